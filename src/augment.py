@@ -0,0 +1,226 @@
+"""Batched tensor augmentations applied on the device."""
+
+import torch
+import torch.nn as nn
+
+# NOTE: Transforms whose output depends only on the input
+DETERMINISTIC_TRANSFORMS = ("Resize",)
+
+
+def split_deterministic_prefix(transform: dict) -> tuple:
+    """Splits the transforms into the leading deterministic part and the rest.
+
+    Args:
+        transform (dict): Serialized albumentations Compose.
+
+    Returns:
+        tuple: (prefix, suffix) lists of serialized transforms.
+    """
+    transforms = transform["transforms"]
+
+    prefix_length = 0
+    while (
+        prefix_length < len(transforms)
+        and transforms[prefix_length]["__class_fullname__"] in DETERMINISTIC_TRANSFORMS
+    ):
+        prefix_length += 1
+
+    return transforms[:prefix_length], transforms[prefix_length:]
+
+
+def split_device_transforms(transform: dict) -> tuple:
+    """Splits the transforms into the CPU and the device part.
+
+    The deterministic prefix stays on CPU so that samples have equal sizes
+    and can be batched, everything else runs batched on the device.
+
+    Args:
+        transform (dict): Serialized albumentations Compose.
+
+    Returns:
+        tuple: (cpu_transform, device_transforms). The CPU part is a serialized
+            Compose that ends with ToTensorV2, the device part is a list.
+    """
+    prefix, suffix = split_deterministic_prefix(transform)
+
+    if not prefix:
+        raise ValueError(
+            "Device augmentation requires a leading Resize so that samples can be batched."
+        )
+
+    cpu_transform = {
+        **transform,
+        "transforms": prefix + [{"__class_fullname__": "ToTensorV2"}],
+    }
+    device_transforms = [t for t in suffix if t["__class_fullname__"] != "ToTensorV2"]
+
+    return cpu_transform, device_transforms
+
+
+def get_limits(limit: float | list) -> tuple:
+    """Converts an albumentations limit to a (low, high) range."""
+    if isinstance(limit, (list, tuple)):
+        return tuple(limit)
+    return -limit, limit
+
+
+class RandomCrop(nn.Module):
+    """Crops every sample of the batch at its own random position."""
+
+    def __init__(self, height: int, width: int, **kwargs) -> None:
+        super().__init__()
+        self.height, self.width = int(height), int(width)
+
+    def forward(self, images: torch.Tensor, masks: torch.Tensor) -> tuple:
+        """Same as torch.nn.Module.forward"""
+        batch_size, _, height, width = images.shape
+        if self.height > height or self.width > width:
+            raise ValueError(
+                f"Crop size ({self.height}, {self.width}) exceeds image size ({height}, {width})."
+            )
+
+        # NOTE: Offsets are drawn on CPU to avoid device synchronizations
+        tops = torch.randint(0, height - self.height + 1, (batch_size,)).tolist()
+        lefts = torch.randint(0, width - self.width + 1, (batch_size,)).tolist()
+
+        images = torch.stack(
+            [
+                image[:, top : top + self.height, left : left + self.width]
+                for image, top, left in zip(images, tops, lefts)
+            ]
+        )
+        masks = torch.stack(
+            [
+                mask[top : top + self.height, left : left + self.width]
+                for mask, top, left in zip(masks, tops, lefts)
+            ]
+        )
+
+        return images, masks
+
+
+class RandomFlip(nn.Module):
+    """Flips every sample of the batch with probability p."""
+
+    def __init__(self, dim: int, p: float = 0.5, **kwargs) -> None:
+        super().__init__()
+        self.dim, self.p = dim, p
+
+    def forward(self, images: torch.Tensor, masks: torch.Tensor) -> tuple:
+        """Same as torch.nn.Module.forward"""
+        apply = torch.rand(images.shape[0], device=images.device) < self.p
+
+        images = torch.where(apply[:, None, None, None], images.flip(self.dim), images)
+        masks = torch.where(apply[:, None, None], masks.flip(self.dim), masks)
+
+        return images, masks
+
+
+class RandomBrightnessContrast(nn.Module):
+    """Changes brightness and contrast of every sample with probability p."""
+
+    def __init__(
+        self,
+        brightness_limit: float | list = 0.2,
+        contrast_limit: float | list = 0.2,
+        brightness_by_max: bool = True,
+        p: float = 0.5,
+        **kwargs,
+    ) -> None:
+        super().__init__()
+        self.brightness_limit = get_limits(brightness_limit)
+        self.contrast_limit = get_limits(contrast_limit)
+        self.brightness_by_max = brightness_by_max
+        self.p = p
+
+    def forward(self, images: torch.Tensor, masks: torch.Tensor) -> tuple:
+        """Same as torch.nn.Module.forward"""
+        batch_size, device = images.shape[0], images.device
+        images = images.float()
+
+        apply = torch.rand(batch_size, 1, 1, 1, device=device) < self.p
+        alpha = torch.empty(batch_size, 1, 1, 1, device=device).uniform_(
+            1 + self.contrast_limit[0], 1 + self.contrast_limit[1]
+        )
+        beta = torch.empty(batch_size, 1, 1, 1, device=device).uniform_(
+            *self.brightness_limit
+        )
+
+        if self.brightness_by_max:
+            beta = beta * 255.0
+        else:
+            beta = beta * images.mean(dim=(1, 2, 3), keepdim=True)
+
+        alpha = torch.where(apply, alpha, torch.ones_like(alpha))
+        beta = torch.where(apply, beta, torch.zeros_like(beta))
+
+        return (images * alpha + beta).clamp_(0.0, 255.0), masks
+
+
+class Normalize(nn.Module):
+    """Normalizes the batch the same way as albumentations.Normalize."""
+
+    def __init__(
+        self,
+        mean: list,
+        std: list,
+        max_pixel_value: float = 255.0,
+        **kwargs,
+    ) -> None:
+        super().__init__()
+        mean = torch.tensor(mean, dtype=torch.float32) * max_pixel_value
+        std = torch.tensor(std, dtype=torch.float32) * max_pixel_value
+
+        self.register_buffer("mean", mean.view(1, -1, 1, 1), persistent=False)
+        self.register_buffer("std", std.view(1, -1, 1, 1), persistent=False)
+
+    def forward(self, images: torch.Tensor, masks: torch.Tensor) -> tuple:
+        """Same as torch.nn.Module.forward"""
+        return (images.float() - self.mean) / self.std, masks
+
+
+class BatchAugmentation(nn.Module):
+    """Applies a list of serialized albumentations transforms to a batch on its device.
+
+    Images are expected as (N, C, H, W) uint8 tensors and masks as (N, H, W).
+    If the pipeline has no Normalize, images are returned as uint8 again.
+    """
+
+    def __init__(self, transforms: list) -> None:
+        """Initializes the batched transforms.
+
+        Args:
+            transforms (list): Serialized albumentations transforms.
+        """
+        super().__init__()
+
+        self.transforms = nn.ModuleList()
+        for transform in transforms:
+            name = transform["__class_fullname__"]
+            params = {k: v for k, v in transform.items() if k != "__class_fullname__"}
+
+            if name == "RandomCrop":
+                self.transforms.append(RandomCrop(**params))
+            elif name == "HorizontalFlip":
+                self.transforms.append(RandomFlip(dim=-1, **params))
+            elif name == "VerticalFlip":
+                self.transforms.append(RandomFlip(dim=-2, **params))
+            elif name == "RandomBrightnessContrast":
+                self.transforms.append(RandomBrightnessContrast(**params))
+            elif name == "Normalize":
+                self.transforms.append(Normalize(**params))
+            else:
+                raise ValueError(f"Unsupported device transform: {name}")
+
+        self.normalized = any(isinstance(t, Normalize) for t in self.transforms)
+
+    @torch.no_grad()
+    def forward(self, images: torch.Tensor, masks: torch.Tensor) -> tuple:
+        """Same as torch.nn.Module.forward"""
+        for transform in self.transforms:
+            images, masks = transform(images, masks)
+
+        if not self.normalized and images.dtype != torch.uint8:
+            images = images.round_().to(torch.uint8)
+
+        return images, masks
@@ -0,0 +1,424 @@
+"""Benchmarks for the data and prediction pipelines"""
+
+import itertools
+import json
+import os
+import platform
+import subprocess
+import time
+from copy import deepcopy
+from typing import Callable
+
+import albumentations as A
+import cv2
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, default_collate
+
+import settings
+from augment import (
+    BatchAugmentation,
+    split_deterministic_prefix,
+    split_device_transforms,
+)
+from data import LabelEncoder, SegmentationDataModule
+from utils import get_console_logger, load_config, parse_benchmark_args
+
+
+def measure(fn: Callable, repeats: int) -> dict:
+    """Measure the wall time of a function.
+
+    Args:
+        fn (Callable): Function without arguments to measure.
+        repeats (int): Number of measured runs.
+
+    Returns:
+        dict: Best and mean time of a single run in seconds.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    return {"best": min(timings), "mean": sum(timings) / len(timings)}
+
+
+def encode_label_loop(label: np.ndarray) -> np.ndarray:
+    """Reference per-class label encoding used before LabelEncoder.
+
+    Args:
+        label (np.ndarray): BGR label of shape (H, W, 3).
+
+    Returns:
+        np.ndarray: Encoded label.
+    """
+    height, width = label.shape[:2]
+
+    label = label.reshape(-1, 3)
+
+    encoded_label = np.zeros((height, width), dtype=np.long)
+    for class_idx, (class_name, pixel_value) in enumerate(
+        settings.CLASS_ENCODING.items()
+    ):
+        encoded_class = np.all(label == pixel_value, axis=1, keepdims=True)
+        encoded_class = encoded_class.reshape(height, width)
+
+        encoded_label[encoded_class] = class_idx
+
+    return encoded_label
+
+
+def benchmark_label_encoding(height: int, width: int, repeats: int) -> dict:
+    """Compare the per-class loop with the lookup-table label encoder.
+
+    Args:
+        height (int): Height of the synthetic label.
+        width (int): Width of the synthetic label.
+        repeats (int): Number of measured runs.
+
+    Returns:
+        dict: Timings of both implementations.
+    """
+    rng = np.random.default_rng(0)
+    colours = np.array(list(settings.CLASS_ENCODING.values()), dtype=np.uint8)
+    label = colours[rng.integers(0, len(colours), size=(height, width))]
+
+    encoder = LabelEncoder()
+
+    if not np.array_equal(encode_label_loop(label), encoder(label)):
+        raise RuntimeError("LabelEncoder output differs from the reference loop.")
+
+    return {
+        "loop": measure(lambda: encode_label_loop(label), repeats),
+        "lut": measure(lambda: encoder(label), repeats),
+    }
+
+
+def benchmark_augmentation(
+    transform: dict, batch_size: int, repeats: int, device: str
+) -> dict:
+    """Compare per-sample albumentations with batched device augmentation.
+
+    Only the transforms after the deterministic prefix are measured, as the
+    prefix runs on CPU workers in both cases.
+
+    Args:
+        transform (dict): Serialized albumentations Compose of the training split.
+        batch_size (int): Number of samples in a batch.
+        repeats (int): Number of measured batches.
+        device (str): Device for the batched augmentation.
+
+    Returns:
+        dict: Timings of a batch and throughput of both implementations.
+    """
+    prefix, suffix = split_deterministic_prefix(transform)
+    _, device_transforms = split_device_transforms(transform)
+
+    height, width = prefix[-1]["height"], prefix[-1]["width"]
+
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, size=(batch_size, height, width, 3), dtype=np.uint8)
+    masks = rng.integers(0, 8, size=(batch_size, height, width), dtype=np.uint8)
+
+    albumentations_transform = A.from_dict(
+        {"transform": {**transform, "transforms": suffix}}
+    )
+    batch_augmentation = BatchAugmentation(device_transforms).to(device)
+
+    def albumentations_batch():
+        samples = []
+        for image, mask in zip(images, masks):
+            augmented = albumentations_transform(image=image, mask=mask)
+            samples.append((augmented["image"], augmented["mask"]))
+        batch = default_collate(samples)
+        return [tensor.to(device) for tensor in batch]
+
+    def device_batch():
+        batch = (
+            torch.from_numpy(images).permute(0, 3, 1, 2).to(device),
+            torch.from_numpy(masks).to(device),
+        )
+        batch = batch_augmentation(*batch)
+        if device.startswith("cuda"):
+            torch.cuda.synchronize()
+        return batch
+
+    # Warm-up
+    albumentations_batch()
+    device_batch()
+
+    results = {
+        "albumentations": measure(albumentations_batch, repeats),
+        "device": measure(device_batch, repeats),
+    }
+    for timing in results.values():
+        timing["samples_per_second"] = batch_size / timing["mean"]
+
+    return results
+
+
+def profile_stages(dataset, num_samples: int, batch_size: int) -> dict:
+    """Time the stages of sample loading from PNG files in the main process.
+
+    Args:
+        dataset (CustomTrainDataset | CustomValDataset): Dataset of the split.
+        num_samples (int): Number of profiled frames.
+        batch_size (int): Number of samples in a collated batch.
+
+    Returns:
+        dict: Mean milliseconds per sample of every stage and per batch of collate.
+    """
+    pairs = list(dict.fromkeys((sample[0], sample[1]) for sample in dataset.samples))
+    pairs = pairs[:num_samples]
+
+    timings = {"read": [], "decode": [], "encode": [], "transform": []}
+    outputs = []
+
+    for image_path, label_path in pairs:
+        start = time.perf_counter()
+        image_bytes = np.fromfile(image_path, dtype=np.uint8)
+        label_bytes = np.fromfile(label_path, dtype=np.uint8)
+        timings["read"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        image = cv2.imdecode(image_bytes, cv2.IMREAD_COLOR)
+        label = cv2.imdecode(label_bytes, cv2.IMREAD_COLOR)
+        timings["decode"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        label = dataset.label_encoder(label)
+        timings["encode"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        if dataset.prefix_transform is not None:
+            augmented = dataset.prefix_transform(image=image, mask=label)
+            image, label = augmented["image"], augmented["mask"]
+        augmented = dataset.transform(image=image, mask=label)
+        timings["transform"].append(time.perf_counter() - start)
+
+        outputs.append((augmented["image"], augmented["mask"]))
+
+    # NOTE: Frames are repeated to fill a batch if the profile is smaller
+    batch = list(itertools.islice(itertools.cycle(outputs), batch_size))
+    collate = measure(lambda: default_collate(batch), repeats=5)
+
+    stages = {
+        name: 1000 * sum(values) / len(values) for name, values in timings.items()
+    }
+    stages["collate_per_batch"] = 1000 * collate["mean"]
+
+    return {"samples": len(pairs), "milliseconds": stages}
+
+
+def measure_dataloader(dataloader: DataLoader, num_batches: int) -> dict:
+    """Measure throughput of a dataloader, restarting it until enough batches are read.
+
+    Args:
+        dataloader (DataLoader): Data loader to measure.
+        num_batches (int): Number of measured batches.
+
+    Returns:
+        dict: Time to the first batch, total time and samples per second.
+    """
+    samples, batches = 0, 0
+    first_batch_seconds = None
+
+    start = time.perf_counter()
+    while batches < num_batches:
+        pass_batches = batches
+        for images, _ in dataloader:
+            if first_batch_seconds is None:
+                first_batch_seconds = time.perf_counter() - start
+
+            samples += len(images)
+            batches += 1
+            if batches == num_batches:
+                break
+
+        # NOTE: E.g. drop_last with fewer samples than batch_size yields nothing
+        if batches == pass_batches:
+            break
+
+    seconds = time.perf_counter() - start
+
+    return {
+        "batches": batches,
+        "samples": samples,
+        "seconds": seconds,
+        "first_batch_seconds": first_batch_seconds,
+        "samples_per_second": samples / seconds if batches else 0.0,
+    }
+
+
+def benchmark_dataloader(
+    data_config: dict,
+    split: str,
+    num_workers: int,
+    pin_memory: bool,
+    cache_backend: str,
+    shared_max_bytes: int,
+    num_batches: int,
+) -> dict:
+    """Measure a dataloader of SegmentationDataModule with the given settings.
+
+    Args:
+        data_config (dict): Configuration for the data module.
+        split (str): "train" or "val".
+        num_workers (int): Number of dataloader workers.
+        pin_memory (bool): Pin batches in page-locked memory.
+        cache_backend (str): Cache backend of the split.
+        shared_max_bytes (int): Arena size if the backend is shared.
+        num_batches (int): Number of measured batches.
+
+    Returns:
+        dict: Settings and throughput of the run.
+    """
+    data_config = deepcopy(data_config)
+    data_config[split]["num_workers"] = num_workers
+    data_config[split]["pin_memory"] = pin_memory
+    data_config[split]["cache"] = {
+        **data_config[split]["cache"],
+        "backend": cache_backend,
+    }
+    if cache_backend == "shared":
+        data_config[split]["cache"]["max_bytes"] = shared_max_bytes
+
+    data_module = SegmentationDataModule(data_config)
+    data_module.setup("fit")
+
+    if split == "train":
+        dataloader = data_module.train_dataloader()
+    else:
+        dataloader = data_module.val_dataloader()
+
+    result = measure_dataloader(dataloader, num_batches)
+
+    dataset = getattr(data_module, f"{split}_dataset")
+    stats = dataset.cache.stats.as_dict(reset=True)
+
+    # NOTE: Shuts down persistent workers before the shared arena is removed
+    del dataloader
+    if hasattr(dataset.cache, "close"):
+        dataset.cache.close()
+
+    return {
+        "split": split,
+        "num_workers": num_workers,
+        "pin_memory": pin_memory,
+        "cache_backend": cache_backend,
+        "cache": stats,
+        **result,
+    }
+
+
+def get_commit() -> str | None:
+    """Get the current git commit to label the results, None outside of a repository."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+
+    console_logger = get_console_logger("BenchmarkLogger")
+
+    args = parse_benchmark_args()
+
+    if args.benchmark == "label_encoding":
+        results = benchmark_label_encoding(args.height, args.width, args.repeats)
+
+        for name, timing in results.items():
+            console_logger.info(
+                f"{name}: best {timing['best'] * 1000:.1f} ms, mean {timing['mean'] * 1000:.1f} ms"
+            )
+        console_logger.info(
+            f"Speedup: x{results['loop']['best'] / results['lut']['best']:.1f}"
+        )
+    elif args.benchmark == "augmentation":
+        config = load_config(args.config)
+        device = args.device or ("cuda" if torch.cuda.is_available() else "cpu")
+
+        results = benchmark_augmentation(
+            config["data"]["train"]["transform"],
+            args.batch_size,
+            args.repeats,
+            device,
+        )
+
+        for name, timing in results.items():
+            console_logger.info(
+                f"{name}: mean {timing['mean'] * 1000:.1f} ms/batch, "
+                f"{timing['samples_per_second']:.1f} samples/s"
+            )
+    elif args.benchmark == "dataloader":
+        # NOTE: pin_memory has no effect without CUDA, its runs would only repeat
+        #       the unpinned ones
+        pin_memory_values = args.pin_memory
+        if not torch.cuda.is_available() and "true" in pin_memory_values:
+            console_logger.warning(
+                "CUDA is not available, pin_memory is not swept and stays false."
+            )
+            pin_memory_values = ["false"]
+
+        config = load_config(args.config)
+        data_config = config["data"]
+
+        stages = {}
+        data_module = SegmentationDataModule(data_config)
+        data_module.setup("fit")
+        for split in args.splits:
+            stages[split] = profile_stages(
+                getattr(data_module, f"{split}_dataset"),
+                args.profile_samples,
+                data_config[split]["batch_size"],
+            )
+            console_logger.info(
+                f"{split} stages, ms: "
+                + ", ".join(
+                    f"{name} {value:.2f}"
+                    for name, value in stages[split]["milliseconds"].items()
+                )
+            )
+        del data_module
+
+        runs = []
+        for split, num_workers, pin_memory, cache_backend in itertools.product(
+            args.splits, args.num_workers, pin_memory_values, args.cache_backends
+        ):
+            run = benchmark_dataloader(
+                data_config,
+                split,
+                num_workers,
+                pin_memory == "true",
+                cache_backend,
+                args.shared_max_bytes,
+                args.batches,
+            )
+            runs.append(run)
+
+            console_logger.info(
+                f"{split}: num_workers {num_workers}, pin_memory {pin_memory}, "
+                f"cache {cache_backend}: {run['samples_per_second']:.1f} samples/s, "
+                f"first batch {run['first_batch_seconds'] or 0:.2f} s"
+            )
+
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "commit": get_commit(),
+                    "config": args.config,
+                    "platform": platform.platform(),
+                    "num_cpus": os.cpu_count(),
+                    "torch": torch.__version__,
+                    "stages": stages,
+                    "runs": runs,
+                },
+                f,
+                indent=2,
+            )
+
+        console_logger.info(f"Results are written to {args.output}")
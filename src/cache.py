@@ -0,0 +1,566 @@
+"""Sample cache backends for the datasets."""
+
+import fcntl
+import hashlib
+import json
+import mmap
+import multiprocessing as mp
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+
+def build_cache(
+    cache_config: dict, num_keys: int
+) -> "NullCache | MemoryCache | ClockCache | SharedMemoryCache":
+    """Initialize the cache backend based on the provided configuration.
+
+    Args:
+        cache_config (dict): Configuration for the cache. None keeps the unbounded in-process cache.
+        num_keys (int): Number of distinct keys that can be cached.
+
+    Returns:
+        NullCache | MemoryCache | ClockCache | SharedMemoryCache: Initialized cache.
+    """
+    if not cache_config:
+        return MemoryCache()
+
+    backend = cache_config["backend"]
+    if backend == "none":
+        return NullCache()
+    elif backend == "memory":
+        policy = cache_config.get("policy", "lru")
+        if policy == "lru":
+            return MemoryCache(max_bytes=cache_config.get("max_bytes"))
+        elif policy == "clock":
+            if not cache_config.get("max_bytes"):
+                raise ValueError("CLOCK policy requires `max_bytes` to be set.")
+            return ClockCache(max_bytes=cache_config["max_bytes"])
+        else:
+            raise ValueError(f"Unsupported cache policy: {policy}")
+    elif backend == "shared":
+        if not cache_config.get("max_bytes"):
+            raise ValueError("Shared cache requires `max_bytes` to be set.")
+
+        return SharedMemoryCache(
+            num_keys=num_keys,
+            max_bytes=cache_config["max_bytes"],
+            directory=cache_config.get("directory"),
+        )
+    else:
+        raise ValueError(f"Unsupported cache backend: {backend}")
+
+
+def get_nbytes(value: tuple) -> int:
+    """Gets the size of a cached tuple of arrays in bytes."""
+    return sum(array.nbytes for array in value)
+
+
+class CacheStats:
+    """Hit, miss and eviction counters shared with DataLoader workers.
+
+    Counters live in shared memory created in the main process, so the
+    numbers reported there include the lookups done by every worker.
+    """
+
+    FIELDS = ("hits", "misses", "evictions")
+
+    def __init__(self) -> None:
+        self._counters = mp.Array("q", len(self.FIELDS))
+
+    def increment(self, field: str, value: int = 1) -> None:
+        """Increments a counter.
+
+        Args:
+            field (str): Name of the counter.
+            value (int, optional): Increment. Defaults to 1.
+        """
+        with self._counters.get_lock():
+            self._counters[self.FIELDS.index(field)] += value
+
+    def as_dict(self, reset: bool = False) -> dict:
+        """Gets the counters.
+
+        Args:
+            reset (bool, optional): Reset the counters after reading. Defaults to False.
+
+        Returns:
+            dict: Counters by name.
+        """
+        with self._counters.get_lock():
+            stats = dict(zip(self.FIELDS, self._counters[:]))
+            if reset:
+                self._counters[:] = [0] * len(self.FIELDS)
+        return stats
+
+
+class NullCache:
+    """Cache that never stores anything."""
+
+    def __init__(self) -> None:
+        self.stats = CacheStats()
+
+    def get(self, key: int) -> tuple | None:
+        """Always misses."""
+        self.stats.increment("misses")
+        return None
+
+    def put(self, key: int, value: tuple) -> bool:
+        """Drops the value."""
+        return False
+
+    def discard(self, key: int) -> None:
+        """Nothing to remove."""
+
+
+class MemoryCache:
+    """In-process cache with an optional byte budget and LRU eviction.
+
+    Every DataLoader worker holds its own instance, so the budget applies
+    per process.
+    """
+
+    def __init__(self, max_bytes: int = None) -> None:
+        """Initializes the cache.
+
+        Args:
+            max_bytes (int, optional): Byte budget of the cache. Defaults to None (unbounded).
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.stats = CacheStats()
+
+        self._data = OrderedDict()
+
+    def get(self, key: int) -> tuple | None:
+        """Gets a cached tuple of arrays.
+
+        Args:
+            key (int): Key of the sample.
+
+        Returns:
+            tuple | None: Cached arrays or None if the key is missing.
+        """
+        value = self._data.get(key)
+        if value is None:
+            self.stats.increment("misses")
+            return None
+
+        self._data.move_to_end(key)
+        self.stats.increment("hits")
+        return value
+
+    def put(self, key: int, value: tuple) -> bool:
+        """Stores a tuple of arrays, evicting the least recently used ones if needed.
+
+        Args:
+            key (int): Key of the sample.
+            value (tuple): Arrays to cache.
+
+        Returns:
+            bool: Whether the value was stored.
+        """
+        nbytes = get_nbytes(value)
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            return False
+
+        if key in self._data:
+            self.nbytes -= get_nbytes(self._data.pop(key))
+
+        evictions = 0
+        while self.max_bytes is not None and self.nbytes + nbytes > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.nbytes -= get_nbytes(evicted)
+            evictions += 1
+
+        if evictions:
+            self.stats.increment("evictions", evictions)
+
+        self._data[key] = value
+        self.nbytes += nbytes
+        return True
+
+    def discard(self, key: int) -> None:
+        """Removes a key if it is cached.
+
+        Args:
+            key (int): Key of the sample.
+        """
+        if key in self._data:
+            self.nbytes -= get_nbytes(self._data.pop(key))
+
+
+class ClockCache:
+    """In-process cache with a byte budget and CLOCK (second chance) eviction.
+
+    Hits only set a reference bit instead of reordering entries, which makes
+    lookups cheaper than LRU while keeping a similar hit rate.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        """Initializes the cache.
+
+        Args:
+            max_bytes (int): Byte budget of the cache.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.stats = CacheStats()
+
+        self._data = {}
+        self._referenced = {}
+        self._ring = []
+        self._hand = 0
+
+    def get(self, key: int) -> tuple | None:
+        """Gets a cached tuple of arrays.
+
+        Args:
+            key (int): Key of the sample.
+
+        Returns:
+            tuple | None: Cached arrays or None if the key is missing.
+        """
+        value = self._data.get(key)
+        if value is None:
+            self.stats.increment("misses")
+            return None
+
+        self._referenced[key] = True
+        self.stats.increment("hits")
+        return value
+
+    def _evict(self) -> None:
+        """Advances the clock hand until an unreferenced entry is evicted."""
+        while True:
+            self._hand %= len(self._ring)
+            key = self._ring[self._hand]
+
+            if self._referenced[key]:
+                self._referenced[key] = False
+                self._hand += 1
+                continue
+
+            self._ring.pop(self._hand)
+            del self._referenced[key]
+            self.nbytes -= get_nbytes(self._data.pop(key))
+            return
+
+    def put(self, key: int, value: tuple) -> bool:
+        """Stores a tuple of arrays, evicting entries if needed.
+
+        Args:
+            key (int): Key of the sample.
+            value (tuple): Arrays to cache.
+
+        Returns:
+            bool: Whether the value was stored.
+        """
+        nbytes = get_nbytes(value)
+        if nbytes > self.max_bytes or key in self._data:
+            return key in self._data
+
+        evictions = 0
+        while self.nbytes + nbytes > self.max_bytes:
+            self._evict()
+            evictions += 1
+
+        if evictions:
+            self.stats.increment("evictions", evictions)
+
+        self._data[key] = value
+        self._referenced[key] = False
+        self._ring.insert(self._hand, key)
+        self._hand += 1
+        self.nbytes += nbytes
+        return True
+
+    def discard(self, key: int) -> None:
+        """Removes a key if it is cached.
+
+        Args:
+            key (int): Key of the sample.
+        """
+        if key not in self._data:
+            return
+
+        index = self._ring.index(key)
+        self._ring.pop(index)
+        if index < self._hand:
+            self._hand -= 1
+
+        del self._referenced[key]
+        self.nbytes -= get_nbytes(self._data.pop(key))
+
+
+class SharedMemoryCache:
+    """Cache stored once in a memory-mapped arena shared by all processes.
+
+    The arena is a file in POSIX shared memory (/dev/shm) made of a fixed index
+    with one record per key followed by the array data. Space is reserved by a
+    bump allocator under a file lock, so every DataLoader worker can add and
+    read samples without duplicating them. Once the arena is full, new samples
+    are no longer cached, so nothing is ever evicted.
+
+    Record layout (int64): state, number of arrays and, for every array,
+    offset, dtype code, ndim and up to MAX_DIMS dimensions.
+    """
+
+    EMPTY, WRITING, READY = 0, 1, 2
+
+    DTYPES = (np.uint8, np.int64, np.float32, np.float16, np.int32, np.uint16)
+    MAX_ARRAYS = 2
+    MAX_DIMS = 4
+    ARRAY_FIELDS = 3 + MAX_DIMS
+    RECORD_SIZE = 2 + MAX_ARRAYS * ARRAY_FIELDS
+    ALIGNMENT = 64
+
+    def __init__(self, num_keys: int, max_bytes: int, directory: str = None) -> None:
+        """Creates the arena file.
+
+        Args:
+            num_keys (int): Number of distinct keys that can be cached.
+            max_bytes (int): Capacity of the data region in bytes.
+            directory (str, optional): Directory for the arena file. Defaults to /dev/shm if available.
+        """
+        if directory is None:
+            directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+        self.num_keys = num_keys
+        self.max_bytes = int(max_bytes)
+
+        # NOTE: Record 0 is the header holding the allocator position
+        index_bytes = (num_keys + 1) * self.RECORD_SIZE * 8
+        self._data_offset = -(-index_bytes // self.ALIGNMENT) * self.ALIGNMENT
+
+        fd, self.path = tempfile.mkstemp(
+            prefix="uavid_cache_", suffix=".arena", dir=directory
+        )
+        os.ftruncate(fd, self._data_offset + self.max_bytes)
+        os.close(fd)
+
+        self._owner_pid = os.getpid()
+        self._pid = None
+
+        self.stats = CacheStats()
+
+    def __getstate__(self) -> dict:
+        """Drops the process-local file handles."""
+        state = self.__dict__.copy()
+        for key in ("_file", "_mmap", "_index"):
+            state.pop(key, None)
+        state["_pid"] = None
+        return state
+
+    def _open(self) -> None:
+        """Maps the arena into the current process.
+
+        File handles are reopened after a fork, so that file locks
+        are not shared between the processes.
+        """
+        if self._pid == os.getpid():
+            return
+
+        self._file = open(self.path, "r+b")
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self._index = np.frombuffer(
+            self._mmap, dtype=np.int64, count=(self.num_keys + 1) * self.RECORD_SIZE
+        ).reshape(self.num_keys + 1, self.RECORD_SIZE)
+        self._pid = os.getpid()
+
+    def get(self, key: int) -> tuple | None:
+        """Gets a cached tuple of arrays as views of the arena.
+
+        Args:
+            key (int): Key of the sample.
+
+        Returns:
+            tuple | None: Cached arrays or None if the key is missing.
+        """
+        self._open()
+
+        record = self._index[key + 1]
+        if record[0] != self.READY:
+            self.stats.increment("misses")
+            return None
+
+        self.stats.increment("hits")
+
+        arrays = []
+        for i in range(record[1]):
+            start = 2 + i * self.ARRAY_FIELDS
+            offset, dtype_code, ndim, *dims = record[start : start + self.ARRAY_FIELDS]
+            shape = tuple(dims[:ndim])
+            arrays.append(
+                np.frombuffer(
+                    self._mmap,
+                    dtype=self.DTYPES[dtype_code],
+                    count=int(np.prod(shape)),
+                    offset=self._data_offset + int(offset),
+                ).reshape(shape)
+            )
+
+        return tuple(arrays)
+
+    def put(self, key: int, value: tuple) -> bool:
+        """Copies a tuple of arrays into the arena.
+
+        Args:
+            key (int): Key of the sample.
+            value (tuple): Arrays to cache.
+
+        Returns:
+            bool: Whether the value is stored in the arena.
+        """
+        self._open()
+
+        if len(value) > self.MAX_ARRAYS:
+            raise ValueError(f"At most {self.MAX_ARRAYS} arrays can be cached per key.")
+
+        arrays = [np.ascontiguousarray(array) for array in value]
+        for array in arrays:
+            if array.ndim > self.MAX_DIMS:
+                raise ValueError(f"At most {self.MAX_DIMS} dimensions are supported.")
+            if array.dtype.type not in self.DTYPES:
+                raise ValueError(f"Unsupported dtype for shared cache: {array.dtype}")
+        sizes = [
+            -(-array.nbytes // self.ALIGNMENT) * self.ALIGNMENT for array in arrays
+        ]
+
+        header, record = self._index[0], self._index[key + 1]
+
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            if record[0] != self.EMPTY:
+                return record[0] == self.READY
+
+            offset = int(header[0])
+            if offset + sum(sizes) > self.max_bytes:
+                return False
+
+            header[0] = offset + sum(sizes)
+            record[0] = self.WRITING
+        finally:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+        record[1] = len(arrays)
+        for i, (array, size) in enumerate(zip(arrays, sizes)):
+            np.frombuffer(
+                self._mmap,
+                dtype=array.dtype,
+                count=array.size,
+                offset=self._data_offset + offset,
+            )[:] = array.ravel()
+
+            dims = list(array.shape) + [0] * (self.MAX_DIMS - array.ndim)
+            start = 2 + i * self.ARRAY_FIELDS
+            record[start : start + self.ARRAY_FIELDS] = [
+                offset,
+                self.DTYPES.index(array.dtype.type),
+                array.ndim,
+                *dims,
+            ]
+            offset += size
+
+        record[0] = self.READY
+        return True
+
+    def discard(self, key: int) -> None:
+        """Keeps the key, arena space is never reused and the entry is shared by all workers.
+
+        Args:
+            key (int): Key of the sample.
+        """
+
+    def close(self) -> None:
+        """Removes the arena file if it was created by this process."""
+        if os.getpid() == self._owner_pid and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __del__(self) -> None:
+        """Ensure the arena file is removed when the cache is destroyed."""
+        self.close()
+
+
+class DiskCache:
+    """Persistent cache of samples after the deterministic transforms.
+
+    Entries are .npy files keyed by the source paths, their modification
+    times, the serialized transforms (target size, interpolation, ...) and
+    the label encoding, so changing the data, the transforms, the classes or
+    the ignore index invalidates them.
+    """
+
+    def __init__(
+        self, cache_dir: str, transforms: list, label_encoding: dict = None
+    ) -> None:
+        """Initializes the cache.
+
+        Args:
+            cache_dir (str): Directory for the cached samples.
+            transforms (list): Serialized transforms applied before caching.
+            label_encoding (dict, optional): Settings of the label encoder applied
+                before caching, see LabelEncoder.get_config. Defaults to None.
+        """
+        self.cache_dir = cache_dir
+        self.transforms_key = json.dumps([transforms, label_encoding], sort_keys=True)
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_filepaths(self, image_path: str, label_path: str) -> tuple:
+        """Gets paths of the cached image and label.
+
+        Args:
+            image_path (str): Path to the source image.
+            label_path (str): Path to the source label.
+
+        Returns:
+            tuple: Paths of the cached image and label.
+        """
+        sources = []
+        for path in (image_path, label_path):
+            # NOTE: Sources may be missing if samples are read from shards
+            mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+            sources.append((os.path.abspath(path), mtime))
+
+        key = hashlib.sha1(
+            json.dumps([sources, self.transforms_key]).encode()
+        ).hexdigest()
+
+        return (
+            os.path.join(self.cache_dir, f"{key}.image.npy"),
+            os.path.join(self.cache_dir, f"{key}.label.npy"),
+        )
+
+    def get(self, image_path: str, label_path: str) -> tuple | None:
+        """Gets a cached sample.
+
+        Args:
+            image_path (str): Path to the source image.
+            label_path (str): Path to the source label.
+
+        Returns:
+            tuple | None: Cached (image, label) or None if the sample is missing.
+        """
+        filepaths = self.get_filepaths(image_path, label_path)
+        if not all(os.path.exists(path) for path in filepaths):
+            return None
+
+        return tuple(np.load(path) for path in filepaths)
+
+    def put(self, image_path: str, label_path: str, value: tuple) -> None:
+        """Stores a sample.
+
+        Args:
+            image_path (str): Path to the source image.
+            label_path (str): Path to the source label.
+            value (tuple): Transformed (image, label).
+        """
+        # NOTE: Files are moved into place atomically as workers may write concurrently
+        for path, array in zip(self.get_filepaths(image_path, label_path), value):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
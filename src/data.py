@@ -1,7 +1,15 @@
 """Data modules for segmentation task."""
 
 import glob
+import json
 import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
 from pathlib import Path
 from typing import Iterator
 
@@ -10,10 +18,15 @@ import cv2
 import lightning as L
 import numpy as np
 import torch
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Dataset, Sampler, WeightedRandomSampler
+from tqdm import tqdm
 
 import settings
-from utils import get_console_logger
+from augment import split_deterministic_prefix, split_device_transforms
+from cache import DiskCache, NullCache, SharedMemoryCache, build_cache
+from sampling import ClassIndex, RareClassCropSelector
+from storage import ShardReader, TileReader
+from utils import get_console_logger, get_num_cores
 
 
 def get_png_size(filepath: str) -> tuple:
@@ -25,6 +38,335 @@ def get_png_size(filepath: str) -> tuple:
         return height, width
 
 
+def scan_split_folder(data_split_path: str, patterns: list) -> list:
+    """Lists image and label pairs of a split folder.
+
+    Args:
+        data_split_path (str): Path to the data split folder.
+        patterns (list): Glob patterns of the images relative to the split folder.
+
+    Returns:
+        list: List of (image_path, label_path) tuples.
+    """
+    pairs = []
+
+    for pattern in patterns:
+        for image_path in glob.glob(os.path.join(data_split_path, pattern)):
+            label_path = image_path.replace("/Images/", "/Labels/")
+
+            pairs.append((image_path, label_path))
+
+    return pairs
+
+
+def get_directory_mtimes(directories: list) -> dict:
+    """Gets modification times of directories, None for missing ones."""
+    mtimes = {}
+    for directory in directories:
+        try:
+            mtimes[directory] = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            mtimes[directory] = None
+    return mtimes
+
+
+def load_manifest(manifest_path: str, data_split_path: str, patterns: list) -> list:
+    """Loads samples of a split folder from its manifest, rebuilding it if the folder changed.
+
+    Adding, removing or renaming files changes the modification time of their
+    directory, so the manifest is validated by a stat of every recorded
+    directory instead of listing them again.
+
+    Args:
+        manifest_path (str): Path to the manifest file.
+        data_split_path (str): Path to the data split folder.
+        patterns (list): Glob patterns of the images relative to the split folder.
+
+    Returns:
+        list: List of (image_path, label_path, (height, width)) tuples.
+    """
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+
+        if (
+            manifest["data_split_path"] == data_split_path
+            and manifest["patterns"] == patterns
+            and get_directory_mtimes(manifest["directories"]) == manifest["directories"]
+        ):
+            return [
+                (image_path, label_path, tuple(size))
+                for image_path, label_path, size in manifest["samples"]
+            ]
+
+    samples = [
+        (image_path, label_path, get_png_size(image_path))
+        for image_path, label_path in scan_split_folder(data_split_path, patterns)
+    ]
+
+    # NOTE: Every directory between the split folder and the files is recorded
+    directories = {data_split_path}
+    for image_path, label_path, _ in samples:
+        for path in (image_path, label_path):
+            directory = os.path.dirname(path)
+            while (
+                directory.startswith(data_split_path) and directory not in directories
+            ):
+                directories.add(directory)
+                directory = os.path.dirname(directory)
+
+    manifest = {
+        "data_split_path": data_split_path,
+        "patterns": patterns,
+        "directories": get_directory_mtimes(sorted(directories)),
+        "samples": samples,
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+    return samples
+
+
+# NOTE: Dataset of the warm-up pool worker, set once by the pool initializer
+_warm_up_dataset = None
+
+
+def _init_warm_up_worker(dataset: Dataset) -> None:
+    """Stores the dataset in the warm-up pool worker."""
+    global _warm_up_dataset
+    _warm_up_dataset = dataset
+
+
+def _warm_up_sample(sample: tuple) -> tuple:
+    """Prepares a sample in the warm-up pool worker.
+
+    The shared memory cache is filled by the worker itself, other caches
+    are per process, so the value is sent back to the main process.
+
+    Args:
+        sample (tuple): (image_path, label_path) of the sample.
+
+    Returns:
+        tuple: (key, value, nbytes). The value is None if it is already cached.
+    """
+    dataset = _warm_up_dataset
+    image_path, label_path = sample
+    key = dataset.image_ids[image_path]
+
+    value = dataset.prepare_sample(image_path, label_path)
+    nbytes = sum(array.nbytes for array in value)
+
+    if isinstance(dataset.cache, SharedMemoryCache):
+        dataset.cache.put(key, value)
+        value = None
+
+    return key, value, nbytes
+
+
+def warm_up_cache(dataset: Dataset, num_processes: int = None) -> dict:
+    """Prepares every sample of the dataset in a process pool and fills its cache.
+
+    Args:
+        dataset (Dataset): CustomTrainDataset or CustomValDataset.
+        num_processes (int, optional): Size of the pool. Defaults to the number of available cores.
+
+    Returns:
+        dict: Number of samples, bytes, seconds and cache evictions of the warm-up.
+    """
+    samples = list(dict.fromkeys((sample[0], sample[1]) for sample in dataset.samples))
+    num_processes = min(num_processes or get_num_cores(), max(len(samples), 1))
+
+    start, nbytes = time.perf_counter(), 0
+
+    with Pool(
+        num_processes, initializer=_init_warm_up_worker, initargs=(dataset,)
+    ) as pool:
+        for key, value, sample_nbytes in tqdm(
+            pool.imap_unordered(_warm_up_sample, samples), total=len(samples)
+        ):
+            if value is not None:
+                dataset.cache.put(key, value)
+            nbytes += sample_nbytes
+
+    # NOTE: Counters are reset so that the first epoch reports its own hits
+    stats = dataset.cache.stats.as_dict(reset=True)
+
+    return {
+        "samples": len(samples),
+        "bytes": nbytes,
+        "seconds": time.perf_counter() - start,
+        "evictions": stats["evictions"],
+    }
+
+
+class SliceGroupBatchSampler(Sampler):
+    """Batch sampler that keeps all slices of a frame in one DataLoader worker.
+
+    Frames are split into one stream per worker, balanced by their number of
+    slices. Every stream is cut into the same number of batches and the
+    batches are interleaved, so that DataLoader, which sends batch i to worker
+    i % num_workers, hands each frame to exactly one worker and its slices
+    arrive in order. If the frames cannot fill the same number of batches in
+    every stream, fewer streams are used and num_workers is reduced to match.
+    """
+
+    def __init__(
+        self,
+        samples: list,
+        batch_size: int,
+        num_workers: int = 0,
+    ) -> None:
+        """Initializes the sampler.
+
+        Args:
+            samples (list): Dataset samples, (image_path, label_path, interval) tuples
+                with the slices of every frame stored consecutively.
+            batch_size (int): Number of slices in a batch.
+            num_workers (int, optional): Number of DataLoader workers. Defaults to 0.
+        """
+        self.batch_size = batch_size
+
+        frames = {}
+        for idx, sample in enumerate(samples):
+            frames.setdefault(sample[0], []).append(idx)
+        frames = list(frames.values())
+
+        num_streams = max(num_workers, 1)
+        while True:
+            streams = self.assign_frames(frames, num_streams)
+            num_batches = self.get_num_batches(streams)
+            if num_batches is not None:
+                break
+            num_streams -= 1
+
+        self.num_workers = num_streams if num_workers > 0 else 0
+        self.streams = [self.split_batches(stream, num_batches) for stream in streams]
+
+    @staticmethod
+    def assign_frames(frames: list, num_streams: int) -> list:
+        """Assigns frames to streams, largest first to the stream with the fewest slices.
+
+        Args:
+            frames (list): Sample indices of every frame.
+            num_streams (int): Number of streams.
+
+        Returns:
+            list: Sample indices of every stream, frames in their original order.
+        """
+        streams, sizes = [[] for _ in range(num_streams)], [0] * num_streams
+        for frame_idx in sorted(range(len(frames)), key=lambda i: -len(frames[i])):
+            stream_idx = sizes.index(min(sizes))
+            streams[stream_idx].append(frame_idx)
+            sizes[stream_idx] += len(frames[frame_idx])
+
+        return [
+            [idx for frame_idx in sorted(stream) for idx in frames[frame_idx]]
+            for stream in streams
+        ]
+
+    def get_num_batches(self, streams: list) -> int:
+        """Gets the number of batches that every stream is cut into.
+
+        Args:
+            streams (list): Sample indices of every stream.
+
+        Returns:
+            int: Number of batches, None if a stream has fewer samples than
+                the longest stream has batches.
+        """
+        # NOTE: Shorter streams are cut into smaller batches, every batch needs
+        #       at least one sample
+        num_batches = max(-(-len(stream) // self.batch_size) for stream in streams)
+        if any(len(stream) < num_batches for stream in streams):
+            return None
+
+        return num_batches
+
+    def split_batches(self, indices: list, num_batches: int) -> list:
+        """Cuts the sample indices of a stream into batches of near equal size."""
+        if num_batches == 0:
+            return []
+
+        bounds = [len(indices) * i // num_batches for i in range(num_batches + 1)]
+        return [indices[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def __iter__(self) -> Iterator[list]:
+        """Yields the batches of all streams round-robin."""
+        for batches in zip(*self.streams):
+            yield from batches
+
+    def __len__(self) -> int:
+        """Gets the number of batches."""
+        return sum(len(batches) for batches in self.streams)
+
+
+class LabelEncoder:
+    """Encodes BGR colour labels to class indices with a lookup table.
+
+    Each pixel is packed into a single 24-bit key which is mapped through a
+    precomputed table, so the whole label is encoded in one pass regardless
+    of the number of classes.
+    """
+
+    def __init__(self, class_encoding: dict = None, ignore_index: int = 0) -> None:
+        """Initializes the lookup table for the given class encoding.
+
+        Args:
+            class_encoding (dict, optional): Mapping of class names to BGR pixel values. Defaults to settings.CLASS_ENCODING.
+            ignore_index (int, optional): Index assigned to colours not present in the encoding. Defaults to 0.
+        """
+        class_encoding = class_encoding or settings.CLASS_ENCODING
+
+        if len(class_encoding) > 256:
+            raise ValueError("LabelEncoder supports at most 256 classes.")
+        if not 0 <= ignore_index <= 255:
+            raise ValueError(f"ignore_index must fit into uint8, got {ignore_index}")
+
+        self.class_encoding = class_encoding
+        self.ignore_index = ignore_index
+
+        self.lut = np.full(1 << 24, ignore_index, dtype=np.uint8)
+        for class_idx, pixel_value in enumerate(class_encoding.values()):
+            blue, green, red = pixel_value
+            self.lut[(blue << 16) | (green << 8) | red] = class_idx
+
+    def get_config(self) -> dict:
+        """Gets the serializable settings that determine the encoded labels.
+
+        Returns:
+            dict: Class encoding as lists of BGR values and the ignore index.
+        """
+        return {
+            "class_encoding": {
+                name: list(pixel_value)
+                for name, pixel_value in self.class_encoding.items()
+            },
+            "ignore_index": self.ignore_index,
+        }
+
+    def __call__(self, label: np.ndarray) -> np.ndarray:
+        """Encodes a BGR label.
+
+        Args:
+            label (np.ndarray): Label of shape (H, W, 3) and dtype uint8.
+
+        Returns:
+            np.ndarray: Encoded label of shape (H, W) and dtype uint8.
+        """
+        # NOTE: In-place operations keep a single uint32 temporary alive
+        key = label[..., 0].astype(np.uint32)
+        key <<= 8
+        key |= label[..., 1]
+        key <<= 8
+        key |= label[..., 2]
+
+        return np.take(self.lut, key)
+
+
 class SegmentationDataModule(L.LightningDataModule):
     """Custom lightning data module"""
 
@@ -43,33 +385,52 @@ class SegmentationDataModule(L.LightningDataModule):
         Args:
             stage (str, optional): Stage of the data module. Can be "fit", "test", or None. Defaults to None.
         """
-        image_width, image_height = (
-            self.hparams["image_width"],
-            self.hparams["image_height"],
-        )
         apply_slicing = self.hparams["apply_slicing"]
         slice_width = self.hparams["slice_width"] if apply_slicing else None
         slice_height = self.hparams["slice_height"] if apply_slicing else None
+        # NOTE: Unknown colours are remapped to a class, loss and metrics do not
+        #       ignore any index
+        ignore_index = self.hparams.get("ignore_index", 0)
+        if not 0 <= ignore_index < len(settings.CLASS_ENCODING):
+            raise ValueError(
+                f"data.ignore_index must be a class index below {len(settings.CLASS_ENCODING)}, "
+                f"got {ignore_index}"
+            )
 
         if stage == "fit" or stage is None:
 
             self.train_dataset = CustomTrainDataset(
                 data_split_path=self.hparams["train"]["path"],
+                manifest_path=self.hparams["train"]["manifest_path"],
                 transform_config=self.hparams["train"],
+                ignore_index=ignore_index,
+                shards_path=self.hparams["train"]["shards_path"],
+                tiles_path=self.hparams["train"]["tiles_path"],
+                cache_config=self.hparams["train"]["cache"],
+                augment_on_device=self.hparams["train"]["augment_on_device"],
+                class_index_config=self.hparams["train"]["class_index"],
+                resize_cache_dir=self.hparams["resize_cache_dir"],
             )
 
             self.val_dataset = CustomValDataset(
                 data_split_path=self.hparams["val"]["path"],
+                manifest_path=self.hparams["val"]["manifest_path"],
                 transform_config=self.hparams["val"],
-                image_width=image_width,
-                image_height=image_height,
                 apply_slicing=apply_slicing,
                 slice_width=slice_width,
                 slice_height=slice_height,
+                ignore_index=ignore_index,
+                shards_path=self.hparams["val"]["shards_path"],
+                tiles_path=self.hparams["val"]["tiles_path"],
+                cache_config=self.hparams["val"]["cache"],
+                normalize_on_device=self.hparams["val"]["normalize_on_device"],
+                release_frames=self.hparams["val"]["group_slices"],
+                resize_cache_dir=self.hparams["resize_cache_dir"],
             )
 
             if self.hparams["dry_run"]:
                 # NOTE: If your RAM is limited, you can use only 16 samples for dry run
+                #       or set a `max_bytes` budget in the cache configuration
                 self.train_dataset.samples = self.train_dataset.samples[:16]
                 self.val_dataset.samples = self.val_dataset.samples[:16]
 
@@ -78,28 +439,95 @@ class SegmentationDataModule(L.LightningDataModule):
             #      we will use the same dataset as for validation
             self.test_dataset = CustomValDataset(
                 data_split_path=self.hparams["val"]["path"],
+                manifest_path=self.hparams["val"]["manifest_path"],
                 transform_config=self.hparams["val"],
-                image_width=image_width,
-                image_height=image_height,
                 apply_slicing=apply_slicing,
                 slice_width=slice_width,
                 slice_height=slice_height,
+                ignore_index=ignore_index,
+                shards_path=self.hparams["val"]["shards_path"],
+                tiles_path=self.hparams["val"]["tiles_path"],
+                cache_config=self.hparams["val"]["cache"],
+                normalize_on_device=self.hparams["val"]["normalize_on_device"],
+                release_frames=self.hparams["val"]["group_slices"],
+                resize_cache_dir=self.hparams["resize_cache_dir"],
             )
 
             if self.hparams["dry_run"]:
                 # NOTE: If your RAM is limited, you can use only 16 samples for dry run
                 self.test_dataset.samples = self.test_dataset.samples[:16]
 
+        if self.hparams["warm_up"]["enabled"]:
+            for name in ("train", "val", "test"):
+                if stage in (None, "test" if name == "test" else "fit"):
+                    self.warm_up(name)
+
+    def warm_up(self, name: str) -> None:
+        """Decodes and caches a whole split before the first epoch.
+
+        Args:
+            name (str): Name of the dataset, "train", "val" or "test".
+        """
+        logger = get_console_logger("DataModuleLogger")
+        dataset = getattr(self, f"{name}_dataset")
+
+        # NOTE: Datasets backed by a tile reader decode regions per sample and
+        #       never read the cache
+        if isinstance(dataset.cache, NullCache) or dataset.tile_reader is not None:
+            logger.info(f"Skipping {name} warm-up, the dataset does not cache samples.")
+            return
+
+        result = warm_up_cache(dataset, self.hparams["warm_up"]["num_processes"])
+
+        logger.info(
+            f"Warmed up {name} cache: {result['samples']} samples in {result['seconds']:.1f} s, "
+            f"{result['samples'] / result['seconds']:.1f} samples/s, "
+            f"{result['bytes'] / result['seconds'] / 1024**2:.1f} MB/s"
+        )
+        if result["evictions"]:
+            logger.warning(
+                f"{result['evictions']} {name} samples were evicted during the warm-up, "
+                "increase the cache max_bytes to keep the whole split."
+            )
+
+    def cache_stats(self, stage: str) -> dict:
+        """Gets and resets the cache counters of a dataset.
+
+        Args:
+            stage (str): Stage of the dataset. Can be "train" or "val".
+
+        Returns:
+            dict: Hit, miss and eviction counters. Empty if the dataset is not set up.
+        """
+        dataset = getattr(self, f"{stage}_dataset", None)
+        if dataset is None:
+            return {}
+
+        return dataset.cache.stats.as_dict(reset=True)
+
     def train_dataloader(self) -> DataLoader:
         """Creates the training data loader.
 
         Returns:
             DataLoader: Data loader for the training dataset.
         """
+        sampler = None
+        power = self.hparams["train"]["class_index"]["power"]
+        if self.train_dataset.class_index is not None and power > 0:
+            # NOTE: Frames with rare classes are drawn more often, shuffling is implied
+            sampler = WeightedRandomSampler(
+                self.train_dataset.class_index.get_sample_weights(
+                    self.train_dataset.samples, power
+                ),
+                num_samples=len(self.train_dataset),
+                replacement=True,
+            )
+
         return DataLoader(
             self.train_dataset,
             batch_size=self.hparams["train"]["batch_size"],
-            shuffle=self.hparams["train"]["shuffle"],
+            shuffle=self.hparams["train"]["shuffle"] if sampler is None else False,
+            sampler=sampler,
             num_workers=self.hparams["train"]["num_workers"],
             pin_memory=self.hparams["train"]["pin_memory"],
             persistent_workers=(
@@ -107,14 +535,39 @@ class SegmentationDataModule(L.LightningDataModule):
             ),
         )
 
-    def val_dataloader(self) -> DataLoader:
-        """Creates the validation data loader.
+    def get_val_dataloader(self, dataset: Dataset) -> DataLoader:
+        """Creates a data loader with the validation settings.
+
+        Args:
+            dataset (Dataset): Validation or testing dataset.
 
         Returns:
-            DataLoader: Data loader for the validation dataset.
+            DataLoader: Data loader for the dataset.
         """
+        if self.hparams["val"]["group_slices"]:
+            # NOTE: Slices of a frame are batched in one worker, see SliceGroupBatchSampler.
+            #       The sampler may use fewer workers to keep batches aligned with them
+            if self.hparams["val"]["drop_last"]:
+                raise ValueError(
+                    "val.drop_last is not supported with val.group_slices, dropped "
+                    "slices would keep their frames in the worker caches."
+                )
+
+            batch_sampler = SliceGroupBatchSampler(
+                dataset.samples,
+                batch_size=self.hparams["val"]["batch_size"],
+                num_workers=self.hparams["val"]["num_workers"],
+            )
+            return DataLoader(
+                dataset,
+                batch_sampler=batch_sampler,
+                num_workers=batch_sampler.num_workers,
+                pin_memory=self.hparams["val"]["pin_memory"],
+                persistent_workers=True if batch_sampler.num_workers > 0 else False,
+            )
+
         return DataLoader(
-            self.val_dataset,
+            dataset,
             batch_size=self.hparams["val"]["batch_size"],
             shuffle=self.hparams["val"]["shuffle"],
             num_workers=self.hparams["val"]["num_workers"],
@@ -124,60 +577,160 @@ class SegmentationDataModule(L.LightningDataModule):
             ),
         )
 
+    def val_dataloader(self) -> DataLoader:
+        """Creates the validation data loader.
+
+        Returns:
+            DataLoader: Data loader for the validation dataset.
+        """
+        return self.get_val_dataloader(self.val_dataset)
+
     def test_dataloader(self) -> DataLoader:
         """Creates the testing data loader.
 
         Returns:
             DataLoader: Data loader for the validation* dataset.
         """
-        return DataLoader(
-            self.val_dataset,
-            batch_size=self.hparams["val"]["batch_size"],
-            shuffle=self.hparams["val"]["shuffle"],
-            num_workers=self.hparams["val"]["num_workers"],
-            pin_memory=self.hparams["val"]["pin_memory"],
-            persistent_workers=(
-                True if self.hparams["val"]["num_workers"] > 0 else False
-            ),
-        )
+        return self.get_val_dataloader(self.val_dataset)
 
 
 class CustomTrainDataset(Dataset):
     """Custom dataset for training"""
 
-    def __init__(self, data_split_path: str, transform_config: dict):
+    def __init__(
+        self,
+        data_split_path: str,
+        transform_config: dict,
+        ignore_index: int = 0,
+        shards_path: str = None,
+        tiles_path: str = None,
+        cache_config: dict = None,
+        augment_on_device: bool = False,
+        resize_cache_dir: str = None,
+        manifest_path: str = None,
+        class_index_config: dict = None,
+    ):
         """Initializes the dataset with the given data split path and transform configuration.
 
         Args:
             data_split_path (str): Path to the data split folder.
             transform_config (dict): Configuration for data augmentation transforms.
+            ignore_index (int, optional): Class index for unknown label colours. Defaults to 0.
+            shards_path (str, optional): Path to shards built by src/preprocess.py. Defaults to None.
+            tiles_path (str, optional): Path to tiles built by src/preprocess.py. Defaults to None.
+            cache_config (dict, optional): Configuration for the sample cache. Defaults to None.
+            augment_on_device (bool, optional): Apply only the leading Resize and return uint8
+                tensors, the rest of the transforms is applied by the model. Defaults to False.
+            resize_cache_dir (str, optional): Directory of the persistent cache of samples
+                after the leading Resize. Defaults to None.
+            manifest_path (str, optional): Path to the manifest of the split folder, it is
+                built on first use and rebuilt when the folder changes. Defaults to None.
+            class_index_config (dict, optional): Configuration for the class-frequency index
+                and rare-class-aware crops. Defaults to None.
         """
         super().__init__()
 
-        self.parse_split_folder(data_split_path)
+        self.augment_on_device = augment_on_device
+        self.use_class_index = bool(class_index_config and class_index_config["path"])
+
+        self.label_encoder = LabelEncoder(ignore_index=ignore_index)
+
+        if shards_path and tiles_path:
+            raise ValueError("Set either shards_path or tiles_path, not both.")
+
+        self.shard_reader, self.tile_reader = None, None
+        if shards_path:
+            self.shard_reader = ShardReader(shards_path)
+            self.samples = self.shard_reader.samples
+        elif tiles_path:
+            self.tile_reader = TileReader(tiles_path)
+            self.samples = self.tile_reader.samples
+        else:
+            self.parse_split_folder(data_split_path, manifest_path)
+
         self.parse_transform_config(transform_config)
 
-        # NOTE: Dummy cache mechanism that speeds up training x100 times
-        self.cache = {}
+        if (
+            self.tile_reader is not None
+            and self.tile_reader.transforms != self.prefix_transforms
+        ):
+            raise ValueError(
+                f"Tiles in {tiles_path} were built with different deterministic transforms. "
+                "Rebuild them with src/preprocess.py."
+            )
+
+        self.disk_cache = None
+        if resize_cache_dir and self.prefix_transforms and self.tile_reader is None:
+            self.disk_cache = DiskCache(
+                resize_cache_dir,
+                self.prefix_transforms,
+                label_encoding=self.label_encoder.get_config(),
+            )
 
-    def parse_split_folder(self, data_split_path: str) -> None:
-        """Parses the data split folder and initializes the dataset samples.
+        # NOTE: Decoded samples are cached, this speeds up training x100 times
+        self.image_ids = {sample[0]: i for i, sample in enumerate(self.samples)}
+        self.cache = build_cache(cache_config, num_keys=len(self.image_ids))
+
+        self.class_index, self.crop_selector = None, None
+        if self.use_class_index:
+            self.class_index = self.load_class_index(
+                class_index_config["path"], class_index_config["tile_size"]
+            )
+            if self.crop_size is not None:
+                self.crop_selector = RareClassCropSelector(
+                    self.class_index,
+                    self.crop_size,
+                    power=class_index_config["power"],
+                    crop_p=class_index_config["crop_p"],
+                )
+
+    def load_class_index(self, index_path: str, tile_size: int) -> ClassIndex:
+        """Loads the class-frequency index, building it if it is missing or outdated.
 
         Args:
-            data_split_path (str): Path to the data split folder.
+            index_path (str): Path to the .npz index.
+            tile_size (int): Height and width of a tile in pixels.
+
+        Returns:
+            ClassIndex: Index of the dataset samples.
         """
+        if os.path.exists(index_path):
+            class_index = ClassIndex(index_path)
+            if class_index.covers(self, tile_size):
+                return class_index
 
-        self.samples = []
+        get_console_logger("DatasetLogger").info(
+            f"Building class-frequency index {index_path}"
+        )
+        ClassIndex.build(self, index_path, tile_size, len(settings.CLASS_ENCODING))
 
-        # NOTE: Exclude 400 augmented samples "shifted*.png" and "flipped*.png"
-        images = glob.glob(
-            os.path.join(data_split_path, "**", "Images", "000*.png")
-        ) + glob.glob(os.path.join(data_split_path, "**", "Images", "file*.png"))
+        return ClassIndex(index_path)
 
-        for image_path in images:
-            label_path = image_path.replace("/Images/", "/Labels/")
+    def parse_split_folder(
+        self, data_split_path: str, manifest_path: str = None
+    ) -> None:
+        """Parses the data split folder and initializes the dataset samples.
 
-            self.samples.append((image_path, label_path))
+        Args:
+            data_split_path (str): Path to the data split folder.
+            manifest_path (str, optional): Path to the manifest of the split folder. Defaults to None.
+        """
+
+        # NOTE: Exclude 400 augmented samples "shifted*.png" and "flipped*.png"
+        patterns = [
+            os.path.join("**", "Images", "000*.png"),
+            os.path.join("**", "Images", "file*.png"),
+        ]
+
+        if manifest_path:
+            self.samples = [
+                (image_path, label_path)
+                for image_path, label_path, _ in load_manifest(
+                    manifest_path, data_split_path, patterns
+                )
+            ]
+        else:
+            self.samples = scan_split_folder(data_split_path, patterns)
 
     def parse_transform_config(self, transform_config: dict) -> None:
         """Parses the transform configuration and initializes the transformation pipeline.
@@ -187,9 +740,34 @@ class CustomTrainDataset(Dataset):
         """
 
         self.transform = None
+        self.prefix_transform, self.prefix_transforms = None, []
+        self.crop_size = None
+
+        if not transform_config:
+            return
+
+        transform = transform_config["transform"]
+        if self.augment_on_device:
+            # NOTE: The rest of the transforms is applied by the model on the device
+            transform, _ = split_device_transforms(transform)
 
-        if transform_config:
-            self.transform = A.from_dict(transform_config)
+        # NOTE: The deterministic prefix (Resize) is applied once before caching
+        self.prefix_transforms, suffix = split_deterministic_prefix(transform)
+
+        if (
+            (self.tile_reader is not None or self.use_class_index)
+            and suffix
+            and suffix[0]["__class_fullname__"] == "RandomCrop"
+        ):
+            # NOTE: The crop window is drawn by the dataset, so that it can be read
+            #       from the tiles or placed around rare classes
+            self.crop_size = (int(suffix[0]["height"]), int(suffix[0]["width"]))
+            suffix = suffix[1:]
+        if self.prefix_transforms:
+            self.prefix_transform = A.from_dict(
+                {"transform": {**transform, "transforms": self.prefix_transforms}}
+            )
+        self.transform = A.from_dict({"transform": {**transform, "transforms": suffix}})
 
     def __len__(self) -> int:
         """Gets the length of the dataset.
@@ -208,6 +786,9 @@ class CustomTrainDataset(Dataset):
         Returns:
             np.ndarray: Loaded image.
         """
+        if self.shard_reader is not None:
+            return self.shard_reader.read_image(image_path)
+
         return cv2.imread(image_path)
 
     def load_label(self, label_path: str) -> np.ndarray:
@@ -220,21 +801,86 @@ class CustomTrainDataset(Dataset):
         Returns:
             np.ndarray: Encoded label.
         """
-        label = cv2.imread(label_path)
-        height, width = label.shape[:2]
+        if self.shard_reader is not None:
+            return self.shard_reader.read_label(label_path)
 
-        label = label.reshape(-1, 3)
+        return self.label_encoder(cv2.imread(label_path))
 
-        encoded_label = np.zeros((height, width), dtype=np.long)
-        for class_idx, (class_name, pixel_value) in enumerate(
-            settings.CLASS_ENCODING.items()
-        ):
-            encoded_class = np.all(label == pixel_value, axis=1, keepdims=True)
-            encoded_class = encoded_class.reshape(height, width)
+    def load_sample(
+        self, image_path: str, label_path: str, window: tuple = None
+    ) -> tuple:
+        """Loads an image and its label and applies the deterministic transforms.
+
+        Args:
+            image_path (str): Path to the image.
+            label_path (str): Path to the label.
+            window (tuple, optional): (rows, columns) slices to read from the tiles.
+                Defaults to None, the whole sample.
+
+        Returns:
+            tuple: (image, label)
+        """
+        if self.tile_reader is not None:
+            # NOTE: Tiles are stored after the deterministic transforms
+            return (
+                self.tile_reader.read_image(image_path, window),
+                self.tile_reader.read_label(label_path, window),
+            )
+
+        if self.disk_cache is not None:
+            cached = self.disk_cache.get(image_path, label_path)
+            if cached is not None:
+                return cached
+
+        image = self.load_image(image_path)
+        label = self.load_label(label_path)
+
+        if self.prefix_transform is not None:
+            augmented = self.prefix_transform(image=image, mask=label)
+            image, label = augmented["image"], augmented["mask"]
+
+        if self.disk_cache is not None:
+            self.disk_cache.put(image_path, label_path, (image, label))
+
+        return image, label
 
-            encoded_label[encoded_class] = class_idx
+    def prepare_sample(self, image_path: str, label_path: str) -> tuple:
+        """Prepares the cached value of a sample.
 
-        return encoded_label
+        Args:
+            image_path (str): Path to the image.
+            label_path (str): Path to the label.
+
+        Returns:
+            tuple: (image, label) after the deterministic transforms.
+        """
+        return self.load_sample(image_path, label_path)
+
+    def get_crop_window(self, image_path: str, shape: tuple) -> tuple:
+        """Draws a random crop window of a sample.
+
+        Args:
+            image_path (str): Path to the image.
+            shape (tuple): (height, width) of the sample after the deterministic transforms.
+
+        Returns:
+            tuple: (rows, columns) slices of the crop.
+        """
+        if self.crop_selector is not None:
+            return self.crop_selector(image_path, shape)
+
+        height, width = shape
+        crop_height, crop_width = self.crop_size
+
+        if crop_height > height or crop_width > width:
+            raise ValueError(
+                f"Crop size ({crop_height}, {crop_width}) exceeds image size ({height}, {width})."
+            )
+
+        top = random.randint(0, height - crop_height)
+        left = random.randint(0, width - crop_width)
+
+        return slice(top, top + crop_height), slice(left, left + crop_width)
 
     def __getitem__(self, idx: int) -> tuple:
         """Gets an item from the dataset.
@@ -243,21 +889,37 @@ class CustomTrainDataset(Dataset):
             idx (int): Index of the item to get.
 
         Returns:
-            tuple: (image, label)
+            tuple: (image, label). Both are uint8 if augment_on_device is set.
         """
 
         image_path, label_path = self.samples[idx]
-        if image_path in self.cache:
-            image, label = self.cache[image_path]
+        key = self.image_ids[image_path]
+
+        if self.crop_size is not None and self.tile_reader is not None:
+            # NOTE: Only the tiles under the crop are decoded, so whole frames are not cached
+            window = self.get_crop_window(
+                image_path, self.tile_reader.get_shape(image_path)
+            )
+            image, label = self.load_sample(image_path, label_path, window)
         else:
-            image = self.load_image(image_path)
-            label = self.load_label(label_path)
-            self.cache[image_path] = (image, label)
+            cached = self.cache.get(key)
+            if cached is not None:
+                image, label = cached
+            else:
+                image, label = self.prepare_sample(image_path, label_path)
+                self.cache.put(key, (image, label))
+
+            if self.crop_size is not None:
+                window = self.get_crop_window(image_path, label.shape)
+                image, label = image[window], label[window]
 
         augmented = self.transform(image=image, mask=label)
         image = augmented["image"]
         label = augmented["mask"]
 
+        if self.augment_on_device:
+            return image, label
+
         return image, label.type(torch.long)
 
 
@@ -268,34 +930,97 @@ class CustomValDataset(Dataset):
         self,
         data_split_path: str,
         transform_config: dict,
-        image_width: int,
-        image_height: int,
         apply_slicing: bool = False,
         slice_width: int = None,
         slice_height: int = None,
+        ignore_index: int = 0,
+        shards_path: str = None,
+        tiles_path: str = None,
+        cache_config: dict = None,
+        normalize_on_device: bool = False,
+        resize_cache_dir: str = None,
+        manifest_path: str = None,
+        release_frames: bool = False,
     ) -> None:
         """Initializes the dataset with the given data split path, transform configuration,
 
         Args:
             data_split_path (str): Path to the data split folder.
             transform_config (dict): Configuration for data augmentation transforms.
-            image_width (int): Width of the image.
-            image_height (int): Height of the image.
             apply_slicing (bool, optional): Apply slicing method. Defaults to False.
             slice_width (int, optional): Width of slices. Defaults to None.
             slice_height (int, optional): Height of slices. Defaults to None.
+            ignore_index (int, optional): Class index for unknown label colours. Defaults to 0.
+            shards_path (str, optional): Path to shards built by src/preprocess.py. Defaults to None.
+            tiles_path (str, optional): Path to tiles built by src/preprocess.py. Defaults to None.
+            cache_config (dict, optional): Configuration for the sample cache. Defaults to None.
+            normalize_on_device (bool, optional): Skip Normalize and return uint8 tensors
+                which are normalized by the model after the transfer. Defaults to False.
+            resize_cache_dir (str, optional): Directory of the persistent cache of samples
+                after the leading Resize. Defaults to None.
+            manifest_path (str, optional): Path to the manifest of the split folder, it is
+                built on first use and rebuilt when the folder changes. Defaults to None.
+            release_frames (bool, optional): Remove a frame from the cache once its last slice
+                is read, for samplers that read the slices of a frame in order. Defaults to False.
         """
         super().__init__()
 
-        self.image_width, self.image_height = image_width, image_height
+        self.release_frames = release_frames
         self.apply_slicing = apply_slicing
         self.slice_width, self.slice_height = slice_width, slice_height
+        self.normalize_on_device = normalize_on_device
+
+        self.label_encoder = LabelEncoder(ignore_index=ignore_index)
+
+        if shards_path and tiles_path:
+            raise ValueError("Set either shards_path or tiles_path, not both.")
 
-        self.parse_split_folder(data_split_path)
+        # NOTE: Transforms are parsed first, the Resize defines the size of the sliced frames
         self.parse_transform_config(transform_config)
 
-        # NOTE: Dummy cache mechanism that speeds up testing x100 times
-        self.cache = {}
+        self.shard_reader, self.tile_reader = None, None
+        if shards_path:
+            self.shard_reader = ShardReader(shards_path)
+            self.build_samples(
+                [
+                    (image_path, label_path, self.shard_reader.get_shape(image_path))
+                    for image_path, label_path in self.shard_reader.samples
+                ]
+            )
+        elif tiles_path:
+            self.tile_reader = TileReader(tiles_path)
+            self.build_samples(
+                [
+                    (image_path, label_path, self.tile_reader.get_shape(image_path))
+                    for image_path, label_path in self.tile_reader.samples
+                ]
+            )
+        else:
+            self.parse_split_folder(data_split_path, manifest_path)
+
+        if (
+            self.tile_reader is not None
+            and self.tile_reader.transforms != self.prefix_transforms
+        ):
+            raise ValueError(
+                f"Tiles in {tiles_path} were built with different deterministic transforms. "
+                "Rebuild them with src/preprocess.py."
+            )
+
+        self.disk_cache = None
+        if resize_cache_dir and self.prefix_transforms and self.tile_reader is None:
+            self.disk_cache = DiskCache(
+                resize_cache_dir,
+                self.prefix_transforms,
+                label_encoding=self.label_encoder.get_config(),
+            )
+
+        # NOTE: Transformed images are cached, this speeds up testing x100 times
+        self.image_ids = {
+            image_path: i
+            for i, image_path in enumerate(dict.fromkeys(s[0] for s in self.samples))
+        }
+        self.cache = build_cache(cache_config, num_keys=len(self.image_ids))
 
     def generate_slice_intervals(
         self, image_height: int, image_width: int, slice_height: int, slice_width: int
@@ -331,24 +1056,64 @@ class CustomValDataset(Dataset):
 
         return intervals
 
-    def parse_split_folder(self, data_split_path: str) -> None:
+    def parse_split_folder(
+        self, data_split_path: str, manifest_path: str = None
+    ) -> None:
         """Parses the data split folder and initializes the dataset samples.
 
         Args:
             data_split_path (str): Path to the data split folder.
+            manifest_path (str, optional): Path to the manifest of the split folder. Defaults to None.
         """
 
-        self.samples = []
+        patterns = [os.path.join("**", "Images", "*.png")]
 
-        for image_path in glob.glob(
-            os.path.join(data_split_path, "**", "Images", "*.png")
-        ):
-            label_path = image_path.replace("/Images/", "/Labels/")
+        if manifest_path:
+            self.build_samples(load_manifest(manifest_path, data_split_path, patterns))
+        else:
+            self.build_samples(
+                [
+                    (image_path, label_path, None)
+                    for image_path, label_path in scan_split_folder(
+                        data_split_path, patterns
+                    )
+                ]
+            )
+
+    def get_frame_size(self, image_path: str, size: tuple = None) -> tuple:
+        """Gets the size of a sample after the deterministic transforms.
+
+        Args:
+            image_path (str): Path to the image.
+            size (tuple, optional): Native (height, width) of the image if known. Defaults to None.
+
+        Returns:
+            tuple: (height, width) of the frame that is sliced.
+        """
+        resizes = [
+            t for t in self.prefix_transforms if t["__class_fullname__"] == "Resize"
+        ]
+        if resizes:
+            return int(resizes[-1]["height"]), int(resizes[-1]["width"])
+
+        return size if size is not None else get_png_size(image_path)
 
+    def build_samples(self, samples: list) -> None:
+        """Initializes the dataset samples, expanding every image into its slices.
+
+        Args:
+            samples (list): List of (image_path, label_path, (height, width)) tuples,
+                the size may be None if it is unknown.
+        """
+
+        self.samples = []
+
+        for image_path, label_path, size in samples:
             if self.apply_slicing:
+                image_height, image_width = self.get_frame_size(image_path, size)
                 intervals = self.generate_slice_intervals(
-                    self.image_height,
-                    self.image_width,
+                    image_height,
+                    image_width,
                     self.slice_height,
                     self.slice_width,
                 )
@@ -366,9 +1131,30 @@ class CustomValDataset(Dataset):
         """
 
         self.transform = None
-
-        if transform_config:
-            self.transform = A.from_dict(transform_config)
+        self.prefix_transform, self.prefix_transforms = None, []
+
+        if not transform_config:
+            return
+
+        transform = transform_config["transform"]
+        if self.normalize_on_device:
+            # NOTE: Images stay uint8 and are normalized on the device by the model
+            transform = {
+                **transform,
+                "transforms": [
+                    t
+                    for t in transform["transforms"]
+                    if t["__class_fullname__"] != "Normalize"
+                ],
+            }
+
+        # NOTE: The deterministic prefix (Resize) can be served by the disk cache
+        self.prefix_transforms, suffix = split_deterministic_prefix(transform)
+        if self.prefix_transforms:
+            self.prefix_transform = A.from_dict(
+                {"transform": {**transform, "transforms": self.prefix_transforms}}
+            )
+        self.transform = A.from_dict({"transform": {**transform, "transforms": suffix}})
 
     def __len__(self) -> int:
         """Gets the length of the dataset.
@@ -387,6 +1173,9 @@ class CustomValDataset(Dataset):
         Returns:
             np.ndarray: Loaded image.
         """
+        if self.shard_reader is not None:
+            return self.shard_reader.read_image(image_path)
+
         return cv2.imread(image_path)
 
     def load_label(self, label_path: str) -> np.ndarray:
@@ -399,21 +1188,77 @@ class CustomValDataset(Dataset):
         Returns:
             np.ndarray: Encoded label.
         """
-        label = cv2.imread(label_path)
-        height, width = label.shape[:2]
+        if self.shard_reader is not None:
+            return self.shard_reader.read_label(label_path)
 
-        label = label.reshape(-1, 3)
+        return self.label_encoder(cv2.imread(label_path))
 
-        encoded_label = np.zeros((height, width), dtype=np.long)
-        for class_idx, (class_name, pixel_value) in enumerate(
-            settings.CLASS_ENCODING.items()
-        ):
-            encoded_class = np.all(label == pixel_value, axis=1, keepdims=True)
-            encoded_class = encoded_class.reshape(height, width)
+    def load_sample(
+        self, image_path: str, label_path: str, window: tuple = None
+    ) -> tuple:
+        """Loads an image and its label and applies the deterministic transforms.
+
+        Args:
+            image_path (str): Path to the image.
+            label_path (str): Path to the label.
+            window (tuple, optional): (rows, columns) slices to read from the tiles.
+                Defaults to None, the whole sample.
+
+        Returns:
+            tuple: (image, label)
+        """
+        if self.tile_reader is not None:
+            # NOTE: Tiles are stored after the deterministic transforms
+            return (
+                self.tile_reader.read_image(image_path, window),
+                self.tile_reader.read_label(label_path, window),
+            )
+
+        if self.disk_cache is not None:
+            cached = self.disk_cache.get(image_path, label_path)
+            if cached is not None:
+                return cached
+
+        image = self.load_image(image_path)
+        label = self.load_label(label_path)
+
+        if self.prefix_transform is not None:
+            augmented = self.prefix_transform(image=image, mask=label)
+            image, label = augmented["image"], augmented["mask"]
+
+        if self.disk_cache is not None:
+            self.disk_cache.put(image_path, label_path, (image, label))
+
+        return image, label
+
+    def is_last_slice(self, idx: int) -> bool:
+        """Checks whether a sample is the last slice of its frame.
+
+        Args:
+            idx (int): Index of the sample.
+
+        Returns:
+            bool: True if the next sample belongs to another frame.
+        """
+        return (
+            idx + 1 == len(self.samples)
+            or self.samples[idx + 1][0] != self.samples[idx][0]
+        )
 
-            encoded_label[encoded_class] = class_idx
+    def prepare_sample(self, image_path: str, label_path: str) -> tuple:
+        """Prepares the cached value of a sample.
 
-        return encoded_label
+        Args:
+            image_path (str): Path to the image.
+            label_path (str): Path to the label.
+
+        Returns:
+            tuple: Transformed (image, label) as numpy arrays.
+        """
+        image, label = self.load_sample(image_path, label_path)
+
+        augmented = self.transform(image=image, mask=label)
+        return augmented["image"].numpy(), augmented["mask"].numpy()
 
     def __getitem__(self, idx: int) -> tuple:
         """Gets an item from the dataset.
@@ -422,25 +1267,36 @@ class CustomValDataset(Dataset):
             idx (int): Index of the item to get.
 
         Returns:
-            tuple: (image, label)
+            tuple: (image, label). Both are uint8 if normalize_on_device is set.
         """
 
         image_path, label_path, interval = self.samples[idx]
+        key = self.image_ids[image_path]
 
-        if image_path in self.cache:
-            image, label = self.cache[image_path]
-        else:
-            image = self.load_image(image_path)
-            label = self.load_label(label_path)
+        if self.tile_reader is not None:
+            # NOTE: Only the tiles under the slice are decoded. The remaining
+            #       transforms (Normalize, ToTensorV2) are per pixel, so they can
+            #       be applied to the slice instead of the whole frame.
+            image, label = self.load_sample(image_path, label_path, interval)
 
             augmented = self.transform(image=image, mask=label)
-            image = augmented["image"]
-            label = augmented["mask"]
+            image, label = augmented["image"], augmented["mask"]
+        else:
+            cached = self.cache.get(key)
+            if cached is not None:
+                image, label = cached
+            else:
+                image, label = self.prepare_sample(image_path, label_path)
+                self.cache.put(key, (image, label))
+
+            image = torch.from_numpy(image[slice(None), *interval])
+            label = torch.from_numpy(label[interval])
 
-            self.cache[image_path] = (image, label)
+            if self.release_frames and self.is_last_slice(idx):
+                self.cache.discard(key)
 
-        image = image[slice(None), *interval]
-        label = label[interval]
+        if self.normalize_on_device:
+            return image, label
 
         return image, label.type(torch.long)
 
@@ -451,11 +1307,54 @@ class PredictionSource:
     SUPPORTED_IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"]
     SUPPORTED_VIDEO_EXTENSIONS = [".mp4", ".avi", ".mov", ".mkv", ".wmv", ".flv"]
 
-    def __init__(self, source: str) -> None:
+    # NOTE: Marks the end of the prefetch queue
+    _END = object()
+
+    def __init__(
+        self,
+        source: str,
+        prefetch: int = 0,
+        num_threads: int = 1,
+        frame_range: tuple = None,
+        frame_stride: int = 1,
+        target_fps: float = None,
+        time_window: tuple = None,
+    ) -> None:
+        """Initializes the source.
+
+        Args:
+            source (str): Path to picture, folder, or video.
+            prefetch (int, optional): Number of frames decoded ahead in the background,
+                0 decodes synchronously. Defaults to 0.
+            num_threads (int, optional): Number of decode threads for image and folder
+                sources, video is always decoded by one thread. Defaults to 1.
+            frame_range (tuple, optional): (start, stop) frames of a video to read.
+                Defaults to None, the whole video.
+            frame_stride (int, optional): Only for videos! Read every Nth frame. Defaults to 1.
+            target_fps (float, optional): Only for videos! Sample frames at this rate instead
+                of a fixed stride. Defaults to None.
+            time_window (tuple, optional): Only for videos! (start, end) in seconds, end may
+                be None for the end of the video. Defaults to None, the whole video.
+        """
         self.source = Path(source)
+        self.prefetch = prefetch
+        self.num_threads = num_threads
+        self.frame_range = frame_range
+        self.frame_stride = frame_stride
+        self.target_fps = target_fps
+        self.time_window = time_window
+
+        if frame_stride < 1:
+            raise ValueError(f"Frame stride must be at least 1, got {frame_stride}")
+        if target_fps is not None and target_fps <= 0:
+            raise ValueError(f"Target fps must be positive, got {target_fps}")
+        if target_fps is not None and frame_stride > 1:
+            raise ValueError("Frame stride and target fps are mutually exclusive")
 
         self.logger = get_console_logger("PredictionSource")
 
+        self._metrics_lock = threading.Lock()
+        self.reset_metrics()
         self.load_source()
 
     def load_source(self) -> None:
@@ -476,6 +1375,20 @@ class PredictionSource:
                     raise ValueError(f"Cannot open video file: {self.source}")
 
                 self._total_items = int(self._items.get(cv2.CAP_PROP_FRAME_COUNT))
+                self._fps = self._items.get(cv2.CAP_PROP_FPS)
+
+                self._start_frame = 0
+                self._frame_step = 1.0
+                self._frame_indices = self.get_frame_indices()
+                if self._frame_indices is not None:
+                    self._start_frame = (
+                        int(self._frame_indices[0]) if len(self._frame_indices) else 0
+                    )
+                    self._total_items = len(self._frame_indices)
+
+                    # NOTE: Seeking skips the frames before the range or time window
+                    if self._start_frame > 0:
+                        self._items.set(cv2.CAP_PROP_POS_FRAMES, self._start_frame)
             else:
                 raise ValueError(f"Unsupported file type: {suffix}")
         elif self.source.is_dir():
@@ -499,9 +1412,129 @@ class PredictionSource:
             f"Loaded {self._source_type} source with {self._total_items} items."
         )
 
+    def get_frame_indices(self) -> np.ndarray:
+        """Selects the video frames to read from the time window, sampling and range.
+
+        Frames are sampled from the start of the time window, so that ranges of
+        the same video read by different workers stay aligned.
+
+        Raises:
+            ValueError: If the video has no frame rate and it is needed.
+
+        Returns:
+            np.ndarray: Sorted frame indices, None if every frame is read.
+        """
+        sampled = (
+            self.frame_stride > 1
+            or self.target_fps is not None
+            or self.time_window is not None
+        )
+        if not sampled and self.frame_range is None:
+            return None
+
+        if (self.target_fps is not None or self.time_window is not None) and (
+            self._fps <= 0
+        ):
+            raise ValueError(f"Cannot read the frame rate of video: {self.source}")
+
+        first, last = 0, self._total_items
+        if self.time_window is not None:
+            start_time, end_time = self.time_window
+            first = max(first, round((start_time or 0) * self._fps))
+            if end_time is not None:
+                last = min(last, round(end_time * self._fps))
+
+        step = self.frame_stride
+        if self.target_fps is not None:
+            step = max(self._fps / self.target_fps, 1.0)
+        self._frame_step = float(step)
+
+        indices = np.unique(np.round(np.arange(first, last, step)).astype(int))
+        indices = indices[indices < last]
+
+        if self.frame_range is not None:
+            start, stop = self.frame_range
+            indices = indices[(indices >= start) & (indices < stop)]
+
+        return indices
+
+    def get_frame_ranges(self, num_chunks: int) -> list:
+        """Splits the frames to read into contiguous ranges with nearly equal counts.
+
+        Args:
+            num_chunks (int): Number of ranges.
+
+        Returns:
+            list: List of (start, stop) video frames in frame order.
+        """
+        indices = self._frame_indices
+        if indices is None:
+            indices = np.arange(
+                self._start_frame, self._start_frame + self._total_items
+            )
+
+        return [
+            (int(chunk[0]), int(chunk[-1]) + 1)
+            for chunk in np.array_split(indices, num_chunks)
+            if len(chunk)
+        ]
+
+    def reset_metrics(self) -> None:
+        """Resets the decode and prefetch counters."""
+        self._metrics = {
+            "frames": 0,
+            "decode_seconds": 0.0,
+            "wait_seconds": 0.0,
+            "prefetch_depth": 0,
+        }
+
+    def get_metrics(self) -> dict:
+        """Gets the decode and prefetch metrics of the frames read so far.
+
+        Returns:
+            dict: Mean decode time, mean time the consumer waited for a frame and
+                mean number of decoded frames ready in the prefetch queue, both
+                measured when a frame is taken.
+        """
+        frames = max(self._metrics["frames"], 1)
+        return {
+            "frames": self._metrics["frames"],
+            "decode_ms": 1000 * self._metrics["decode_seconds"] / frames,
+            "wait_ms": 1000 * self._metrics["wait_seconds"] / frames,
+            "prefetch_depth": self._metrics["prefetch_depth"] / frames,
+        }
+
+    def _record(self, wait_seconds: float, prefetch_depth: int) -> None:
+        """Records the consumption of a frame."""
+        self._metrics["frames"] += 1
+        self._metrics["wait_seconds"] += wait_seconds
+        self._metrics["prefetch_depth"] += prefetch_depth
+
     def __iter__(self) -> Iterator[np.ndarray]:
         """Returns the generator for iterating over processed images/batches."""
-        return self._generator()
+        if self.prefetch <= 0:
+            return self._synchronous_generator()
+        if self._source_type == "folder" and self.num_threads > 1:
+            return self._pool_generator()
+        return self._thread_generator()
+
+    def _read_image(self, img_path: Path) -> tuple:
+        """Reads an image and measures the decode time.
+
+        Raises:
+            ValueError: If the image cannot be read.
+
+        Returns:
+            tuple: (image, filename)
+        """
+        start = time.perf_counter()
+        img = cv2.imread(str(img_path))
+        with self._metrics_lock:
+            self._metrics["decode_seconds"] += time.perf_counter() - start
+
+        if img is None:
+            raise ValueError(f"Failed to read image: {img_path}")
+        return (img, img_path.name)
 
     def _generator(self) -> Iterator[np.array]:
         """Generator function to yield processed images/videos.
@@ -515,22 +1548,144 @@ class PredictionSource:
         if self._source_type == "image" or self._source_type == "folder":
             paths = self._items
             for img_path in paths:
-                img = cv2.imread(str(img_path))
-                img_filename = img_path.name
-                if img is None:
-                    raise ValueError(f"Failed to read image: {img_path}")
-                yield (img, img_filename)
+                yield self._read_image(img_path)
         elif self._source_type == "video":
-            frame_idx = 0
+            # NOTE: Frames are named by their index in the whole video,
+            #       without a selection the video is read until its end
+            frame_idx = self._start_frame
+            targets = None
+            if self._frame_indices is not None:
+                targets = iter(self._frame_indices.tolist())
+
             while True:
-                ret, frame = self._items.read()
-                frame_name = self.source.name + f"_{frame_idx:04d}.jpg"
+                target = frame_idx if targets is None else next(targets, None)
+                if target is None:
+                    break
+
+                start = time.perf_counter()
+                # NOTE: Skipped frames are only grabbed, without retrieving them
+                while frame_idx < target and self._items.grab():
+                    frame_idx += 1
+                ret, frame = (
+                    self._items.read() if frame_idx == target else (False, None)
+                )
+                self._metrics["decode_seconds"] += time.perf_counter() - start
+
+                frame_name = self.get_frame_name(frame_idx)
                 if not ret:
                     break
                 yield (frame, frame_name)
+                frame_idx += 1
         else:
             raise ValueError(f"Unsupported source type: {self._source_type}")
 
+    def _synchronous_generator(self) -> Iterator[tuple]:
+        """Yields frames decoded on demand."""
+        items = self._generator()
+        while True:
+            start = time.perf_counter()
+            item = next(items, self._END)
+            if item is self._END:
+                return
+
+            self._record(time.perf_counter() - start, 0)
+            yield item
+
+    def _thread_generator(self) -> Iterator[tuple]:
+        """Yields frames decoded by a background thread into a bounded queue."""
+        frames = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def produce() -> None:
+            try:
+                for item in self._generator():
+                    # NOTE: Waits for free space, unless the consumer has stopped
+                    while not stop.is_set():
+                        try:
+                            frames.put(item, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+            except Exception as e:
+                frames.put(e)
+            frames.put(self._END)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                depth = frames.qsize()
+
+                start = time.perf_counter()
+                item = frames.get()
+                if item is self._END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+
+                self._record(time.perf_counter() - start, depth)
+                yield item
+        finally:
+            stop.set()
+            # NOTE: Unblocks the producer if it waits on a full queue
+            while thread.is_alive():
+                try:
+                    frames.get_nowait()
+                except queue.Empty:
+                    thread.join(timeout=0.1)
+
+    def _pool_generator(self) -> Iterator[tuple]:
+        """Yields images decoded by a thread pool, keeping the order of the folder."""
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            paths = iter(self._items)
+            futures = deque()
+
+            try:
+                while True:
+                    while len(futures) < self.prefetch:
+                        img_path = next(paths, None)
+                        if img_path is None:
+                            break
+                        futures.append(executor.submit(self._read_image, img_path))
+
+                    if not futures:
+                        return
+
+                    depth = sum(future.done() for future in futures)
+
+                    start = time.perf_counter()
+                    item = futures.popleft().result()
+
+                    self._record(time.perf_counter() - start, depth)
+                    yield item
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    @property
+    def source_type(self) -> str:
+        """Type of the source, "image", "folder" or "video"."""
+        return self._source_type
+
+    @property
+    def fps(self) -> float:
+        """Rate of the video frames read after sampling, None for images."""
+        if self._source_type != "video":
+            return None
+        return self._fps / self._frame_step
+
+    def get_frame_name(self, frame_idx: int) -> str:
+        """Gets the output filename of a video frame, e.g. video.mp4_0012.jpg."""
+        return self.source.name + f"_{frame_idx:04d}.jpg"
+
+    @staticmethod
+    def get_frame_index(frame_name: str) -> int:
+        """Gets the index of a video frame from its output filename."""
+        return int(os.path.splitext(frame_name)[0].rsplit("_", 1)[1])
+
     def __len__(self) -> int:
         """Get the total number of items in the source.
 
@@ -548,7 +1703,6 @@ class PredictionSource:
 
 if __name__ == "__main__":
     import yaml
-    from tqdm import tqdm
 
     from utils import load_config
 
@@ -11,6 +11,7 @@ import torch.nn as nn
 import torch.optim as optim
 import torchmetrics
 
+from augment import BatchAugmentation, split_device_transforms
 from utils import get_console_logger
 
 
@@ -24,6 +25,8 @@ class SegmentationModel(L.LightningModule):
         self.init_model()
         self.init_loss()
         self.init_metrics()
+        self.init_normalization()
+        self.init_augmentation()
 
     def init_model(self) -> None:
         """Initialize the model based on the provided hyperparameters."""
@@ -57,6 +60,37 @@ class SegmentationModel(L.LightningModule):
         self.val_acc = torchmetrics.Accuracy(**metric_params, average="macro")
         self.test_acc = torchmetrics.Accuracy(**metric_params, average="macro")
 
+    def init_normalization(self) -> None:
+        """Initialize normalization of uint8 batches based on the provided hyperparameters."""
+        mean = torch.tensor(self.hparams["normalization"]["mean"]) * 255.0
+        std = torch.tensor(self.hparams["normalization"]["std"]) * 255.0
+
+        # NOTE: Not persistent to keep the checkpoint state_dict model-only
+        self.register_buffer("pixel_mean", mean.view(1, -1, 1, 1), persistent=False)
+        self.register_buffer("pixel_std", std.view(1, -1, 1, 1), persistent=False)
+
+    def init_augmentation(self) -> None:
+        """Initialize batched training augmentation based on the provided hyperparameters."""
+        self.augmentation = None
+
+        if self.hparams["augmentation"]["on_device"]:
+            _, device_transforms = split_device_transforms(
+                self.hparams["augmentation"]["transform"]
+            )
+            self.augmentation = BatchAugmentation(device_transforms)
+
+    def on_after_batch_transfer(self, batch: tuple, dataloader_idx: int) -> tuple:
+        """Augment training batches, normalize uint8 images and cast masks on the device."""
+        images, masks = batch
+
+        if self.augmentation is not None and self.training:
+            images, masks = self.augmentation(images, masks)
+
+        if images.dtype == torch.uint8:
+            images = (images.float() - self.pixel_mean) / self.pixel_std
+
+        return images, masks.long()
+
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         """Same as torch.nn.Module.forward"""
         return self.model(x)
@@ -145,6 +179,28 @@ class SegmentationModel(L.LightningModule):
         """Test step for the model."""
         return self._common_step(batch, batch_idx, "test")
 
+    def on_train_epoch_end(self) -> None:
+        """Log the training cache counters once per epoch."""
+        self._log_cache_stats("train")
+
+    def on_validation_epoch_end(self) -> None:
+        """Log the validation cache counters once per epoch."""
+        self._log_cache_stats("val")
+
+    def _log_cache_stats(self, stage: str) -> None:
+        """Log hit, miss and eviction counters of the dataset cache."""
+        datamodule = self.trainer.datamodule
+        if datamodule is None or not hasattr(datamodule, "cache_stats"):
+            return
+
+        stats = datamodule.cache_stats(stage)
+        self.log_dict(
+            {f"{stage}_cache_{name}": float(value) for name, value in stats.items()},
+            on_step=False,
+            on_epoch=True,
+            logger=True,
+        )
+
     def configure_optimizers(self) -> optim.Optimizer | tuple:
         """Choose what optimizers and learning-rate schedulers to use in your optimization."""
         optimizer_name = self.hparams["optimizer"]["optimizer_name"]
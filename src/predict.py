@@ -1,7 +1,13 @@
 """Prediction script for image segmentation tasks"""
 
 import datetime as dt
+import multiprocessing as mp
 import os
+from argparse import Namespace
+from collections import deque
+from functools import partial
+from pathlib import Path
+from typing import Iterable, Iterator
 from urllib.parse import urlparse
 from warnings import filterwarnings
 
@@ -14,7 +20,95 @@ import torch
 
 import settings
 from data import PredictionSource
-from utils import create_dir_safely, get_console_logger, parse_predict_args
+from storage import MaskStoreWriter
+from utils import (
+    create_dir_safely,
+    get_console_logger,
+    get_num_cores,
+    parse_predict_args,
+)
+from writer import STREAM_FORMATS, MaskWriter, StoreMaskWriter, VideoMaskWriter
+
+
+def get_blending_window(height: int, width: int, blending: str) -> np.ndarray:
+    """Computes the weights of slice pixels when blending overlapping slices.
+
+    Args:
+        height (int): Height of the slice.
+        width (int): Width of the slice.
+        blending (str): "uniform", "linear" (tent, highest in the center) or
+            "gaussian" (sigma of 1/8 of the slice size).
+
+    Returns:
+        np.ndarray: Float32 weights of shape (height, width) with the maximum of 1.
+    """
+
+    def profile(size: int) -> np.ndarray:
+        distance = np.abs(np.arange(size) - (size - 1) / 2)
+        if blending == "linear":
+            return 1.0 - distance / (size / 2)
+        elif blending == "gaussian":
+            sigma = size / 8
+            return np.exp(-(distance**2) / (2 * sigma**2))
+        else:
+            raise ValueError(f"Unsupported blending: {blending}")
+
+    if blending == "uniform":
+        return np.ones((height, width), dtype=np.float32)
+
+    window = np.outer(profile(height), profile(width))
+
+    # NOTE: Border pixels keep a small weight, they are the only prediction
+    #       at the borders of the image
+    return np.maximum(window / window.max(), 1e-3).astype(np.float32)
+
+
+class BufferArena:
+    """Reusable arrays of the prediction hot path, keyed by name, shape and dtype.
+
+    For frames of the same shape every buffer is allocated once and reused by
+    the following frames, so the steady state allocates nothing.
+    """
+
+    def __init__(self) -> None:
+        self._buffers = {}
+        self.allocations = 0
+        self.reuses = 0
+
+    def get(self, name: str, shape: tuple, dtype: np.dtype) -> np.ndarray:
+        """Gets an uninitialized buffer, allocating it on first use.
+
+        Args:
+            name (str): Name of the buffer, buffers used at the same time need distinct names.
+            shape (tuple): Shape of the buffer.
+            dtype (np.dtype): Data type of the buffer.
+
+        Returns:
+            np.ndarray: Buffer, its content is left from the previous use.
+        """
+        key = (name, tuple(int(d) for d in shape), np.dtype(dtype))
+
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = np.empty(key[1], dtype=key[2])
+            self.allocations += 1
+        else:
+            self.reuses += 1
+
+        return buffer
+
+    def get_stats(self) -> dict:
+        """Gets the number of allocations and reuses and the size of the arena."""
+        return {
+            "allocations": self.allocations,
+            "reuses": self.reuses,
+            "buffers": len(self._buffers),
+            "megabytes": sum(b.nbytes for b in self._buffers.values()) / 1e6,
+        }
+
+    def clear(self) -> None:
+        """Releases all buffers."""
+        self._buffers.clear()
 
 
 class PredictionEngine:
@@ -35,6 +129,11 @@ class PredictionEngine:
         slice_width: int,
         slice_overlap: float,
         half: bool = False,
+        num_threads: int = None,
+        blending: str = "uniform",
+        stitch_dtype: str = "float32",
+        device: str = None,
+        device_postprocess: bool = True,
     ):
         """Initialize the PredictionEngine.
 
@@ -45,6 +144,15 @@ class PredictionEngine:
             image_crop_size (int): Size of the image crop.
             intersection_ratio (float): Ratio of intersection for cropping.
             half (bool, optional): Only for Pytorch Inference! Use FP16. Defaults to False.
+            num_threads (int, optional): Number of intra-op CPU threads. Defaults to None (library default).
+            blending (str, optional): Weight window of overlapping slices, "uniform",
+                "linear" or "gaussian". Defaults to "uniform".
+            stitch_dtype (str, optional): Accumulation dtype of the stitched logits,
+                "float32" or "float16". Defaults to "float32".
+            device (str, optional): Only for Pytorch Inference! Device of the model.
+                Defaults to None, CUDA if available.
+            device_postprocess (bool, optional): Only for Pytorch Inference! Stitch and
+                argmax on the device and transfer only the uint8 mask. Defaults to True.
         """
 
         self.model_source = model_source
@@ -58,8 +166,33 @@ class PredictionEngine:
         self.slice_width = slice_width
         self.slice_overlap = slice_overlap
         self.half = half
+        self.num_threads = num_threads
+        self.blending = blending
+        self.stitch_dtype = np.dtype(stitch_dtype)
+
+        if self.stitch_dtype not in (np.float16, np.float32):
+            raise ValueError(f"Unsupported stitch dtype: {stitch_dtype}")
+
+        self.device = torch.device(
+            device or ("cuda" if torch.cuda.is_available() else "cpu")
+        )
+        self.device_postprocess = device_postprocess
+
+        self._windows = {}
+        self._inverse_weight_maps = {}
+        self._device_stitching = {}
+        self._device_slots = {}
+        self.transferred_bytes = 0
 
         self.logger = get_console_logger("PredictionEngine")
+        self.arena = BufferArena()
+
+        # NOTE: Normalized value of every uint8 pixel value per channel,
+        #       so normalization is a single lookup into float32
+        self._normalization_lut = (
+            (np.arange(256) / 255.0 - self.DEFAULT_MEAN[:, None])
+            / self.DEFAULT_STD[:, None]
+        ).astype(np.float32)
 
         self.load_model()
 
@@ -98,7 +231,10 @@ class PredictionEngine:
         if self.model_source.endswith(".ckpt"):
             self._engine = "torch"
 
-            checkpoint = torch.load(self.model_source)
+            if self.num_threads:
+                torch.set_num_threads(self.num_threads)
+
+            checkpoint = torch.load(self.model_source, map_location="cpu")
             # Remove 'model.' prefix from state_dict keys
             checkpoint["state_dict"] = {
                 k[6:]: v for k, v in checkpoint["state_dict"].items()
@@ -106,6 +242,7 @@ class PredictionEngine:
 
             self.model = smp.create_model(**checkpoint["hyper_parameters"]["model"])
             self.model.load_state_dict(checkpoint["state_dict"])
+            self.model.to(self.device)
             self.model.eval()
 
             if self.half:
@@ -129,22 +266,31 @@ class PredictionEngine:
 
                 self._providers = ["CPUExecutionProvider"]
 
+            session_options = ort.SessionOptions()
+            if self.num_threads:
+                session_options.intra_op_num_threads = self.num_threads
+
             self.model = ort.InferenceSession(
-                self.model_source, providers=self._providers
+                self.model_source,
+                sess_options=session_options,
+                providers=self._providers,
             )
             self._input_name = self.model.get_inputs()[0].name
             self._output_name = self.model.get_outputs()[0].name
+            self._io_binding = self.model.io_binding()
 
             self._dtype = (
                 self.model.get_inputs()[0].type.replace("tensor(", "").replace(")", "")
             )
+            # NOTE: ORT "float" is float32, numpy would read it as float64
+            ort_dtypes = {"float": "float32", "double": "float64"}
             try:
-                self._dtype = np.dtype(self._dtype)
+                self._dtype = np.dtype(ort_dtypes.get(self._dtype, self._dtype))
             except TypeError:
                 self.logger.warning(
                     f"ORT expected input type not understood: {self._dtype}. Defaulting to float32."
                 )
-                self._dtype = np.float32
+                self._dtype = np.dtype(np.float32)
 
             if self.half:
                 pass
@@ -169,29 +315,30 @@ class PredictionEngine:
             slice_overlap (float): Overlap ratio for the slices.
 
         Returns:
-            list: List of tuples representing the intervals.
+            list: List of tuples representing the unique intervals.
         """
-        intervals = []
-
         height_step_size = int(slice_height * (1 - slice_overlap))
         width_step_size = int(slice_width * (1 - slice_overlap))
 
-        for i in range(0, image_height, height_step_size):
-            for j in range(0, image_width, width_step_size):
-                height_slice_start = i - max(0, (i + slice_height) - image_height)
-                height_slice_end = i + slice_height
-
-                width_slice_start = j - max(0, (j + slice_width) - image_width)
-                width_slice_end = j + slice_width
-
-                intervals.append(
-                    (
-                        slice(height_slice_start, height_slice_end),
-                        slice(width_slice_start, width_slice_end),
-                    )
-                )
+        # NOTE: Steps past the last full slice are shifted back onto it. The
+        #       duplicates would be predicted again and double their blending weight
+        height_slice_starts = dict.fromkeys(
+            i - max(0, (i + slice_height) - image_height)
+            for i in range(0, image_height, height_step_size)
+        )
+        width_slice_starts = dict.fromkeys(
+            j - max(0, (j + slice_width) - image_width)
+            for j in range(0, image_width, width_step_size)
+        )
 
-        return intervals
+        return [
+            (
+                slice(height_slice_start, height_slice_start + slice_height),
+                slice(width_slice_start, width_slice_start + slice_width),
+            )
+            for height_slice_start in height_slice_starts
+            for width_slice_start in width_slice_starts
+        ]
 
     def split_to_slices(self, image: np.ndarray) -> tuple:
         """Apply slicing to the image based on the specified intervals.
@@ -200,7 +347,7 @@ class PredictionEngine:
             image (np.ndarray): Input image.
 
         Returns:
-            tuple: Tuple containing the sliced images and the intervals.
+            tuple: Tuple containing the slices as views of the image and the intervals.
         """
 
         intervals = self.generate_slice_intervals(
@@ -211,16 +358,88 @@ class PredictionEngine:
             self.slice_overlap,
         )
 
-        slices = []
-        for interval in intervals:
-            slices.append(image[interval])
+        # NOTE: Slices are strided views, overlapping pixels are not copied
+        slices = [image[interval] for interval in intervals]
 
-        return np.array(slices), intervals
+        return slices, intervals
 
-    def concatenate_slices(
+    def normalize_slices(self, slices: list, out: np.ndarray = None) -> np.ndarray:
+        """Normalizes uint8 HWC slices into a float32 NCHW tensor in a single pass.
+
+        Args:
+            slices (list): Slices of shape (H, W, 3), e.g. views of the image.
+            out (np.ndarray, optional): Preallocated float32 tensor of shape
+                (N, 3, H, W). Defaults to None, a new tensor.
+
+        Returns:
+            np.ndarray: Normalized tensor of shape (N, 3, H, W).
+        """
+        height, width, channels = slices[0].shape
+        if out is None:
+            out = np.empty((len(slices), channels, height, width), dtype=np.float32)
+
+        for i, image_slice in enumerate(slices):
+            for channel in range(channels):
+                np.take(
+                    self._normalization_lut[channel],
+                    image_slice[..., channel],
+                    out=out[i, channel],
+                    mode="clip",
+                )
+
+        return out
+
+    def get_window(self, height: int, width: int) -> np.ndarray:
+        """Gets the blending weights of a slice, computed once per slice shape.
+
+        Args:
+            height (int): Height of the slice.
+            width (int): Width of the slice.
+
+        Returns:
+            np.ndarray: Weights of shape (height, width) in the stitch dtype.
+        """
+        key = (height, width)
+        if key not in self._windows:
+            self._windows[key] = get_blending_window(
+                height, width, self.blending
+            ).astype(self.stitch_dtype)
+        return self._windows[key]
+
+    def get_inverse_weight_map(
+        self, intervals: list, image_shape: tuple, window: np.ndarray
+    ) -> np.ndarray:
+        """Gets the inverse of the summed slice weights of every pixel.
+
+        Intervals depend only on the image and slice shapes, so the map is
+        computed once per shape.
+
+        Args:
+            intervals (list): List of intervals used for slicing.
+            image_shape (tuple): Shape of the stitched image.
+            window (np.ndarray): Blending weights of a slice.
+
+        Returns:
+            np.ndarray: Inverse weights of shape (H, W) in the stitch dtype.
+        """
+        key = (tuple(image_shape[:2]), window.shape, len(intervals))
+        if key not in self._inverse_weight_maps:
+            weight_map = np.zeros(image_shape[:2], dtype=np.float32)
+            for slice_interval in intervals:
+                weight_map[slice_interval] += window
+
+            self._inverse_weight_maps[key] = (
+                1.0 / np.maximum(weight_map, 1e-6)
+            ).astype(self.stitch_dtype)
+        return self._inverse_weight_maps[key]
+
+    def stitch_logits(
         self, slices_probs: np.ndarray, intervals: list, image_shape: tuple
     ) -> np.ndarray:
-        """Concatenate the slices back to the original image shape.
+        """Blends overlapping slice logits into logits of the whole image.
+
+        Logits of every slice are weighted by the blending window, accumulated
+        in float and divided by the summed weights of every pixel.
 
         Args:
             slices_probs (np.ndarray): Segmentation masks of probs of classes.
@@ -228,19 +447,45 @@ class PredictionEngine:
             image_shape (tuple): Original image shape.
 
         Returns:
-            np.ndarray: Concatenated segmentation mask.
+            np.ndarray: Logits of shape (C, H, W), reused by the next call.
         """
+        window = self.get_window(*slices_probs.shape[2:])
 
-        slices_probs = np.moveaxis(slices_probs, (1, 2), (-1, -2))
-        mask_probs = np.zeros(
-            (image_shape[0], image_shape[1], self.num_classes), dtype=np.uint8
+        # NOTE: Weighting is vectorized over all slices at once
+        weighted = self.arena.get(
+            "weighted_probs", slices_probs.shape, self.stitch_dtype
         )
+        np.multiply(slices_probs, window, out=weighted, casting="unsafe")
 
-        for slice_probs, slice_interval in zip(slices_probs, intervals):
-            mask_probs[slice_interval] = slice_probs
+        logits = self.arena.get(
+            "logits",
+            (self.num_classes, image_shape[0], image_shape[1]),
+            self.stitch_dtype,
+        )
+        logits.fill(0)
+        for slice_probs, (rows, columns) in zip(weighted, intervals):
+            logits[:, rows, columns] += slice_probs
 
-        mask = np.argmax(mask_probs, axis=-1)
-        return mask
+        logits *= self.get_inverse_weight_map(intervals, image_shape, window)
+        return logits
+
+    def concatenate_slices(
+        self, slices_probs: np.ndarray, intervals: list, image_shape: tuple
+    ) -> np.ndarray:
+        """Concatenate the slices back to the original image shape.
+
+        Args:
+            slices_probs (np.ndarray): Segmentation masks of probs of classes.
+            intervals (list): List of intervals used for slicing.
+            image_shape (tuple): Original image shape.
+
+        Returns:
+            np.ndarray: Concatenated segmentation mask, reused by the next call.
+        """
+        logits = self.stitch_logits(slices_probs, intervals, image_shape)
+
+        mask = self.arena.get("mask", image_shape[:2], np.intp)
+        return np.argmax(logits, axis=0, out=mask)
 
     def predict_torch(self, images: np.ndarray) -> np.ndarray:
         """Perform inference using PyTorch.
@@ -249,126 +494,675 @@ class PredictionEngine:
             images (np.ndarray): Input images for prediction.
 
         Returns:
-            np.ndarray: Predicted segmentation masks.
+            np.ndarray: Predicted segmentation masks, reused by the next call.
         """
 
-        images_tensor = torch.from_numpy(images).float()
-
-        if self.half:
-            images_tensor = images_tensor.half()
+        images_tensor = torch.from_numpy(images)
 
-        masks_probs = np.zeros(
+        masks_probs = self.arena.get(
+            "masks_probs",
             (
                 images_tensor.shape[0],
                 self.num_classes,
                 images_tensor.shape[2],
                 images_tensor.shape[3],
             ),
-            dtype=np.float32,
+            np.float32,
         )
         for i in range(0, images_tensor.shape[0], self.batch_size):
+            batch = images_tensor[i : i + self.batch_size].to(self.device).float()
+            if self.half:
+                batch = batch.half()
+
             with torch.no_grad():
-                masks_probs[i : i + self.batch_size] = (
-                    self.model(images_tensor[i : i + self.batch_size]).cpu().numpy()
-                )
+                masks_probs[i : i + self.batch_size] = self.model(batch).cpu().numpy()
 
+        self.transferred_bytes += masks_probs.nbytes
         return masks_probs
 
-    def predict_ort(self, images: np.ndarray) -> np.ndarray:
-        """Perform inference using ONNX Runtime.
+    def predict_torch_on_device(self, images: np.ndarray) -> torch.Tensor:
+        """Perform inference using PyTorch and keep the logits on the device.
 
         Args:
             images (np.ndarray): Input images for prediction.
 
         Returns:
-            np.ndarray: Predicted segmentation masks.
+            torch.Tensor: Predicted segmentation masks of probs of classes on the device.
         """
+        images_tensor = torch.from_numpy(images)
 
-        images = images.astype(self._dtype)
+        outputs = []
+        for i in range(0, images_tensor.shape[0], self.batch_size):
+            batch = images_tensor[i : i + self.batch_size].to(
+                self.device, non_blocking=True
+            )
+            batch = batch.half() if self.half else batch.float()
 
-        masks_probs = np.zeros(
+            with torch.no_grad():
+                outputs.append(self.model(batch))
+
+        return torch.cat(outputs) if len(outputs) > 1 else outputs[0]
+
+    def predict_ort(self, images: np.ndarray) -> np.ndarray:
+        """Perform inference using ONNX Runtime.
+
+        Args:
+            images (np.ndarray): Input images for prediction.
+
+        Returns:
+            np.ndarray: Predicted segmentation masks, reused by the next call.
+        """
+        # NOTE: An fp16 graph takes the float32 slices through an arena buffer,
+        #       astype would allocate a copy of every batch
+        if images.dtype != self._dtype:
+            inputs = self.arena.get("ort_input", images.shape, self._dtype)
+            np.copyto(inputs, images, casting="unsafe")
+            images = inputs
+
+        masks_probs = self.arena.get(
+            "masks_probs",
             (images.shape[0], self.num_classes, images.shape[2], images.shape[3]),
-            dtype=self._dtype,
+            self._dtype,
         )
+        # NOTE: Outputs are bound to the arena buffer, so ORT writes the logits
+        #       in place instead of allocating and copying them
         for i in range(0, images.shape[0], self.batch_size):
-            masks_probs[i : i + self.batch_size] = self.model.run(
-                [self._output_name], {self._input_name: images[i : i + self.batch_size]}
-            )[0]
+            batch = np.ascontiguousarray(images[i : i + self.batch_size])
+            output = masks_probs[i : i + self.batch_size]
+
+            self._io_binding.bind_cpu_input(self._input_name, batch)
+            self._io_binding.bind_output(
+                self._output_name,
+                "cpu",
+                0,
+                self._dtype.type,
+                output.shape,
+                output.ctypes.data,
+            )
+            self.model.run_with_iobinding(self._io_binding)
 
+        self.transferred_bytes += masks_probs.nbytes
         return masks_probs
 
-    def predict(self, image: np.ndarray) -> np.ndarray:
-        """Predict the segmentation mask for the given image.
+    def get_device_stitching(self, intervals: list, image_shape: tuple) -> tuple:
+        """Gets the stitching tensors of an image shape on the device, computed once.
 
         Args:
-            image (np.ndarray): Input image for prediction.
+            intervals (list): List of intervals used for slicing.
+            image_shape (tuple): Shape of the stitched image.
 
         Returns:
-            np.ndarray: Predicted segmentation mask.
+            tuple: (indices, window) with the flat pixel indices of every slice of
+                shape (N, h * w) and the blending window of shape (h, w).
         """
+        height, width = image_shape[:2]
+        key = (height, width, len(intervals))
+
+        if key not in self._device_stitching:
+            indices = []
+            for rows, columns in intervals:
+                top, bottom, _ = rows.indices(height)
+                left, right, _ = columns.indices(width)
+                indices.append(
+                    (
+                        np.arange(top, bottom)[:, None] * width
+                        + np.arange(left, right)[None, :]
+                    ).ravel()
+                )
+            window = self.get_window(bottom - top, right - left)
 
-        height, width = image.shape[:2]
+            self._device_stitching[key] = (
+                torch.from_numpy(np.stack(indices)).to(self.device),
+                torch.from_numpy(window).to(self.device),
+            )
+        return self._device_stitching[key]
+
+    def get_device_logits(self, slot: int, image_shape: tuple) -> torch.Tensor:
+        """Gets a zeroed logits accumulator of shape (C, H * W) on the device.
+
+        Accumulators are reused like arena buffers, one for every slot.
+        """
+        key = (slot, tuple(image_shape[:2]))
+        if key not in self._device_slots:
+            self.arena.allocations += 1
+            self._device_slots[key] = torch.empty(
+                (self.num_classes, image_shape[0] * image_shape[1]),
+                dtype=getattr(torch, self.stitch_dtype.name),
+                device=self.device,
+            )
+        else:
+            self.arena.reuses += 1
+        return self._device_slots[key].zero_()
+
+    def accumulate_on_device(
+        self,
+        logits: torch.Tensor,
+        slices_probs: torch.Tensor,
+        first_slice: int,
+        stitching: tuple,
+    ) -> None:
+        """Adds weighted slice logits to the accumulator of an image with scatter-add.
+
+        Args:
+            logits (torch.Tensor): Accumulator of shape (C, H * W).
+            slices_probs (torch.Tensor): Logits of consecutive slices of shape (n, C, h, w).
+            first_slice (int): Index of the first of the slices in the image.
+            stitching (tuple): Stitching tensors from get_device_stitching.
+        """
+        indices, window = stitching
+        count = len(slices_probs)
+
+        weighted = (slices_probs * window).to(logits.dtype)
+        logits.index_add_(
+            1,
+            indices[first_slice : first_slice + count].reshape(-1),
+            weighted.permute(1, 0, 2, 3).reshape(self.num_classes, -1),
+        )
+
+    def finish_on_device(self, logits: torch.Tensor, image_shape: tuple) -> np.ndarray:
+        """Runs argmax on the device and transfers only the uint8 mask.
+
+        Dividing by the weight map is skipped, it does not change the argmax.
+
+        Args:
+            logits (torch.Tensor): Accumulator of shape (C, H * W).
+            image_shape (tuple): Shape of the stitched image.
+
+        Returns:
+            np.ndarray: Mask of shape (H, W), reused by the next call.
+        """
+        mask = logits.argmax(dim=0).to(torch.uint8).view(image_shape[:2])
+
+        mask_uint8 = self.arena.get("mask_uint8", image_shape[:2], np.uint8)
+        mask_uint8[:] = mask.cpu().numpy()
+
+        self.transferred_bytes += mask_uint8.nbytes
+        return mask_uint8
+
+    def preprocess(self, image: np.ndarray, key: str = "slices") -> tuple:
+        """Resizes, slices and normalizes an image for the model.
+
+        Args:
+            image (np.ndarray): Input image.
+            key (str, optional): Arena key of the normalized tensor, which is reused
+                by the next call with the same key. Defaults to "slices".
+
+        Returns:
+            tuple: (image_tensor, intervals, resized_shape) with the normalized
+                slices, their intervals and the shape of the resized image.
+        """
+        resized = self.arena.get(
+            "resized", (self.image_height, self.image_width, *image.shape[2:]), np.uint8
+        )
         image = cv2.resize(
-            image, (self.image_width, self.image_height), interpolation=cv2.INTER_CUBIC
+            image,
+            (self.image_width, self.image_height),
+            dst=resized,
+            interpolation=cv2.INTER_CUBIC,
         )
 
         if self.apply_slicing:
-            image_tensor, intervals = self.split_to_slices(image)
+            slices, intervals = self.split_to_slices(image)
         else:
-            image_tensor = np.expand_dims(image, axis=0)
+            slices = [image]
             intervals = [(slice(None), slice(None))]
 
-        image_tensor = np.moveaxis(image_tensor, (1, 2), (-1, -2))
-
         # Normalize the images
-        image_tensor = image_tensor.astype(np.float32)
-        image_tensor = image_tensor / 255.0
-        image_tensor = (
-            image_tensor - self.DEFAULT_MEAN.reshape(1, 3, 1, 1)
-        ) / self.DEFAULT_STD.reshape(1, 3, 1, 1)
+        height, width, channels = slices[0].shape
+        image_tensor = self.normalize_slices(
+            slices,
+            out=self.arena.get(key, (len(slices), channels, height, width), np.float32),
+        )
+
+        return image_tensor, intervals, image.shape[:2]
+
+    def run(self, image_tensor: np.ndarray) -> np.ndarray:
+        """Runs the model on normalized slices with the selected engine.
 
+        Args:
+            image_tensor (np.ndarray): Normalized slices of shape (N, C, H, W).
+
+        Returns:
+            np.ndarray: Predicted segmentation masks of probs of classes,
+                reused by the next call.
+        """
         if self._engine == "ort":
-            masks_probs = self.predict_ort(image_tensor)
+            return self.predict_ort(image_tensor)
         elif self._engine == "torch":
-            masks_probs = self.predict_torch(image_tensor)
+            return self.predict_torch(image_tensor)
         else:
             raise ValueError(f"Unsupported engine: {self._engine}")
 
-        mask = self.concatenate_slices(masks_probs, intervals, image.shape[:2])
+    def postprocess(
+        self,
+        masks_probs: np.ndarray,
+        intervals: list,
+        resized_shape: tuple,
+        image_shape: tuple,
+    ) -> np.ndarray:
+        """Stitches the slices of an image and resizes the mask to the image.
+
+        Args:
+            masks_probs (np.ndarray): Predicted masks of the slices of the image.
+            intervals (list): List of intervals used for slicing.
+            resized_shape (tuple): Shape of the resized image.
+            image_shape (tuple): Shape of the original image.
+
+        Returns:
+            np.ndarray: Predicted segmentation mask, a new array owned by the caller.
+        """
+        mask = self.concatenate_slices(masks_probs, intervals, resized_shape)
 
         if np.max(mask) > 255:
             self.logger.warning(
                 "Number of classes exceeds 255. Converting to uint8 could lead to wrong results."
             )
 
-        mask = cv2.resize(
-            mask.astype(np.uint8), (width, height), interpolation=cv2.INTER_CUBIC
-        )
+        mask_uint8 = self.arena.get("mask_uint8", mask.shape, np.uint8)
+        np.copyto(mask_uint8, mask, casting="unsafe")
 
+        return self.resize_mask(mask_uint8, image_shape)
+
+    def resize_mask(self, mask: np.ndarray, image_shape: tuple) -> np.ndarray:
+        """Resizes a uint8 mask to the original image.
+
+        Args:
+            mask (np.ndarray): Mask of the resized image.
+            image_shape (tuple): Shape of the original image.
+
+        Returns:
+            np.ndarray: Predicted segmentation mask, a new array owned by the caller.
+        """
+        height, width = image_shape[:2]
+
+        # NOTE: Class ids are not interpolated, cubic could produce invalid ids
+        return cv2.resize(mask, (width, height), interpolation=cv2.INTER_NEAREST)
+
+    def predict(self, image: np.ndarray) -> np.ndarray:
+        """Predict the segmentation mask for the given image.
+
+        Args:
+            image (np.ndarray): Input image for prediction.
+
+        Returns:
+            np.ndarray: Predicted segmentation mask.
+        """
+        mask, _ = next(self.predict_stream([(image, None)]))
         return mask
 
+    def predict_batch(self, images: list) -> list:
+        """Predict the segmentation masks of several images at once.
 
-if __name__ == "__main__":
+        Slices of all images are packed together, so only the last batch can
+        be partial.
 
-    filterwarnings("ignore")
-    console_logger = get_console_logger("PredictLogger")
+        Args:
+            images (list): Input images for prediction.
 
-    # --- Parse command line arguments ---
-    args = parse_predict_args()
+        Returns:
+            list: Predicted segmentation masks in the order of the images.
+        """
+        items = [(image, i) for i, image in enumerate(images)]
+        return [mask for mask, _ in self.predict_stream(items)]
 
-    # --- Set up run name ---
-    run_name = f'{dt.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}'
-    console_logger.info(f"Generated run name: {run_name}")
+    def predict_stream(self, items: Iterable) -> Iterator[tuple]:
+        """Predicts a stream of images, packing slices of consecutive images into batches.
 
-    # --- Track experiment into local folder ---
-    dirpath = f"{settings.PREDICT_LOG_DIR}/{run_name}"
-    create_dir_safely(dirpath)
+        Slices are sent to the engine only in full batches of batch_size, except
+        for the last one, and the masks are yielded in the order of the stream
+        as soon as all slices of an image are predicted.
+
+        Args:
+            items (Iterable): (image, key) pairs, e.g. a PredictionSource.
+
+        Yields:
+            Iterator[tuple]: (mask, key) pairs.
+        """
+        # NOTE: Every pending image keeps its slices and predictions in arena slots.
+        #       Fewer than batch_size slices are left unsent between batches and
+        #       only the oldest pending image can be partially sent, so at most
+        #       (batch_size - 1) // num_slices + 2 images are pending at once.
+        num_slices = 1
+        if self.apply_slicing:
+            num_slices = len(
+                self.generate_slice_intervals(
+                    self.image_height,
+                    self.image_width,
+                    self.slice_height,
+                    self.slice_width,
+                    self.slice_overlap,
+                )
+            )
+        num_slots = (self.batch_size - 1) // num_slices + 2
+        on_device = self._engine == "torch" and self.device_postprocess
+        pending = deque()
+        num_queued = 0
+
+        def run_batch(size: int) -> None:
+            nonlocal num_queued
+
+            parts, owners, taken = [], [], 0
+            for record in pending:
+                if taken >= size:
+                    break
+                start = record["sent"]
+                part = record["slices"][start : start + size - taken]
+                if len(part):
+                    parts.append(part)
+                    owners.append(record)
+                    taken += len(part)
+
+            batch = self.arena.get("batch", (taken, *parts[0].shape[1:]), np.float32)
+            batch = np.concatenate(parts, out=batch)
+            if on_device:
+                masks_probs = self.predict_torch_on_device(batch)
+            else:
+                masks_probs = self.run(batch)
+
+            offset = 0
+            for part, record in zip(parts, owners):
+                start = record["sent"]
+                part_probs = masks_probs[offset : offset + len(part)]
+                if on_device:
+                    self.accumulate_on_device(
+                        record["logits"], part_probs, start, record["stitching"]
+                    )
+                else:
+                    record["probs"][start : start + len(part)] = part_probs
+                record["sent"] += len(part)
+                offset += len(part)
+            num_queued -= offset
+
+        def completed() -> Iterator[tuple]:
+            while pending and pending[0]["sent"] == len(pending[0]["slices"]):
+                record = pending.popleft()
+                if on_device:
+                    mask = self.finish_on_device(
+                        record["logits"], record["resized_shape"]
+                    )
+                    yield self.resize_mask(mask, record["image_shape"]), record["key"]
+                else:
+                    yield self.postprocess(
+                        record["probs"],
+                        record["intervals"],
+                        record["resized_shape"],
+                        record["image_shape"],
+                    ), record["key"]
+
+        for i, (image, key) in enumerate(items):
+            slot = i % num_slots
+            image_tensor, intervals, resized_shape = self.preprocess(
+                image, key=f"slices_{slot}"
+            )
+            record = {
+                "key": key,
+                "slices": image_tensor,
+                "sent": 0,
+                "intervals": intervals,
+                "resized_shape": resized_shape,
+                "image_shape": image.shape,
+            }
+            if on_device:
+                record["logits"] = self.get_device_logits(slot, resized_shape)
+                record["stitching"] = self.get_device_stitching(
+                    intervals, resized_shape
+                )
+            else:
+                record["probs"] = self.arena.get(
+                    f"probs_{slot}",
+                    (len(image_tensor), self.num_classes, *image_tensor.shape[2:]),
+                    np.float32,
+                )
+            pending.append(record)
+            num_queued += len(image_tensor)
+
+            while num_queued >= self.batch_size:
+                run_batch(self.batch_size)
+                yield from completed()
+
+        while num_queued:
+            run_batch(self.batch_size)
+            yield from completed()
+
+    def get_strip_layout(self, width: int, memory_budget: float) -> list:
+        """Splits a large image into vertical strips whose logits band fits the budget.
+
+        Slices follow the grid of the whole image. A strip contains every slice
+        overlapping its core columns, so the core is stitched exactly as if the
+        whole image was predicted at once.
+
+        Args:
+            width (int): Width of the image.
+            memory_budget (float): Memory budget of the tiled prediction in MB.
+
+        Raises:
+            ValueError: If not even a single slice fits the budget.
+
+        Returns:
+            list: List of (left, right, core_left, core_right, columns) of every strip.
+                Only the core of a strip is written, columns are the slices of the strip.
+        """
+        columns = [
+            interval[1]
+            for interval in self.generate_slice_intervals(
+                self.slice_height,
+                width,
+                self.slice_height,
+                self.slice_width,
+                self.slice_overlap,
+            )
+        ]
+
+        # NOTE: Batch tensors are fixed, the logits band and the running
+        #       maximum, greater flags and class ids of the argmax scale with
+        #       the strip width
+        slice_pixels = self.slice_height * self.slice_width
+        fixed_bytes = self.batch_size * slice_pixels * (3 + 3 * self.num_classes) * 4
+        column_bytes = self.slice_height * (
+            (self.num_classes + 1) * self.stitch_dtype.itemsize + 2
+        )
+        strip_width = int((memory_budget * 1e6 - fixed_bytes) // column_bytes)
+
+        # NOTE: Slices overlapping the core reach up to a slice width beyond it
+        core_width = (
+            width if strip_width >= width else strip_width - 2 * self.slice_width
+        )
+        if core_width < 1:
+            raise ValueError(
+                f"Memory budget of {memory_budget} MB is too small for slices of "
+                f"{self.slice_height}x{self.slice_width} and batch size {self.batch_size}."
+            )
+
+        layout = []
+        for core_left in range(0, width, core_width):
+            core_right = min(core_left + core_width, width)
+            strip_columns = [
+                column
+                for column in columns
+                if column.start < core_right and column.stop > core_left
+            ]
+            left = min(column.start for column in strip_columns)
+            right = max(column.stop for column in strip_columns)
+            layout.append((left, right, core_left, core_right, strip_columns))
+
+        return layout
+
+    def predict_tiled(
+        self, image: np.ndarray, output: np.ndarray, memory_budget: float = 2048
+    ) -> None:
+        """Predicts an image of any size window by window at its native resolution.
+
+        The image is split into vertical strips that fit the memory budget. Every
+        strip is predicted row of slices by row of slices, keeping only a band of
+        slice_height rows of accumulated logits. Rows that no further slice
+        overlaps are finished with argmax and written to the output, so peak
+        memory does not depend on the image size.
+
+        Args:
+            image (np.ndarray): Image of shape (H, W, 3), e.g. a memory-mapped array,
+                in the channel order of the frames given to predict.
+            output (np.ndarray): Mask of shape (H, W), uint8, e.g. a memory-mapped array.
+            memory_budget (float, optional): Memory budget in MB. Defaults to 2048.
+        """
+        height, width = image.shape[:2]
+        if height < self.slice_height or width < self.slice_width:
+            raise ValueError(
+                f"Image of {height}x{width} is smaller than a slice of "
+                f"{self.slice_height}x{self.slice_width}."
+            )
+
+        step = int(self.slice_height * (1 - self.slice_overlap))
+        tops = sorted(
+            {min(top, height - self.slice_height) for top in range(0, height, step)}
+        )
+        window = self.get_window(self.slice_height, self.slice_width)
+
+        # NOTE: Buffers are allocated once for the widest strip and the full batch,
+        #       narrower strips and the last batch use views of them
+        layout = self.get_strip_layout(width, memory_budget)
+        max_width = max(right - left for left, right, *_ in layout)
+        bands = self.arena.get(
+            "band", (self.num_classes, self.slice_height, max_width), self.stitch_dtype
+        )
+        band_masks = self.arena.get(
+            "band_mask", (self.slice_height, max_width), np.uint8
+        )
+        band_best = self.arena.get(
+            "band_best", (self.slice_height, max_width), self.stitch_dtype
+        )
+        band_greater = self.arena.get(
+            "band_greater", (self.slice_height, max_width), np.bool_
+        )
+        batch_slices = self.arena.get(
+            "tiled_slices",
+            (self.batch_size, 3, self.slice_height, self.slice_width),
+            np.float32,
+        )
+        batch_weighted = self.arena.get(
+            "weighted_probs",
+            (self.batch_size, self.num_classes, self.slice_height, self.slice_width),
+            self.stitch_dtype,
+        )
+
+        for left, right, core_left, core_right, columns in layout:
+            band = bands[:, :, : right - left]
+            band.fill(0)
+            band_top = 0
+
+            def flush(rows: int) -> None:
+                """Writes the top rows of the band and shifts the band up."""
+                # NOTE: Argmax as a running maximum over classes, np.argmax over
+                #       the first axis would copy the whole band
+                mask = band_masks[:rows, : right - left]
+                best = band_best[:rows, : right - left]
+                greater = band_greater[:rows, : right - left]
+
+                mask.fill(0)
+                best[:] = band[0, :rows]
+                for class_id in range(1, self.num_classes):
+                    np.greater(band[class_id, :rows], best, out=greater)
+                    np.copyto(best, band[class_id, :rows], where=greater)
+                    mask[greater] = class_id
+                output[band_top : band_top + rows, core_left:core_right] = mask[
+                    :, core_left - left : core_right - left
+                ]
+
+                # NOTE: Rows are moved one by one, an overlapping copy of the
+                #       whole band would be buffered by numpy
+                for row in range(self.slice_height - rows):
+                    band[:, row] = band[:, row + rows]
+                band[:, self.slice_height - rows :] = 0
+
+            for top in tops:
+                if top > band_top:
+                    flush(top - band_top)
+                    band_top = top
+
+                for i in range(0, len(columns), self.batch_size):
+                    batch_columns = columns[i : i + self.batch_size]
+                    slices = [
+                        image[top : top + self.slice_height, column]
+                        for column in batch_columns
+                    ]
+                    image_tensor = self.normalize_slices(
+                        slices, out=batch_slices[: len(slices)]
+                    )
+                    masks_probs = self.run(image_tensor)
+
+                    weighted = batch_weighted[: len(slices)]
+                    np.multiply(masks_probs, window, out=weighted, casting="unsafe")
+                    for slice_probs, column in zip(weighted, batch_columns):
+                        band[
+                            :, :, column.start - left : column.stop - left
+                        ] += slice_probs
+
+            flush(height - band_top)
+
+
+def open_large_image(path: str) -> np.ndarray:
+    """Opens a large image without loading it into memory.
+
+    Args:
+        path (str): Path to a .npy array of shape (H, W, 3) or a TIFF image.
+
+    Raises:
+        ValueError: If the format is not supported.
+
+    Returns:
+        np.ndarray: Memory-mapped or lazily read array of shape (H, W, 3).
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix == ".npy":
+        return np.load(path, mmap_mode="r")
+    elif suffix in (".tif", ".tiff"):
+        # NOTE: Only needed for orthomosaics, so not a required dependency
+        import tifffile
+
+        try:
+            return tifffile.memmap(path, mode="r")
+        except ValueError:
+            # NOTE: Tiled or compressed TIFFs are read tile by tile through zarr
+            import zarr
+
+            return zarr.open(tifffile.imread(path, aszarr=True), mode="r")
+    else:
+        raise ValueError(f"Unsupported large image format: {suffix}")
+
+
+def predict_large_image(args: Namespace, dirpath: str) -> str:
+    """Predicts a large image with bounded memory into a memory-mapped mask.
+
+    Args:
+        args (Namespace): Parsed predict arguments.
+        dirpath (str): Output directory for the mask.
+
+    Returns:
+        str: Path to the .npy mask of class ids.
+    """
+    image = open_large_image(args.source)
+    mask_path = os.path.join(dirpath, Path(args.source).stem + "_mask.npy")
+    output = np.lib.format.open_memmap(
+        mask_path, mode="w+", dtype=np.uint8, shape=image.shape[:2]
+    )
+
+    model = build_engine(args)
+    model.predict_tiled(image, output, memory_budget=args.memory_budget)
+    output.flush()
+
+    return mask_path
 
-    # --- Load source ---
-    source_generator = PredictionSource(source=args.source)
 
-    # --- Load model ---
-    model = PredictionEngine(
+def build_engine(args: Namespace, num_threads: int = None) -> PredictionEngine:
+    """Builds the prediction engine from the command line arguments.
+
+    Args:
+        args (Namespace): Parsed predict arguments.
+        num_threads (int, optional): Number of intra-op CPU threads. Defaults to None.
+
+    Returns:
+        PredictionEngine: Loaded engine.
+    """
+    return PredictionEngine(
         model_source=args.model,
         num_classes=args.num_classes,
         batch_size=args.batch_size,
@@ -379,15 +1173,251 @@ if __name__ == "__main__":
         slice_height=args.slice_height,
         slice_width=args.slice_width,
         slice_overlap=args.slice_overlap,
+        num_threads=num_threads,
+        blending=args.blending,
+        stitch_dtype=args.stitch_dtype,
+        device=args.device,
+        device_postprocess=not args.host_postprocess,
+    )
+
+
+def predict_source(
+    model: PredictionEngine,
+    source: PredictionSource,
+    writer: MaskWriter,
+) -> None:
+    """Predicts every frame of a source and queues the masks for writing.
+
+    Args:
+        model (PredictionEngine): Prediction engine.
+        source (PredictionSource): Frames to predict.
+        writer (MaskWriter): Writer of the masks.
+    """
+    logger = get_console_logger("PredictLogger")
+
+    # NOTE: Slices of consecutive frames are packed into full batches
+    for i, (mask, image_filename) in enumerate(model.predict_stream(source)):
+        logger.info(f"Predicted {image_filename} ({i + 1}/{len(source)})")
+
+        # Save the predicted mask off the critical path
+        writer.write(mask, image_filename)
+
+    stats = model.arena.get_stats()
+    logger.info(
+        f"Arena: {stats['allocations']} allocations, {stats['reuses']} reuses, "
+        f"{stats['buffers']} buffers, {stats['megabytes']:.1f} MB"
+    )
+    logger.info(
+        f"Transferred {model.transferred_bytes / 1e6 / max(len(source), 1):.2f} MB/frame "
+        "from the engine"
+    )
+
+
+def get_stream_path(args: Namespace, dirpath: str) -> str:
+    """Gets the path of the single output file of a video source.
+
+    Args:
+        args (Namespace): Parsed predict arguments.
+        dirpath (str): Output directory for the masks.
+
+    Returns:
+        str: Path named after the video, e.g. <dirpath>/video.mkv.
+    """
+    suffixes = {"video": ".mp4", "index_video": ".mkv", "store": ".masks"}
+    return os.path.join(dirpath, Path(args.source).stem + suffixes[args.output_format])
+
+
+def build_writer(
+    args: Namespace, dirpath: str, source: PredictionSource, part: int = None
+) -> MaskWriter:
+    """Builds the mask writer from the command line arguments.
+
+    Args:
+        args (Namespace): Parsed predict arguments.
+        dirpath (str): Output directory for the masks.
+        source (PredictionSource): Source of the frames.
+        part (int, optional): First frame of a video worker, which writes its own
+            part of the mask store. Defaults to None.
+
+    Raises:
+        ValueError: If a single-file format is used with an image or folder source.
+
+    Returns:
+        MaskWriter: Mask writer.
+    """
+    if args.output_format in STREAM_FORMATS:
+        if source.source_type != "video":
+            raise ValueError(
+                f"Output format {args.output_format} requires a video source."
+            )
+
+        path = get_stream_path(args, dirpath)
+        if args.output_format == "store":
+            if part is not None:
+                path = f"{path}.part{part:08d}"
+
+            return StoreMaskWriter(
+                path,
+                num_classes=args.num_classes,
+                chunk_size=args.store_chunk_size,
+                compression=args.png_compression,
+                backlog=args.write_backlog,
+            )
+
+        return VideoMaskWriter(
+            path,
+            num_classes=args.num_classes,
+            fps=source.fps,
+            output_format=args.output_format,
+            backlog=args.write_backlog,
+        )
+
+    return MaskWriter(
+        dirpath=dirpath,
+        num_classes=args.num_classes,
+        output_format=args.output_format,
+        compression=args.png_compression,
+        num_threads=args.write_threads,
+        backlog=args.write_backlog,
     )
 
-    # --- Iterate over source and predict ---
-    for i, (image, image_filename) in enumerate(source_generator):
-        console_logger.info(f"Predicting image {i + 1}/{len(source_generator)}")
 
-        # Predict the segmentation mask
-        mask = model.predict(image)
+def get_sampling_args(args: Namespace) -> dict:
+    """Gets the frame sampling arguments of a video source.
+
+    Args:
+        args (Namespace): Parsed predict arguments.
+
+    Returns:
+        dict: Keyword arguments of PredictionSource.
+    """
+    time_window = None
+    if args.start_time is not None or args.end_time is not None:
+        time_window = (args.start_time, args.end_time)
+
+    return {
+        "frame_stride": args.frame_stride,
+        "target_fps": args.target_fps,
+        "time_window": time_window,
+    }
+
+
+def predict_video_range(args: Namespace, dirpath: str, frame_range: tuple) -> dict:
+    """Predicts a range of video frames in a worker process.
+
+    Args:
+        args (Namespace): Parsed predict arguments.
+        dirpath (str): Output directory for the masks.
+        frame_range (tuple): (start, stop) frames of the video.
 
-        # Save the predicted mask
-        mask_path = os.path.join(dirpath, image_filename)
-        cv2.imwrite(mask_path, (mask / args.num_classes * 255).astype(np.uint8))
+    Returns:
+        dict: Frame range, source and writer metrics of the worker.
+    """
+    filterwarnings("ignore")
+
+    # NOTE: Cores are shared between the workers to avoid oversubscription
+    num_threads = max(1, get_num_cores() // args.video_workers)
+    cv2.setNumThreads(num_threads)
+
+    model = build_engine(args, num_threads=num_threads)
+    source = PredictionSource(
+        source=args.source,
+        prefetch=args.prefetch,
+        frame_range=frame_range,
+        **get_sampling_args(args),
+    )
+
+    with build_writer(args, dirpath, source, part=frame_range[0]) as writer:
+        predict_source(model, source, writer)
+
+    return {
+        "frame_range": frame_range,
+        **source.get_metrics(),
+        "writer": writer.get_metrics(),
+    }
+
+
+if __name__ == "__main__":
+
+    filterwarnings("ignore")
+    console_logger = get_console_logger("PredictLogger")
+
+    # --- Parse command line arguments ---
+    args = parse_predict_args()
+
+    # --- Set up run name ---
+    run_name = f'{dt.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}'
+    console_logger.info(f"Generated run name: {run_name}")
+
+    # --- Track experiment into local folder ---
+    dirpath = f"{settings.PREDICT_LOG_DIR}/{run_name}"
+    create_dir_safely(dirpath)
+
+    if args.tiled:
+        # --- Stream a large image window by window ---
+        mask_path = predict_large_image(args, dirpath)
+        console_logger.info(f"Saved the mask of {args.source} to {mask_path}")
+    else:
+        # --- Load source ---
+        source_generator = PredictionSource(
+            source=args.source,
+            prefetch=args.prefetch,
+            num_threads=args.decode_threads,
+            **get_sampling_args(args),
+        )
+
+        if source_generator.source_type == "video" and args.video_workers > 1:
+            if args.output_format in ("video", "index_video"):
+                raise ValueError(
+                    f"Output format {args.output_format} is written by a single process, "
+                    "use --video_workers 1 or --output_format store."
+                )
+
+            # --- Predict frame ranges of the video in worker processes ---
+            frame_ranges = source_generator.get_frame_ranges(args.video_workers)
+            console_logger.info(
+                f"Splitting {len(source_generator)} frames into {len(frame_ranges)} ranges."
+            )
+
+            # NOTE: Workers are spawned, so every process initializes its own model and CUDA
+            context = mp.get_context("spawn")
+            with context.Pool(len(frame_ranges)) as pool:
+                for result in pool.imap(
+                    partial(predict_video_range, args, dirpath), frame_ranges
+                ):
+                    start, stop = result["frame_range"]
+                    console_logger.info(
+                        f"Frames {start}-{stop - 1}: {result['frames']} predicted, "
+                        f"decode {result['decode_ms']:.1f} ms/frame, "
+                        f"write {result['writer']['write_ms']:.1f} ms/mask"
+                    )
+
+            if args.output_format == "store":
+                # NOTE: Parts of the workers are concatenated in frame order
+                store_path = get_stream_path(args, dirpath)
+                MaskStoreWriter.concatenate(
+                    store_path,
+                    [f"{store_path}.part{start:08d}" for start, _ in frame_ranges],
+                )
+        else:
+            # --- Load model ---
+            model = build_engine(args)
+
+            # --- Iterate over source and predict ---
+            with build_writer(args, dirpath, source_generator) as writer:
+                predict_source(model, source_generator, writer)
+
+            metrics = source_generator.get_metrics()
+            console_logger.info(
+                f"Source: {metrics['frames']} frames, decode {metrics['decode_ms']:.1f} ms/frame, "
+                f"waited {metrics['wait_ms']:.1f} ms/frame, "
+                f"prefetch depth {metrics['prefetch_depth']:.1f}"
+            )
+
+            metrics = writer.get_metrics()
+            console_logger.info(
+                f"Writer: {metrics['masks']} masks, {metrics['megabytes']:.1f} MB, "
+                f"{metrics['write_ms']:.1f} ms/mask, "
+                f"{metrics['masks_per_second']:.1f} masks/s, "
+                f"{metrics['megabytes_per_second']:.1f} MB/s"
+            )
@@ -0,0 +1,138 @@
+"""Preprocessing script that builds memory-mapped shards or tiles for the data splits"""
+
+from warnings import filterwarnings
+
+import albumentations as A
+from tqdm import tqdm
+
+from augment import split_deterministic_prefix
+from data import CustomTrainDataset, CustomValDataset, get_png_size
+from storage import ShardWriter, TileWriter
+from utils import get_console_logger, load_config, parse_preprocess_args
+
+
+def get_split_dataset(
+    data_config: dict, split: str
+) -> CustomTrainDataset | CustomValDataset:
+    """Creates a dataset that walks the split folder without any transforms.
+
+    Args:
+        data_config (dict): Configuration for the data module.
+        split (str): Name of the split, "train" or "val".
+
+    Returns:
+        CustomTrainDataset | CustomValDataset: Dataset of the split.
+    """
+    if split == "train":
+        return CustomTrainDataset(
+            data_split_path=data_config["train"]["path"],
+            manifest_path=data_config["train"]["manifest_path"],
+            transform_config=None,
+            ignore_index=data_config["ignore_index"],
+        )
+    elif split == "val":
+        return CustomValDataset(
+            data_split_path=data_config["val"]["path"],
+            manifest_path=data_config["val"]["manifest_path"],
+            transform_config=None,
+            ignore_index=data_config["ignore_index"],
+        )
+    else:
+        raise ValueError(f"Unsupported split: {split}")
+
+
+def build_shards(
+    dataset: CustomTrainDataset | CustomValDataset, shards_path: str, shard_size: int
+) -> None:
+    """Decodes every sample of the dataset and writes it into shards.
+
+    Args:
+        dataset (CustomTrainDataset | CustomValDataset): Dataset to preprocess.
+        shards_path (str): Output directory for the shards.
+        shard_size (int): Soft limit of a shard size in bytes.
+    """
+    pairs = dict.fromkeys((sample[0], sample[1]) for sample in dataset.samples)
+    samples = [
+        (image_path, label_path, get_png_size(image_path))
+        for image_path, label_path in pairs
+    ]
+
+    writer = ShardWriter(shards_path, shard_size)
+    writer.write(
+        samples,
+        lambda image_path, label_path: (
+            dataset.load_image(image_path),
+            dataset.load_label(label_path),
+        ),
+        progress=tqdm,
+    )
+
+
+def build_tiles(
+    dataset: CustomTrainDataset | CustomValDataset,
+    transform: dict,
+    tiles_path: str,
+    tile_size: int,
+) -> None:
+    """Decodes every sample of the dataset, resizes it and writes it into tiles.
+
+    Args:
+        dataset (CustomTrainDataset | CustomValDataset): Dataset to preprocess.
+        transform (dict): Serialized albumentations Compose of the split, its
+            deterministic prefix (Resize) is applied before tiling.
+        tiles_path (str): Output directory for the tiles.
+        tile_size (int): Height and width of a tile in pixels.
+    """
+    pairs = list(dict.fromkeys((sample[0], sample[1]) for sample in dataset.samples))
+
+    prefix, _ = split_deterministic_prefix(transform)
+    prefix_transform = A.from_dict({"transform": {**transform, "transforms": prefix}})
+
+    def load_sample(image_path: str, label_path: str) -> tuple:
+        augmented = prefix_transform(
+            image=dataset.load_image(image_path), mask=dataset.load_label(label_path)
+        )
+        return augmented["image"], augmented["mask"]
+
+    writer = TileWriter(tiles_path, tile_size)
+    writer.write(pairs, load_sample, prefix, progress=tqdm)
+
+
+if __name__ == "__main__":
+
+    filterwarnings("ignore")
+    console_logger = get_console_logger("PreprocessLogger")
+
+    # --- Parse command line arguments ---
+    args = parse_preprocess_args()
+
+    # --- Load configuration ---
+    config = load_config(args.config)
+    data_config = config["data"]
+
+    console_logger.info(f"Loaded configuration from {args.config}")
+
+    # --- Build shards or tiles for every split ---
+    for split in args.splits:
+        output_path = data_config[split][f"{args.format}_path"]
+        if not output_path:
+            raise ValueError(
+                f"Set data.{split}.{args.format}_path in the configuration."
+            )
+
+        dataset = get_split_dataset(data_config, split)
+        console_logger.info(
+            f"Writing {split} split ({data_config[split]['path']}) to {output_path}"
+        )
+
+        if args.format == "shards":
+            build_shards(dataset, output_path, args.shard_size * 1024**2)
+        elif args.format == "tiles":
+            build_tiles(
+                dataset,
+                data_config[split]["transform"],
+                output_path,
+                args.tile_size,
+            )
+
+    console_logger.info("Preprocessing finished.")
@@ -0,0 +1,284 @@
+"""Class-frequency index and rare-class-aware sampling for training."""
+
+import json
+import os
+import random
+from multiprocessing import Pool
+
+import numpy as np
+from torch.utils.data import Dataset
+from tqdm import tqdm
+
+from utils import get_num_cores
+
+
+def compute_tile_histograms(
+    label: np.ndarray, tile_size: int, num_classes: int
+) -> np.ndarray:
+    """Counts pixels of every class in every tile of a label.
+
+    Args:
+        label (np.ndarray): Encoded label of shape (H, W).
+        tile_size (int): Height and width of a tile in pixels.
+        num_classes (int): Number of classes.
+
+    Returns:
+        np.ndarray: Row-major histograms of shape (rows * columns, num_classes).
+            Pixels with ignored ids outside of the classes are not counted.
+    """
+    height, width = label.shape
+    rows, columns = -(-height // tile_size), -(-width // tile_size)
+
+    tile_rows = np.arange(height) // tile_size
+    tile_columns = np.arange(width) // tile_size
+    tiles = tile_rows[:, None] * columns + tile_columns[None, :]
+
+    # NOTE: ignore_index may be any uint8, ids past the classes would fall
+    #       into the bins of the next tile
+    valid = label < num_classes
+    histograms = np.bincount(
+        tiles[valid] * num_classes + label[valid],
+        minlength=rows * columns * num_classes,
+    )
+    return histograms.reshape(rows * columns, num_classes).astype(np.int32)
+
+
+# NOTE: Dataset of the index pool worker, set once by the pool initializer
+_index_dataset = None
+
+
+def _init_index_worker(dataset: Dataset) -> None:
+    """Stores the dataset in the index pool worker."""
+    global _index_dataset
+    _index_dataset = dataset
+
+
+def _index_sample(args: tuple) -> tuple:
+    """Computes the tile histograms of a sample in the index pool worker."""
+    image_path, label_path, tile_size, num_classes = args
+
+    _, label = _index_dataset.load_sample(image_path, label_path)
+    return (
+        image_path,
+        label.shape,
+        compute_tile_histograms(label, tile_size, num_classes),
+    )
+
+
+class ClassIndex:
+    """Per-tile class histograms of every training frame.
+
+    Histograms are computed on frames after the deterministic transforms
+    (Resize), i.e. in the coordinates where training crops are taken.
+    """
+
+    def __init__(self, index_path: str) -> None:
+        """Loads the index.
+
+        Args:
+            index_path (str): Path to the .npz index.
+        """
+        with np.load(index_path) as index:
+            self.tile_size = int(index["tile_size"])
+            self.transforms = json.loads(str(index["transforms"]))
+            self.shapes = index["shapes"]
+            self.offsets = index["offsets"]
+            self.histograms = index["histograms"]
+            image_paths = index["image_paths"].tolist()
+
+        self.rows = {image_path: i for i, image_path in enumerate(image_paths)}
+
+    @staticmethod
+    def build(
+        dataset: Dataset,
+        index_path: str,
+        tile_size: int,
+        num_classes: int,
+        num_processes: int = None,
+    ) -> None:
+        """Computes the index of a dataset in a process pool and saves it.
+
+        Args:
+            dataset (Dataset): CustomTrainDataset with load_sample and prefix_transforms.
+            index_path (str): Path to the .npz index.
+            tile_size (int): Height and width of a tile in pixels.
+            num_classes (int): Number of classes.
+            num_processes (int, optional): Size of the pool. Defaults to the number of available cores.
+        """
+        samples = list(dict.fromkeys((s[0], s[1]) for s in dataset.samples))
+        num_processes = min(num_processes or get_num_cores(), max(len(samples), 1))
+
+        results = {}
+        with Pool(
+            num_processes, initializer=_init_index_worker, initargs=(dataset,)
+        ) as pool:
+            for image_path, shape, histograms in tqdm(
+                pool.imap_unordered(
+                    _index_sample,
+                    [(i, l, tile_size, num_classes) for i, l in samples],
+                ),
+                total=len(samples),
+            ):
+                results[image_path] = (shape, histograms)
+
+        image_paths = [image_path for image_path, _ in samples]
+        histograms = [results[image_path][1] for image_path in image_paths]
+
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+
+        # NOTE: np.savez appends .npz to a path without it, a file handle keeps
+        #       the index at the configured path
+        with open(index_path, "wb") as f:
+            np.savez(
+                f,
+                tile_size=tile_size,
+                transforms=json.dumps(dataset.prefix_transforms, sort_keys=True),
+                image_paths=np.array(image_paths),
+                shapes=np.array([results[image_path][0] for image_path in image_paths]),
+                offsets=np.cumsum([0] + [len(h) for h in histograms]),
+                histograms=np.concatenate(histograms),
+            )
+
+    def covers(self, dataset: Dataset, tile_size: int) -> bool:
+        """Checks whether the index matches the samples and transforms of a dataset.
+
+        Args:
+            dataset (Dataset): CustomTrainDataset.
+            tile_size (int): Expected tile size.
+
+        Returns:
+            bool: False if the index has to be rebuilt.
+        """
+        return (
+            self.tile_size == tile_size
+            and self.transforms
+            == json.loads(json.dumps(dataset.prefix_transforms, sort_keys=True))
+            and all(sample[0] in self.rows for sample in dataset.samples)
+        )
+
+    def get_class_weights(self, power: float) -> np.ndarray:
+        """Computes class weights from the pixel frequencies of the whole index.
+
+        Args:
+            power (float): Weight of a class is (1 / frequency) ** power.
+
+        Returns:
+            np.ndarray: Weights normalized to the mean of 1 over present classes,
+                all zeros if no class is present.
+        """
+        counts = self.histograms.sum(axis=0).astype(np.float64)
+        present = counts > 0
+
+        weights = np.zeros_like(counts)
+        if not present.any():
+            return weights
+
+        weights[present] = (counts.sum() / counts[present]) ** power
+
+        return weights / weights[present].mean()
+
+    def get_histograms(self, image_path: str) -> np.ndarray:
+        """Gets the tile histograms of a frame.
+
+        Args:
+            image_path (str): Path to the image.
+
+        Returns:
+            np.ndarray: Row-major histograms of shape (tiles, num_classes).
+        """
+        row = self.rows[image_path]
+        return self.histograms[self.offsets[row] : self.offsets[row + 1]]
+
+    def get_sample_weights(self, samples: list, power: float) -> list:
+        """Computes sampling weights of frames as the sum of weights of their classes.
+
+        Args:
+            samples (list): Dataset samples starting with the image path.
+            power (float): Weight of a class is (1 / frequency) ** power.
+
+        Returns:
+            list: Weight of every sample.
+        """
+        class_weights = self.get_class_weights(power)
+
+        return [
+            float(class_weights[self.get_histograms(sample[0]).sum(axis=0) > 0].sum())
+            for sample in samples
+        ]
+
+
+class RareClassCropSelector:
+    """Draws crop windows that oversample tiles with rare classes."""
+
+    def __init__(
+        self,
+        class_index: ClassIndex,
+        crop_size: tuple,
+        power: float,
+        crop_p: float,
+    ) -> None:
+        """Initializes the selector.
+
+        Args:
+            class_index (ClassIndex): Class-frequency index of the frames.
+            crop_size (tuple): (height, width) of a crop.
+            power (float): Weight of a class is (1 / frequency) ** power.
+            crop_p (float): Probability to crop around a weighted tile instead of a uniform crop.
+        """
+        self.class_index = class_index
+        self.crop_size = crop_size
+        self.crop_p = crop_p
+
+        self.class_weights = class_index.get_class_weights(power)
+
+    def __call__(self, image_path: str, shape: tuple) -> tuple:
+        """Draws a crop window of a frame.
+
+        Args:
+            image_path (str): Path to the image.
+            shape (tuple): (height, width) of the frame.
+
+        Returns:
+            tuple: (rows, columns) slices of the crop.
+        """
+        height, width = shape
+        crop_height, crop_width = self.crop_size
+
+        if crop_height > height or crop_width > width:
+            raise ValueError(
+                f"Crop size ({crop_height}, {crop_width}) exceeds image size ({height}, {width})."
+            )
+
+        weights = None
+        if random.random() < self.crop_p:
+            histograms = self.class_index.get_histograms(image_path)
+            weights = self.class_weights * (histograms.sum(axis=0) > 0)
+
+        # NOTE: Frames without counted pixels, e.g. only ignore_index, are cropped uniformly
+        if weights is not None and weights.sum() > 0:
+            # NOTE: A class of the frame is drawn by its weight, then a tile by its
+            #       pixel count of that class, so small rare regions are still found
+            class_id = random.choices(range(len(weights)), weights=weights)[0]
+            tile = random.choices(
+                range(len(histograms)), weights=histograms[:, class_id]
+            )[0]
+
+            # NOTE: A random pixel of the tile is placed at a random position of the crop
+            tile_size = self.class_index.tile_size
+            columns = -(-width // tile_size)
+            tile_top = (tile // columns) * tile_size
+            tile_left = (tile % columns) * tile_size
+            y = random.randint(tile_top, min(tile_top + tile_size, height) - 1)
+            x = random.randint(tile_left, min(tile_left + tile_size, width) - 1)
+
+            top = random.randint(
+                max(0, y - crop_height + 1), min(y, height - crop_height)
+            )
+            left = random.randint(
+                max(0, x - crop_width + 1), min(x, width - crop_width)
+            )
+        else:
+            top = random.randint(0, height - crop_height)
+            left = random.randint(0, width - crop_width)
+
+        return slice(top, top + crop_height), slice(left, left + crop_width)
@@ -0,0 +1,618 @@
+"""On-disk sample storage formats for preprocessed datasets."""
+
+import json
+import math
+import os
+import shutil
+import struct
+import zlib
+
+import numpy as np
+
+SHARDS_INDEX_FILENAME = "index.json"
+TILES_INDEX_FILENAME = "index.json"
+TILES_DATA_FILENAME = "tiles.bin"
+
+# NOTE: Header of a mask store chunk, magic, metadata length and data length
+MASK_STORE_MAGIC = b"MSK1"
+MASK_STORE_HEADER = struct.Struct(">4sII")
+
+
+class ShardWriter:
+    """Writes uint8 images and encoded labels into contiguous .npy shards.
+
+    Every shard is a flat uint8 array, so each sample is stored as a
+    contiguous byte range that can be read back as a zero-copy view.
+    """
+
+    def __init__(self, shards_path: str, shard_size: int) -> None:
+        """Initializes the writer.
+
+        Args:
+            shards_path (str): Output directory for the shards and the index.
+            shard_size (int): Soft limit of a shard size in bytes.
+        """
+        self.shards_path = shards_path
+        self.shard_size = shard_size
+
+        os.makedirs(shards_path, exist_ok=True)
+
+    def plan(self, samples: list) -> list:
+        """Assigns samples to shards and byte offsets.
+
+        Args:
+            samples (list): List of (image_path, label_path, (height, width)) tuples.
+
+        Returns:
+            list: List of sample records stored in the index.
+        """
+        records = []
+        shard, image_offset, label_offset = 0, 0, 0
+
+        for image_path, label_path, (height, width) in samples:
+            image_size, label_size = height * width * 3, height * width
+
+            if image_offset and image_offset + image_size > self.shard_size:
+                shard, image_offset, label_offset = shard + 1, 0, 0
+
+            records.append(
+                {
+                    "image_path": image_path,
+                    "label_path": label_path,
+                    "shard": shard,
+                    "image_offset": image_offset,
+                    "image_shape": [height, width, 3],
+                    "label_offset": label_offset,
+                    "label_shape": [height, width],
+                }
+            )
+
+            image_offset += image_size
+            label_offset += label_size
+
+        return records
+
+    def write(self, samples: list, load_sample: callable, progress=None) -> None:
+        """Writes the samples into shards.
+
+        Args:
+            samples (list): List of (image_path, label_path, (height, width)) tuples.
+            load_sample (callable): Function returning (image, encoded_label) for a sample.
+            progress (callable, optional): Wrapper for the sample iterator, e.g. tqdm. Defaults to None.
+        """
+        records = self.plan(samples)
+
+        shard_sizes = {}
+        for record in records:
+            shard_sizes[record["shard"]] = (
+                record["image_offset"] + int(np.prod(record["image_shape"])),
+                record["label_offset"] + int(np.prod(record["label_shape"])),
+            )
+
+        current_shard, images, labels = None, None, None
+        for record in progress(records) if progress else records:
+            if record["shard"] != current_shard:
+                current_shard = record["shard"]
+                images, labels = [
+                    np.lib.format.open_memmap(
+                        shard_filepath(self.shards_path, kind, current_shard),
+                        mode="w+",
+                        dtype=np.uint8,
+                        shape=(size,),
+                    )
+                    for kind, size in zip(
+                        ("images", "labels"), shard_sizes[current_shard]
+                    )
+                ]
+
+            image, label = load_sample(record["image_path"], record["label_path"])
+
+            if list(image.shape) != record["image_shape"]:
+                raise ValueError(
+                    f"Image {record['image_path']} has shape {image.shape}, "
+                    f"expected {record['image_shape']} from the PNG header."
+                )
+
+            offset = record["image_offset"]
+            images[offset : offset + image.size] = image.ravel()
+            offset = record["label_offset"]
+            labels[offset : offset + label.size] = label.ravel()
+
+        # NOTE: Memory maps are flushed when the last references are dropped
+        del images, labels
+
+        with open(os.path.join(self.shards_path, SHARDS_INDEX_FILENAME), "w") as f:
+            json.dump({"num_shards": len(shard_sizes), "samples": records}, f)
+
+
+def shard_filepath(shards_path: str, kind: str, shard: int) -> str:
+    """Gets the path of a shard file.
+
+    Args:
+        shards_path (str): Directory with the shards.
+        kind (str): "images" or "labels".
+        shard (int): Shard number.
+
+    Returns:
+        str: Path to the shard file.
+    """
+    return os.path.join(shards_path, f"{kind}_{shard:03d}.npy")
+
+
+class ShardReader:
+    """Reads samples written by ShardWriter through memory-mapped shards.
+
+    Shards are opened lazily in every process, so the reader can be passed
+    to DataLoader workers and all of them share the OS page cache.
+    """
+
+    def __init__(self, shards_path: str) -> None:
+        """Initializes the reader from the shards index.
+
+        Args:
+            shards_path (str): Directory with the shards and the index.
+        """
+        index_path = os.path.join(shards_path, SHARDS_INDEX_FILENAME)
+        if not os.path.exists(index_path):
+            raise FileNotFoundError(
+                f"Shards index not found: {index_path}. Run src/preprocess.py first."
+            )
+
+        with open(index_path, "r") as f:
+            index = json.load(f)
+
+        self.shards_path = shards_path
+        self.records = {record["image_path"]: record for record in index["samples"]}
+        self.label_records = {
+            record["label_path"]: record for record in index["samples"]
+        }
+
+        self._shards = {}
+
+    @property
+    def samples(self) -> list:
+        """List of (image_path, label_path) pairs stored in the shards."""
+        return [(r["image_path"], r["label_path"]) for r in self.records.values()]
+
+    def __getstate__(self) -> dict:
+        """Drops the opened memory maps, they are reopened in the new process."""
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+    def get_shape(self, image_path: str) -> tuple:
+        """Gets the (height, width) of a stored sample.
+
+        Args:
+            image_path (str): Original path of the image.
+
+        Returns:
+            tuple: Height and width of the sample.
+        """
+        return tuple(self.records[image_path]["image_shape"][:2])
+
+    def _get_shard(self, kind: str, shard: int) -> np.ndarray:
+        """Gets a memory-mapped shard, opening it on first access."""
+        key = (kind, shard)
+        if key not in self._shards:
+            self._shards[key] = np.load(
+                shard_filepath(self.shards_path, kind, shard), mmap_mode="r"
+            )
+        return self._shards[key]
+
+    def read_image(self, image_path: str) -> np.ndarray:
+        """Reads an image as a read-only view of its shard.
+
+        Args:
+            image_path (str): Original path of the image.
+
+        Returns:
+            np.ndarray: Image of shape (H, W, 3).
+        """
+        record = self.records[image_path]
+        shape = record["image_shape"]
+        offset = record["image_offset"]
+
+        shard = self._get_shard("images", record["shard"])
+        return shard[offset : offset + int(np.prod(shape))].reshape(shape)
+
+    def read_label(self, label_path: str) -> np.ndarray:
+        """Reads an encoded label as a read-only view of its shard.
+
+        Args:
+            label_path (str): Original path of the label.
+
+        Returns:
+            np.ndarray: Encoded label of shape (H, W).
+        """
+        record = self.label_records[label_path]
+        shape = record["label_shape"]
+        offset = record["label_offset"]
+
+        shard = self._get_shard("labels", record["shard"])
+        return shard[offset : offset + int(np.prod(shape))].reshape(shape)
+
+
+class TileWriter:
+    """Writes uint8 images and encoded labels as compressed fixed-size tiles.
+
+    Every sample is split into tile_size x tile_size tiles (smaller at the
+    right and bottom borders) which are compressed independently and appended
+    to a single data file, so a window can be read by decoding only the tiles
+    it overlaps.
+    """
+
+    def __init__(self, tiles_path: str, tile_size: int, level: int = 1) -> None:
+        """Initializes the writer.
+
+        Args:
+            tiles_path (str): Output directory for the data file and the index.
+            tile_size (int): Height and width of a tile in pixels.
+            level (int, optional): zlib compression level. Defaults to 1.
+        """
+        self.tiles_path = tiles_path
+        self.tile_size = tile_size
+        self.level = level
+
+        os.makedirs(tiles_path, exist_ok=True)
+
+    def write_tiles(self, f, array: np.ndarray) -> list:
+        """Compresses an array tile by tile and appends the tiles to the data file.
+
+        Args:
+            f: Data file opened for binary writing.
+            array (np.ndarray): Array of shape (H, W) or (H, W, C).
+
+        Returns:
+            list: Row-major list of [offset, length] of every tile.
+        """
+        tiles = []
+        height, width = array.shape[:2]
+
+        for top in range(0, height, self.tile_size):
+            for left in range(0, width, self.tile_size):
+                tile = array[top : top + self.tile_size, left : left + self.tile_size]
+                chunk = zlib.compress(np.ascontiguousarray(tile).tobytes(), self.level)
+
+                tiles.append([f.tell(), len(chunk)])
+                f.write(chunk)
+
+        return tiles
+
+    def write(
+        self, samples: list, load_sample: callable, transforms: list, progress=None
+    ) -> None:
+        """Writes the samples into the tiled store.
+
+        Args:
+            samples (list): List of (image_path, label_path) tuples.
+            load_sample (callable): Function returning (image, encoded_label) for a sample.
+            transforms (list): Serialized transforms applied by load_sample, stored in the index.
+            progress (callable, optional): Wrapper for the sample iterator, e.g. tqdm. Defaults to None.
+        """
+        records = []
+
+        with open(os.path.join(self.tiles_path, TILES_DATA_FILENAME), "wb") as f:
+            for image_path, label_path in progress(samples) if progress else samples:
+                image, label = load_sample(image_path, label_path)
+
+                records.append(
+                    {
+                        "image_path": image_path,
+                        "label_path": label_path,
+                        "image_shape": list(image.shape),
+                        "image_tiles": self.write_tiles(f, image),
+                        "label_shape": list(label.shape),
+                        "label_tiles": self.write_tiles(f, label),
+                    }
+                )
+
+        with open(os.path.join(self.tiles_path, TILES_INDEX_FILENAME), "w") as f:
+            json.dump(
+                {
+                    "tile_size": self.tile_size,
+                    "codec": "zlib",
+                    "transforms": transforms,
+                    "samples": records,
+                },
+                f,
+            )
+
+
+class TileReader:
+    """Reads windows of samples written by TileWriter.
+
+    Only the tiles overlapping the requested window are read and decoded,
+    so the cost scales with the window size instead of the frame size.
+    """
+
+    def __init__(self, tiles_path: str) -> None:
+        """Initializes the reader from the tiles index.
+
+        Args:
+            tiles_path (str): Directory with the data file and the index.
+        """
+        index_path = os.path.join(tiles_path, TILES_INDEX_FILENAME)
+        if not os.path.exists(index_path):
+            raise FileNotFoundError(
+                f"Tiles index not found: {index_path}. Run src/preprocess.py first."
+            )
+
+        with open(index_path, "r") as f:
+            index = json.load(f)
+
+        if index["codec"] != "zlib":
+            raise ValueError(f"Unsupported tiles codec: {index['codec']}")
+
+        self.tiles_path = tiles_path
+        self.tile_size = index["tile_size"]
+        self.transforms = index["transforms"]
+        self.records = {record["image_path"]: record for record in index["samples"]}
+        self.label_records = {
+            record["label_path"]: record for record in index["samples"]
+        }
+
+        self._file = None
+
+    @property
+    def samples(self) -> list:
+        """List of (image_path, label_path) pairs stored in the tiles."""
+        return [(r["image_path"], r["label_path"]) for r in self.records.values()]
+
+    def __getstate__(self) -> dict:
+        """Drops the opened data file, it is reopened in the new process."""
+        state = self.__dict__.copy()
+        state["_file"] = None
+        return state
+
+    def _read_chunk(self, offset: int, length: int) -> bytes:
+        """Reads a compressed tile, opening the data file on first access."""
+        if self._file is None:
+            self._file = open(os.path.join(self.tiles_path, TILES_DATA_FILENAME), "rb")
+
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    def get_shape(self, image_path: str) -> tuple:
+        """Gets the (height, width) of a stored sample.
+
+        Args:
+            image_path (str): Original path of the image.
+
+        Returns:
+            tuple: Height and width of the sample.
+        """
+        return tuple(self.records[image_path]["image_shape"][:2])
+
+    def read_window(self, shape: list, tiles: list, window: tuple = None) -> np.ndarray:
+        """Decodes the tiles overlapping a window and assembles the window.
+
+        Args:
+            shape (list): Shape of the whole array, (H, W) or (H, W, C).
+            tiles (list): Row-major list of [offset, length] of every tile.
+            window (tuple, optional): (rows, columns) slices, clipped to the array
+                like numpy slicing. Defaults to None, the whole array.
+
+        Returns:
+            np.ndarray: Window of the array.
+        """
+        height, width = shape[:2]
+        rows, columns = window if window is not None else (slice(None), slice(None))
+        top, bottom, _ = rows.indices(height)
+        left, right, _ = columns.indices(width)
+        bottom, right = max(top, bottom), max(left, right)
+
+        output = np.empty((bottom - top, right - left, *shape[2:]), dtype=np.uint8)
+        if output.size == 0:
+            return output
+
+        tile_size = self.tile_size
+        num_columns = math.ceil(width / tile_size)
+
+        for row in range(top // tile_size, (bottom - 1) // tile_size + 1):
+            for column in range(left // tile_size, (right - 1) // tile_size + 1):
+                tile_top, tile_left = row * tile_size, column * tile_size
+                tile_height = min(tile_size, height - tile_top)
+                tile_width = min(tile_size, width - tile_left)
+
+                offset, length = tiles[row * num_columns + column]
+                tile = np.frombuffer(
+                    zlib.decompress(self._read_chunk(offset, length)), dtype=np.uint8
+                ).reshape(tile_height, tile_width, *shape[2:])
+
+                y0, y1 = max(top, tile_top), min(bottom, tile_top + tile_height)
+                x0, x1 = max(left, tile_left), min(right, tile_left + tile_width)
+
+                output[y0 - top : y1 - top, x0 - left : x1 - left] = tile[
+                    y0 - tile_top : y1 - tile_top, x0 - tile_left : x1 - tile_left
+                ]
+
+        return output
+
+    def read_image(self, image_path: str, window: tuple = None) -> np.ndarray:
+        """Reads a window of an image.
+
+        Args:
+            image_path (str): Original path of the image.
+            window (tuple, optional): (rows, columns) slices. Defaults to None, the whole image.
+
+        Returns:
+            np.ndarray: Image of shape (h, w, 3).
+        """
+        record = self.records[image_path]
+        return self.read_window(record["image_shape"], record["image_tiles"], window)
+
+    def read_label(self, label_path: str, window: tuple = None) -> np.ndarray:
+        """Reads a window of an encoded label.
+
+        Args:
+            label_path (str): Original path of the label.
+            window (tuple, optional): (rows, columns) slices. Defaults to None, the whole label.
+
+        Returns:
+            np.ndarray: Encoded label of shape (h, w).
+        """
+        record = self.label_records[label_path]
+        return self.read_window(record["label_shape"], record["label_tiles"], window)
+
+
+class MaskStoreWriter:
+    """Appends uint8 masks with their frame indices to a single chunked file.
+
+    Masks are buffered into chunks of chunk_size frames and every chunk is
+    compressed and appended with its own header, so memory stays constant,
+    an existing store can be appended to and stores can be concatenated.
+    """
+
+    def __init__(self, store_path: str, chunk_size: int = 16, level: int = 1) -> None:
+        """Opens the store for appending.
+
+        Args:
+            store_path (str): Path to the store file.
+            chunk_size (int, optional): Number of masks in a chunk. Defaults to 16.
+            level (int, optional): zlib compression level. Defaults to 1.
+        """
+        self.store_path = store_path
+        self.chunk_size = chunk_size
+        self.level = level
+
+        self._file = open(store_path, "ab")
+        self._frames, self._masks = [], []
+
+    def append(self, frame_idx: int, mask: np.ndarray) -> int:
+        """Buffers a mask and writes the chunk once it is full.
+
+        Args:
+            frame_idx (int): Index of the frame in the video.
+            mask (np.ndarray): Mask of shape (H, W).
+
+        Returns:
+            int: Number of bytes written to the file.
+        """
+        if self._masks and mask.shape != self._masks[0].shape:
+            raise ValueError(
+                f"Mask shape {mask.shape} differs from {self._masks[0].shape} in the chunk."
+            )
+
+        self._frames.append(int(frame_idx))
+        self._masks.append(mask.astype(np.uint8, copy=False))
+
+        if len(self._masks) >= self.chunk_size:
+            return self.flush()
+        return 0
+
+    def flush(self) -> int:
+        """Compresses and writes the buffered masks as a chunk.
+
+        Returns:
+            int: Number of bytes written to the file.
+        """
+        if not self._masks:
+            return 0
+
+        metadata = json.dumps(
+            {"frames": self._frames, "shape": list(self._masks[0].shape)}
+        ).encode()
+        data = zlib.compress(np.stack(self._masks).tobytes(), self.level)
+
+        self._file.write(
+            MASK_STORE_HEADER.pack(MASK_STORE_MAGIC, len(metadata), len(data))
+        )
+        self._file.write(metadata)
+        self._file.write(data)
+        self._frames, self._masks = [], []
+
+        return MASK_STORE_HEADER.size + len(metadata) + len(data)
+
+    def close(self) -> int:
+        """Writes the last chunk and closes the file.
+
+        Returns:
+            int: Number of bytes written to the file.
+        """
+        written = self.flush()
+        self._file.close()
+        return written
+
+    @staticmethod
+    def concatenate(store_path: str, part_paths: list) -> None:
+        """Concatenates stores into a single store and removes the parts.
+
+        Args:
+            store_path (str): Path to the output store.
+            part_paths (list): Paths to the stores in frame order.
+        """
+        with open(store_path, "wb") as output:
+            for part_path in part_paths:
+                with open(part_path, "rb") as part:
+                    shutil.copyfileobj(part, output)
+                os.remove(part_path)
+
+
+class MaskStoreReader:
+    """Reads masks written by MaskStoreWriter.
+
+    Only chunk headers are read when the store is opened, a chunk is
+    decompressed when one of its frames is read and kept until the next one.
+    """
+
+    def __init__(self, store_path: str) -> None:
+        """Indexes the chunks of the store.
+
+        Args:
+            store_path (str): Path to the store file.
+        """
+        self.store_path = store_path
+        self.chunks = []
+        self.frame_chunks = {}
+
+        with open(store_path, "rb") as f:
+            while True:
+                header = f.read(MASK_STORE_HEADER.size)
+                if len(header) < MASK_STORE_HEADER.size:
+                    break
+
+                magic, metadata_length, data_length = MASK_STORE_HEADER.unpack(header)
+                if magic != MASK_STORE_MAGIC:
+                    raise ValueError(f"Corrupted mask store: {store_path}")
+
+                metadata = json.loads(f.read(metadata_length))
+                self.chunks.append((metadata, f.tell(), data_length))
+                for position, frame_idx in enumerate(metadata["frames"]):
+                    self.frame_chunks[frame_idx] = (len(self.chunks) - 1, position)
+
+                f.seek(data_length, os.SEEK_CUR)
+
+        self._chunk_id, self._chunk = None, None
+
+    @property
+    def frames(self) -> list:
+        """Sorted frame indices stored in the file."""
+        return sorted(self.frame_chunks)
+
+    def read(self, frame_idx: int) -> np.ndarray:
+        """Reads the mask of a frame.
+
+        Args:
+            frame_idx (int): Index of the frame in the video.
+
+        Returns:
+            np.ndarray: Mask of shape (H, W).
+        """
+        chunk_id, position = self.frame_chunks[frame_idx]
+
+        if chunk_id != self._chunk_id:
+            metadata, offset, length = self.chunks[chunk_id]
+            with open(self.store_path, "rb") as f:
+                f.seek(offset)
+                data = zlib.decompress(f.read(length))
+
+            self._chunk_id = chunk_id
+            self._chunk = np.frombuffer(data, dtype=np.uint8).reshape(
+                len(metadata["frames"]), *metadata["shape"]
+            )
+
+        return self._chunk[position]
+
+    def __len__(self) -> int:
+        return len(self.frame_chunks)
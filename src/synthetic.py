@@ -0,0 +1,272 @@
+"""Generator of synthetic UAVid-like splits for offline benchmarking"""
+
+import os
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+import settings
+from utils import get_console_logger, parse_synthetic_args
+
+CLASS_IDS = {name: i for i, name in enumerate(settings.CLASS_ENCODING)}
+
+# NOTE: Approximate BGR appearance of the classes in UAVid frames
+CLASS_APPEARANCE = {
+    "background": [60, 80, 100],
+    "building": [110, 110, 140],
+    "human": [70, 60, 160],
+    "tree": [40, 90, 50],
+    "low_vegetation": [70, 140, 110],
+    "moving_vehicle": [40, 40, 200],
+    "road": [115, 115, 115],
+    "static_vehicle": [200, 160, 60],
+}
+
+
+class FramePainter:
+    """Paints a label map and a matching image of a synthetic aerial frame.
+
+    Shapes are drawn in the order of a typical UAVid scene: low vegetation
+    everywhere, clutter patches, roads, buildings, trees and finally vehicles
+    and humans, which gives a class mix close to the real dataset.
+    """
+
+    def __init__(self, height: int, width: int, rng: np.random.Generator) -> None:
+        """Initializes an empty frame.
+
+        Args:
+            height (int): Height of the frame.
+            width (int): Width of the frame.
+            rng (np.random.Generator): Random generator.
+        """
+        self.height, self.width = height, width
+        self.rng = rng
+        self.scale = width / 3840
+
+        self.label = np.full((height, width), CLASS_IDS["low_vegetation"], np.uint8)
+        self.image = np.empty((height, width, 3), np.uint8)
+        self.image[:] = CLASS_APPEARANCE["low_vegetation"]
+
+        self.roads = []
+
+    def size(self, value: float) -> int:
+        """Scales a size given for 4K frames to the frame resolution."""
+        return max(1, int(value * self.scale))
+
+    def point(self) -> np.ndarray:
+        """Draws a random point of the frame."""
+        return np.array([self.rng.integers(self.width), self.rng.integers(self.height)])
+
+    def colour(self, class_name: str) -> tuple:
+        """Jitters the appearance of a class for a single object."""
+        base = np.array(CLASS_APPEARANCE[class_name], dtype=np.int32)
+        colour = np.clip(base + self.rng.integers(-25, 26, size=3), 0, 255)
+        return tuple(int(c) for c in colour)
+
+    def fill_polygon(self, points: np.ndarray, class_name: str) -> None:
+        """Fills a polygon on the label and the image."""
+        points = points.astype(np.int32)
+        cv2.fillPoly(self.label, [points], CLASS_IDS[class_name])
+        cv2.fillPoly(self.image, [points], self.colour(class_name))
+
+    def rotated_rectangle(
+        self, center: np.ndarray, size: tuple, angle: float, class_name: str
+    ) -> None:
+        """Fills a rotated rectangle on the label and the image."""
+        points = cv2.boxPoints(((float(center[0]), float(center[1])), size, angle))
+        self.fill_polygon(points, class_name)
+
+    def paint_clutter(self, count: int) -> None:
+        """Paints irregular clutter patches (yards, parking lots, construction)."""
+        for _ in range(count):
+            center = self.point()
+            radius = self.size(self.rng.uniform(250, 600))
+            angles = np.sort(self.rng.uniform(0, 2 * np.pi, 8))
+            radii = radius * self.rng.uniform(0.5, 1.0, 8)
+            points = center + np.stack(
+                [radii * np.cos(angles), radii * np.sin(angles)], axis=1
+            )
+            self.fill_polygon(points, "background")
+
+    def paint_roads(self, count: int) -> None:
+        """Paints roads as thick polylines crossing the frame."""
+        for _ in range(count):
+            thickness = self.size(self.rng.uniform(150, 300))
+            start = np.array([0, self.rng.integers(self.height)])
+            end = np.array([self.width, self.rng.integers(self.height)])
+            if self.rng.random() < 0.5:
+                start = np.array([self.rng.integers(self.width), 0])
+                end = np.array([self.rng.integers(self.width), self.height])
+
+            middle = (start + end) / 2 + self.rng.normal(0, self.size(300), 2)
+            points = np.array([start, middle, end], dtype=np.int32)
+
+            cv2.polylines(self.label, [points], False, CLASS_IDS["road"], thickness)
+            cv2.polylines(self.image, [points], False, self.colour("road"), thickness)
+            self.roads.append((points, thickness))
+
+    def paint_buildings(self, count: int) -> None:
+        """Paints buildings as rotated rectangles."""
+        for _ in range(count):
+            size = (
+                self.size(self.rng.uniform(200, 600)),
+                self.size(self.rng.uniform(150, 450)),
+            )
+            self.rotated_rectangle(
+                self.point(), size, self.rng.uniform(0, 180), "building"
+            )
+
+    def paint_trees(self, count: int) -> None:
+        """Paints clusters of tree crowns."""
+        for _ in range(count):
+            center = self.point()
+            for _ in range(self.rng.integers(3, 12)):
+                offset = self.rng.normal(0, self.size(120), 2)
+                radius = self.size(self.rng.uniform(40, 110))
+                crown = tuple(int(c) for c in center + offset)
+
+                cv2.circle(self.label, crown, radius, CLASS_IDS["tree"], -1)
+                cv2.circle(self.image, crown, radius, self.colour("tree"), -1)
+
+    def road_point(self) -> tuple:
+        """Draws a random point on a road and the direction of the road."""
+        points, thickness = self.roads[self.rng.integers(len(self.roads))]
+        segment = self.rng.integers(len(points) - 1)
+        t = self.rng.random()
+
+        direction = points[segment + 1] - points[segment]
+        point = points[segment] + t * direction
+        normal = np.array([-direction[1], direction[0]]) / (
+            np.linalg.norm(direction) + 1e-6
+        )
+        angle = np.degrees(np.arctan2(direction[1], direction[0]))
+
+        return point, normal, thickness, angle
+
+    def paint_vehicles(self, moving: int, static: int) -> None:
+        """Paints moving vehicles on roads and static vehicles at road sides."""
+        if not self.roads:
+            return
+
+        vehicle_size = (self.size(90), self.size(40))
+        for _ in range(moving):
+            point, normal, thickness, angle = self.road_point()
+            point = point + normal * self.rng.uniform(-0.3, 0.3) * thickness
+            self.rotated_rectangle(point, vehicle_size, angle, "moving_vehicle")
+
+        for _ in range(static):
+            point, normal, thickness, angle = self.road_point()
+            point = point + normal * self.rng.choice([-1, 1]) * 0.6 * thickness
+            self.rotated_rectangle(point, vehicle_size, angle, "static_vehicle")
+
+    def paint_humans(self, count: int) -> None:
+        """Paints humans as small blobs."""
+        for _ in range(count):
+            center = tuple(int(c) for c in self.point())
+            radius = self.size(12)
+
+            cv2.circle(self.label, center, radius, CLASS_IDS["human"], -1)
+            cv2.circle(self.image, center, radius, self.colour("human"), -1)
+
+    def add_texture(self) -> None:
+        """Adds low-frequency shading and pixel noise, so images compress like photos."""
+        shading = self.rng.normal(0, 12, (8, 8)).astype(np.float32)
+        shading = cv2.resize(
+            shading, (self.width, self.height), interpolation=cv2.INTER_CUBIC
+        )
+
+        image = self.image.astype(np.float32)
+        image += shading[..., None]
+        image += self.rng.normal(0, 6, image.shape).astype(np.float32)
+
+        self.image = np.clip(image, 0, 255).astype(np.uint8)
+
+    def paint(self) -> tuple:
+        """Paints a whole frame.
+
+        Returns:
+            tuple: (image, colour label) as BGR uint8 arrays.
+        """
+        area = self.scale**2
+
+        self.paint_clutter(int(self.rng.integers(10, 16) * area) + 1)
+        self.paint_roads(int(self.rng.integers(3, 6)))
+        self.paint_buildings(int(self.rng.integers(25, 40) * area) + 1)
+        self.paint_trees(int(self.rng.integers(25, 40) * area) + 1)
+        self.paint_vehicles(
+            moving=int(self.rng.integers(30, 60) * area) + 1,
+            static=int(self.rng.integers(30, 60) * area) + 1,
+        )
+        self.paint_humans(int(self.rng.integers(20, 50) * area) + 1)
+        self.add_texture()
+
+        colours = np.array(list(settings.CLASS_ENCODING.values()), dtype=np.uint8)
+        return self.image, colours[self.label]
+
+
+def generate_split(
+    split_path: str,
+    num_sequences: int,
+    num_frames: int,
+    height: int,
+    width: int,
+    seed: int = 0,
+) -> None:
+    """Writes a synthetic split with the seqN/Images and seqN/Labels layout.
+
+    Args:
+        split_path (str): Output directory of the split.
+        num_sequences (int): Number of sequences.
+        num_frames (int): Number of frames in a sequence.
+        height (int): Height of the frames.
+        width (int): Width of the frames.
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+    """
+    if num_frames > 1000:
+        raise ValueError(
+            f"At most 1000 frames per sequence are matched by the splits, got {num_frames}"
+        )
+
+    rng = np.random.default_rng(seed)
+
+    frames = [
+        (sequence, frame)
+        for sequence in range(1, num_sequences + 1)
+        for frame in range(num_frames)
+    ]
+    for sequence, frame in tqdm(frames):
+        image, label = FramePainter(height, width, rng).paint()
+
+        # NOTE: Frame names follow UAVid, e.g. seq1/Images/000001.png, and keep
+        #       the 000 prefix matched by the training split patterns
+        filename = f"{frame:06d}.png"
+        for folder, array in (("Images", image), ("Labels", label)):
+            folder_path = os.path.join(split_path, f"seq{sequence}", folder)
+            os.makedirs(folder_path, exist_ok=True)
+            cv2.imwrite(os.path.join(folder_path, filename), array)
+
+
+if __name__ == "__main__":
+
+    console_logger = get_console_logger("SyntheticLogger")
+
+    args = parse_synthetic_args()
+
+    for i, split in enumerate(args.splits):
+        split_path = os.path.join(args.output, f"uavid_{split}")
+        console_logger.info(
+            f"Writing {args.sequences}x{args.frames} frames of {args.width}x{args.height} "
+            f"to {split_path}"
+        )
+
+        generate_split(
+            split_path,
+            args.sequences,
+            args.frames,
+            args.height,
+            args.width,
+            seed=args.seed + i,
+        )
+
+    console_logger.info("Synthetic dataset generated.")
@@ -121,7 +121,7 @@ if __name__ == "__main__":
 
         export_model_to_onnx(
             model,
-            input_tensor=next(iter(data_module.test_dataloader()))[0],
+            input_tensor=next(iter(data_module.test_dataloader()))[0].float(),
             export_path=onnx_export_path,
             half=half,
         )
@@ -69,7 +69,8 @@ def process_yaml_anchors_recursively(config: dict, value: any) -> any:
                     raise KeyError(
                         f"Key '{key}' not found in the configuration. Check the path: {value}"
                     )
-            return t
+            # NOTE: The referenced value may contain anchors itself
+            return process_yaml_anchors_recursively(config, t)
         else:
             return value
     elif isinstance(value, dict):
@@ -123,6 +124,17 @@ def create_dir_safely(dirpath: str) -> None:
     os.makedirs(dirpath)
 
 
+def get_num_cores() -> int:
+    """Get the number of cores available to the process.
+
+    Returns:
+        int: Number of cores.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
 def get_console_logger(logger_name: str) -> logging.Logger:
     """Initialize a console logger.
 
@@ -262,6 +274,25 @@ def parse_predict_args():
         - model: Path to the model (ckpt or ONNX) (local or remote).
         - imgsz: Image size for prediction.
         - apply_slicing: Apply slicing to the input data.
+        - device: Device of the PyTorch model.
+        - host_postprocess: Stitch and argmax on the host instead of the device.
+        - blending: Weight window of overlapping slices (uniform, linear, gaussian).
+        - stitch_dtype: Accumulation dtype of the stitched logits.
+        - prefetch: Number of frames decoded ahead in the background.
+        - decode_threads: Number of decode threads for folder sources.
+        - output_format: Format of the saved masks (image, png, palette, npy, npz,
+            video, index_video, store).
+        - png_compression: PNG or mask store compression level of the saved masks.
+        - store_chunk_size: Number of masks in a chunk of the mask store.
+        - write_threads: Number of threads writing masks.
+        - write_backlog: Maximum number of masks waiting to be written.
+        - frame_stride: Predict every Nth frame of a video.
+        - target_fps: Predict video frames sampled at this rate.
+        - start_time: Start of the predicted time window of a video in seconds.
+        - end_time: End of the predicted time window of a video in seconds.
+        - video_workers: Number of processes predicting ranges of a video.
+        - tiled: Stream a large image window by window at native resolution.
+        - memory_budget: Memory budget of the tiled prediction in MB.
 
     Returns:
         Namespace: Parsed arguments.
@@ -329,12 +360,391 @@ def parse_predict_args():
         default=0.2,
         help="Intersection ratio for slicing.",
     )
+    parser.add_argument(
+        "--blending",
+        type=str,
+        default="uniform",
+        choices=["uniform", "linear", "gaussian"],
+        help="Weight window of overlapping slices when stitching.",
+    )
+    parser.add_argument(
+        "--stitch_dtype",
+        type=str,
+        default="float32",
+        choices=["float32", "float16"],
+        help="Accumulation dtype of the stitched logits, float16 halves the memory but is slower on CPU.",
+    )
     parser.add_argument(
         "--half",
         action="store_true",
         default=False,
         help="Only for PyTorch Engine! Use half precision for the model.",
     )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default=None,
+        help="Only for PyTorch Engine! Device of the model, defaults to cuda if available.",
+    )
+    parser.add_argument(
+        "--host_postprocess",
+        action="store_true",
+        help="Only for PyTorch Engine! Stitch and argmax on the host instead of the device.",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        help="Number of frames decoded ahead in the background, 0 disables prefetching.",
+    )
+    parser.add_argument(
+        "--decode_threads",
+        type=int,
+        default=1,
+        help="Number of decode threads for folder sources when prefetching.",
+    )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        default="image",
+        choices=[
+            "image",
+            "png",
+            "palette",
+            "npy",
+            "npz",
+            "video",
+            "index_video",
+            "store",
+        ],
+        help="Format of the saved masks, video, index_video and store write a single file per video.",
+    )
+    parser.add_argument(
+        "--png_compression",
+        type=int,
+        default=3,
+        help="PNG or mask store compression level of the saved masks (0-9).",
+    )
+    parser.add_argument(
+        "--store_chunk_size",
+        type=int,
+        default=16,
+        help="Number of masks in a compressed chunk of the mask store.",
+    )
+    parser.add_argument(
+        "--write_threads",
+        type=int,
+        default=2,
+        help="Number of threads writing masks, 0 writes synchronously.",
+    )
+    parser.add_argument(
+        "--write_backlog",
+        type=int,
+        default=8,
+        help="Maximum number of masks waiting to be written.",
+    )
+    parser.add_argument(
+        "--frame_stride",
+        type=int,
+        default=1,
+        help="Only for videos! Predict every Nth frame.",
+    )
+    parser.add_argument(
+        "--target_fps",
+        type=float,
+        default=None,
+        help="Only for videos! Predict frames sampled at this rate.",
+    )
+    parser.add_argument(
+        "--start_time",
+        type=float,
+        default=None,
+        help="Only for videos! Start of the predicted time window in seconds.",
+    )
+    parser.add_argument(
+        "--end_time",
+        type=float,
+        default=None,
+        help="Only for videos! End of the predicted time window in seconds.",
+    )
+    parser.add_argument(
+        "--video_workers",
+        type=int,
+        default=1,
+        help="Number of processes predicting frame ranges of a video in parallel.",
+    )
+    parser.add_argument(
+        "--tiled",
+        action="store_true",
+        help="Stream a large .npy or TIFF image window by window at native resolution.",
+    )
+    parser.add_argument(
+        "--memory_budget",
+        type=float,
+        default=2048,
+        help="Memory budget of the tiled prediction in MB.",
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+# --- Preprocessing utils ---
+
+
+def parse_preprocess_args():
+    """Parse preprocess command line arguments.\n
+    CLI Args:
+        - config: Path to the configuration file.
+        - splits: Data splits to preprocess.
+        - format: Output format, "shards" or "tiles".
+        - shard_size: Soft limit of a shard size in MB.
+        - tile_size: Height and width of a tile in pixels.
+
+    Returns:
+        Namespace: Parsed arguments.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Preprocess the dataset.")
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=settings.CONFIG_PATH,
+        help="Path to the configuration file.",
+    )
+    parser.add_argument(
+        "--splits",
+        type=str,
+        nargs="+",
+        default=["train", "val"],
+        choices=["train", "val"],
+        help="Data splits to preprocess.",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="shards",
+        choices=["shards", "tiles"],
+        help="Output format: uncompressed memory-mapped shards or compressed tiles.",
+    )
+    parser.add_argument(
+        "--shard_size",
+        type=int,
+        default=2048,
+        help="Soft limit of a shard size in MB.",
+    )
+    parser.add_argument(
+        "--tile_size",
+        type=int,
+        default=128,
+        help="Height and width of a tile in pixels.",
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+# --- Synthetic data utils ---
+
+
+def parse_synthetic_args():
+    """Parse synthetic dataset command line arguments.\n
+    CLI Args:
+        - output: Output directory, splits are written to uavid_<split>.
+        - splits: Data splits to generate.
+        - sequences: Number of sequences in a split.
+        - frames: Number of frames in a sequence, at most 1000.
+        - height: Height of the frames.
+        - width: Width of the frames.
+        - seed: Seed of the random generator.
+
+    Returns:
+        Namespace: Parsed arguments.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset.")
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="data/synthetic",
+        help="Output directory, splits are written to uavid_<split>.",
+    )
+    parser.add_argument(
+        "--splits",
+        type=str,
+        nargs="+",
+        default=["train", "val"],
+        choices=["train", "val"],
+        help="Data splits to generate.",
+    )
+    parser.add_argument(
+        "--sequences",
+        type=int,
+        default=2,
+        help="Number of sequences in a split.",
+    )
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=5,
+        help="Number of frames in a sequence, at most 1000.",
+    )
+    parser.add_argument(
+        "--height",
+        type=int,
+        default=2160,
+        help="Height of the frames.",
+    )
+    parser.add_argument(
+        "--width",
+        type=int,
+        default=3840,
+        help="Width of the frames.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the random generator.",
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+# --- Benchmark utils ---
+
+
+def parse_benchmark_args():
+    """Parse benchmark command line arguments.\n
+    CLI Args:
+        - benchmark: Name of the benchmark to run, "label_encoding",
+          "augmentation" or "dataloader".
+
+    Returns:
+        Namespace: Parsed arguments.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a benchmark.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    label_parser = subparsers.add_parser(
+        "label_encoding", help="Compare label encoding implementations."
+    )
+    label_parser.add_argument(
+        "--height",
+        type=int,
+        default=2160,
+        help="Height of the synthetic label.",
+    )
+    label_parser.add_argument(
+        "--width",
+        type=int,
+        default=3840,
+        help="Width of the synthetic label.",
+    )
+    label_parser.add_argument(
+        "--repeats",
+        type=int,
+        default=5,
+        help="Number of measured runs.",
+    )
+
+    augmentation_parser = subparsers.add_parser(
+        "augmentation", help="Compare albumentations with device augmentation."
+    )
+    augmentation_parser.add_argument(
+        "--config",
+        type=str,
+        default=settings.CONFIG_PATH,
+        help="Path to the configuration file.",
+    )
+    augmentation_parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=32,
+        help="Number of samples in a batch.",
+    )
+    augmentation_parser.add_argument(
+        "--repeats",
+        type=int,
+        default=10,
+        help="Number of measured batches.",
+    )
+    augmentation_parser.add_argument(
+        "--device",
+        type=str,
+        default=None,
+        help="Device for the batched augmentation. Defaults to cuda if available.",
+    )
+
+    dataloader_parser = subparsers.add_parser(
+        "dataloader", help="Measure throughput of the data module dataloaders on CPU."
+    )
+    dataloader_parser.add_argument(
+        "--config",
+        type=str,
+        default=settings.CONFIG_PATH,
+        help="Path to the configuration file.",
+    )
+    dataloader_parser.add_argument(
+        "--splits",
+        type=str,
+        nargs="+",
+        default=["train", "val"],
+        choices=["train", "val"],
+        help="Dataloaders to measure.",
+    )
+    dataloader_parser.add_argument(
+        "--batches",
+        type=int,
+        default=50,
+        help="Number of measured batches per run.",
+    )
+    dataloader_parser.add_argument(
+        "--num_workers",
+        type=int,
+        nargs="+",
+        default=[0, 2, 4],
+        help="Numbers of workers to sweep.",
+    )
+    dataloader_parser.add_argument(
+        "--pin_memory",
+        type=str,
+        nargs="+",
+        default=["false", "true"],
+        choices=["false", "true"],
+        help="pin_memory values to sweep, pinning is only swept if CUDA is available.",
+    )
+    dataloader_parser.add_argument(
+        "--cache_backends",
+        type=str,
+        nargs="+",
+        default=["none", "memory", "shared"],
+        choices=["none", "memory", "shared"],
+        help="Cache backends to sweep.",
+    )
+    dataloader_parser.add_argument(
+        "--shared_max_bytes",
+        type=int,
+        default=4 * 1024**3,
+        help="Arena size of the shared cache backend in bytes.",
+    )
+    dataloader_parser.add_argument(
+        "--profile_samples",
+        type=int,
+        default=8,
+        help="Number of samples for the per-stage profile.",
+    )
+    dataloader_parser.add_argument(
+        "--output",
+        type=str,
+        default="benchmark_dataloader.json",
+        help="Path to the JSON results.",
+    )
 
     args = parser.parse_args()
     return args
@@ -0,0 +1,392 @@
+"""Asynchronous writer of predicted masks."""
+
+import io
+import os
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import settings
+from data import PredictionSource
+from storage import MaskStoreWriter
+
+# NOTE: File formats write a file per mask, stream formats a single file per video
+FILE_FORMATS = ("image", "png", "palette", "npy", "npz")
+STREAM_FORMATS = ("video", "index_video", "store")
+OUTPUT_FORMATS = FILE_FORMATS + STREAM_FORMATS
+
+
+def encode_palette_png(mask: np.ndarray, palette: np.ndarray, level: int) -> bytes:
+    """Encodes a mask as a palette-indexed PNG.
+
+    Args:
+        mask (np.ndarray): Class ids of shape (H, W), uint8.
+        palette (np.ndarray): RGB colour of every class of shape (C, 3), uint8.
+        level (int): zlib compression level.
+
+    Returns:
+        bytes: PNG file.
+    """
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (
+            struct.pack(">I", len(data))
+            + kind
+            + data
+            + struct.pack(">I", zlib.crc32(kind + data))
+        )
+
+    height, width = mask.shape
+
+    # NOTE: Every row starts with the filter type byte, 0 is no filter
+    rows = np.zeros((height, width + 1), dtype=np.uint8)
+    rows[:, 1:] = mask
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0))
+        + chunk(b"PLTE", palette.astype(np.uint8).tobytes())
+        + chunk(b"IDAT", zlib.compress(rows.tobytes(), level))
+        + chunk(b"IEND", b"")
+    )
+
+
+class MaskWriter:
+    """Encodes and writes masks on a thread pool with a bounded backlog.
+
+    Formats:
+        - image: Mask scaled to 0-255 in the format of the source filename.
+        - png: Mask scaled to 0-255 as a grayscale PNG.
+        - palette: Class ids as a palette-indexed PNG with the class colours.
+        - npy: Class ids as a raw numpy array.
+        - npz: Class ids as a compressed numpy archive.
+    """
+
+    def __init__(
+        self,
+        dirpath: str,
+        num_classes: int,
+        output_format: str = "image",
+        compression: int = 3,
+        num_threads: int = 2,
+        backlog: int = 8,
+    ) -> None:
+        """Initializes the writer.
+
+        Args:
+            dirpath (str): Output directory for the masks.
+            num_classes (int): Number of classes, used to scale the image masks.
+            output_format (str, optional): One of OUTPUT_FORMATS. Defaults to "image".
+            compression (int, optional): PNG compression level 0-9. Defaults to 3.
+            num_threads (int, optional): Number of writer threads, 0 writes synchronously. Defaults to 2.
+            backlog (int, optional): Maximum number of masks waiting to be written. Defaults to 8.
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {output_format}")
+
+        self.dirpath = dirpath
+        self.num_classes = num_classes
+        self.output_format = output_format
+        self.compression = compression
+
+        # NOTE: CLASS_ENCODING colours are BGR, PNG palettes are RGB
+        self.palette = np.array(list(settings.CLASS_ENCODING.values()), np.uint8)
+        self.palette = self.palette[:, ::-1]
+
+        self._executor = None
+        if num_threads > 0:
+            self._executor = ThreadPoolExecutor(max_workers=num_threads)
+            self._slots = threading.BoundedSemaphore(max(backlog, 1))
+
+        self._lock = threading.Lock()
+        self._error = None
+        self._start = time.perf_counter()
+        self._metrics = {"masks": 0, "bytes": 0, "write_seconds": 0.0}
+
+    def get_path(self, filename: str) -> str:
+        """Gets the output path of a mask, replacing the suffix for numpy formats."""
+        stem, suffix = os.path.splitext(filename)
+        if self.output_format in ("png", "palette"):
+            suffix = ".png"
+        elif self.output_format in ("npy", "npz"):
+            suffix = f".{self.output_format}"
+
+        return os.path.join(self.dirpath, stem + suffix)
+
+    def encode(self, mask: np.ndarray, path: str) -> bytes:
+        """Encodes a mask in the output format.
+
+        Args:
+            mask (np.ndarray): Class ids of shape (H, W).
+            path (str): Output path, its suffix selects the image format.
+
+        Returns:
+            bytes: Encoded file.
+        """
+        if self.output_format in ("image", "png"):
+            image = (mask / self.num_classes * 255).astype(np.uint8)
+            params = [cv2.IMWRITE_PNG_COMPRESSION, self.compression]
+
+            ok, buffer = cv2.imencode(os.path.splitext(path)[1], image, params)
+            if not ok:
+                raise ValueError(f"Failed to encode mask: {path}")
+            return buffer.tobytes()
+        elif self.output_format == "palette":
+            return encode_palette_png(
+                mask.astype(np.uint8), self.palette, self.compression
+            )
+        elif self.output_format == "npy":
+            buffer = io.BytesIO()
+            np.save(buffer, mask.astype(np.uint8))
+            return buffer.getvalue()
+        elif self.output_format == "npz":
+            buffer = io.BytesIO()
+            np.savez_compressed(buffer, mask=mask.astype(np.uint8))
+            return buffer.getvalue()
+        else:
+            raise ValueError(f"Unsupported output format: {self.output_format}")
+
+    def _write(self, mask: np.ndarray, filename: str) -> None:
+        """Encodes and writes a single mask."""
+        start = time.perf_counter()
+        path = self.get_path(filename)
+        data = self.encode(mask, path)
+
+        with open(path, "wb") as f:
+            f.write(data)
+
+        self._record(start, len(data))
+
+    def _record(self, start: float, num_bytes: int) -> None:
+        """Records a written mask."""
+        with self._lock:
+            self._metrics["masks"] += 1
+            self._metrics["bytes"] += num_bytes
+            self._metrics["write_seconds"] += time.perf_counter() - start
+
+    def _done(self, future) -> None:
+        """Releases a backlog slot and keeps the first error."""
+        self._slots.release()
+        if future.exception() is not None and self._error is None:
+            self._error = future.exception()
+
+    def write(self, mask: np.ndarray, filename: str) -> None:
+        """Queues a mask, blocking while the backlog is full.
+
+        Args:
+            mask (np.ndarray): Class ids of shape (H, W).
+            filename (str): Filename of the source frame.
+
+        Raises:
+            Exception: The first error of a previous write.
+        """
+        if self._error is not None:
+            raise self._error
+
+        if self._executor is None:
+            self._write(mask, filename)
+            return
+
+        self._slots.acquire()
+        future = self._executor.submit(self._write, mask, filename)
+        future.add_done_callback(self._done)
+
+    def close(self) -> None:
+        """Waits for the queued masks to be written.
+
+        Raises:
+            Exception: The first error of a write.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+        if self._error is not None:
+            raise self._error
+
+    def get_metrics(self) -> dict:
+        """Gets the write metrics.
+
+        Returns:
+            dict: Number of masks and megabytes written, mean encode and write
+                time of a mask and the throughput since the writer was created.
+        """
+        elapsed = max(time.perf_counter() - self._start, 1e-9)
+        masks = max(self._metrics["masks"], 1)
+        return {
+            "masks": self._metrics["masks"],
+            "megabytes": self._metrics["bytes"] / 1e6,
+            "write_ms": 1000 * self._metrics["write_seconds"] / masks,
+            "masks_per_second": self._metrics["masks"] / elapsed,
+            "megabytes_per_second": self._metrics["bytes"] / 1e6 / elapsed,
+        }
+
+    def __enter__(self) -> "MaskWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class VideoMaskWriter(MaskWriter):
+    """Streams the masks of a video source into a single video file.
+
+    Masks are written by one thread in the order they are queued. The colour
+    video uses the class colours for viewing, the index video stores class ids
+    losslessly with FFV1. Both codecs need even frame sizes, the colour video
+    is padded and odd sizes are rejected for the index video.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        num_classes: int,
+        fps: float,
+        output_format: str = "video",
+        backlog: int = 8,
+    ) -> None:
+        """Initializes the writer, the video is opened with the first mask.
+
+        Args:
+            path (str): Path to the output video.
+            num_classes (int): Number of classes.
+            fps (float): Frame rate of the output video.
+            output_format (str, optional): "video" or "index_video". Defaults to "video".
+            backlog (int, optional): Maximum number of masks waiting to be written. Defaults to 8.
+        """
+        if output_format not in ("video", "index_video"):
+            raise ValueError(f"Unsupported video output format: {output_format}")
+
+        super().__init__(
+            os.path.dirname(path),
+            num_classes,
+            output_format=output_format,
+            num_threads=1,
+            backlog=backlog,
+        )
+        self.path = path
+        self.fps = fps
+
+        # NOTE: VideoWriter expects BGR colours, as in CLASS_ENCODING
+        self.palette = np.array(list(settings.CLASS_ENCODING.values()), np.uint8)
+
+        self._video = None
+
+    def write(self, mask: np.ndarray, filename: str) -> None:
+        """Queues a mask, blocking while the backlog is full.
+
+        Args:
+            mask (np.ndarray): Class ids of shape (H, W).
+            filename (str): Filename of the source frame.
+
+        Raises:
+            ValueError: If the index video mask has an odd height or width.
+            Exception: The first error of a previous write.
+        """
+        height, width = mask.shape
+        if self.output_format == "index_video" and (height % 2 or width % 2):
+            raise ValueError(
+                f"index_video needs even mask sizes, got {width}x{height}, "
+                "FFV1 would crop the last row and column. Use the store format instead."
+            )
+
+        super().write(mask, filename)
+
+    def _write(self, mask: np.ndarray, filename: str) -> None:
+        """Writes a mask as the next frame of the video."""
+        start = time.perf_counter()
+        colour = self.output_format == "video"
+
+        # NOTE: Odd sizes are cropped by the codec, the colour video repeats
+        #       the last row and column instead
+        if colour:
+            mask = np.pad(
+                mask, ((0, mask.shape[0] % 2), (0, mask.shape[1] % 2)), mode="edge"
+            )
+        height, width = mask.shape
+
+        if self._video is None:
+            codec = "mp4v" if colour else "FFV1"
+            self._video = cv2.VideoWriter(
+                self.path,
+                cv2.VideoWriter_fourcc(*codec),
+                self.fps,
+                (width, height),
+                isColor=colour,
+            )
+            if not self._video.isOpened():
+                raise ValueError(f"Cannot open video writer with {codec}: {self.path}")
+
+        mask = mask.astype(np.uint8)
+        self._video.write(self.palette[mask] if colour else mask)
+
+        self._record(start, 0)
+
+    def close(self) -> None:
+        """Waits for the queued masks and finalizes the video."""
+        try:
+            super().close()
+        finally:
+            if self._video is not None:
+                self._video.release()
+                self._video = None
+                self._metrics["bytes"] = os.path.getsize(self.path)
+
+
+class StoreMaskWriter(MaskWriter):
+    """Streams the masks of a video source into a chunked mask store.
+
+    Masks are appended with the index of their frame, which is taken from
+    the filename given by PredictionSource.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        num_classes: int,
+        chunk_size: int = 16,
+        compression: int = 1,
+        backlog: int = 8,
+    ) -> None:
+        """Initializes the writer.
+
+        Args:
+            path (str): Path to the store file.
+            num_classes (int): Number of classes.
+            chunk_size (int, optional): Number of masks in a compressed chunk. Defaults to 16.
+            compression (int, optional): zlib compression level. Defaults to 1.
+            backlog (int, optional): Maximum number of masks waiting to be written. Defaults to 8.
+        """
+        super().__init__(
+            os.path.dirname(path),
+            num_classes,
+            output_format="store",
+            compression=compression,
+            num_threads=1,
+            backlog=backlog,
+        )
+        self.path = path
+
+        self._store = MaskStoreWriter(path, chunk_size=chunk_size, level=compression)
+
+    def _write(self, mask: np.ndarray, filename: str) -> None:
+        """Appends a mask to the store."""
+        start = time.perf_counter()
+        frame_idx = PredictionSource.get_frame_index(filename)
+        self._record(start, self._store.append(frame_idx, mask))
+
+    def close(self) -> None:
+        """Waits for the queued masks and writes the last chunk."""
+        try:
+            super().close()
+        finally:
+            if self._store is not None:
+                written = self._store.close()
+                self._store = None
+                with self._lock:
+                    self._metrics["bytes"] += written